@@ -16,9 +16,14 @@ install_requires = [
     'six >=1.9, <2',
     'timelib >=0.2.4, <0.3',
     'Pillow >=2.7, <3',
-    'mido >=1.1, <2'
+    'mido >=1.1, <2',
 ]
 
+extras_require = {
+    # The 'batch' strategy of schedule-league, and a faster LCG search
+    'league': ['numpy >=1.9, <3'],
+}
+
 if sys.version_info < (3, 4):
     install_requires.append('pathlib >=1.0, <2')
 
@@ -32,6 +37,7 @@ setup(
     author='Student Robotics Competition Software SIG',
     author_email='srobo-devel@googlegroups.com',
     install_requires=install_requires,
+    extras_require=extras_require,
     entry_points={
         'console_scripts': [
             'srcomp = sr.comp.cli.command_line:main'
@@ -43,6 +49,6 @@ setup(
     tests_require=[
         'mock >=1.0.1',
         'nose >=1.3, <2',
-    ],
+    ] + extras_require['league'],
     test_suite='nose.collector'
 )
@@ -0,0 +1,95 @@
+from __future__ import print_function
+
+__description__ = 'Benchmark the league scheduler over a matrix of settings.'
+
+
+def int_list(value):
+    return tuple(int(item) for item in value.split(','))
+
+
+def bool_list(value):
+    choices = {'on': True, 'off': False}
+    return tuple(choices[item] for item in value.split(','))
+
+
+def str_list(value):
+    return tuple(value.split(','))
+
+
+def command(args):
+    import json
+    import sys
+
+    from sr.comp.cli.league_benchmark import (DEFAULT_MATRIX, case_name, cases,
+                                              compare, run_case_with_timeout)
+
+    matrix = dict(DEFAULT_MATRIX)
+    for key in matrix:
+        value = getattr(args, key)
+        if value is not None:
+            matrix[key] = value
+
+    if args.output is None:
+        output = sys.stdout
+    else:
+        output = open(args.output, 'w')
+
+    results = []
+    try:
+        for case in cases(matrix):
+            print('Running', case_name(case), file=sys.stderr)
+            result = run_case_with_timeout(case, args.rounds, args.timeout)
+            print('  {0} in {1}s'.format(result['status'], result['time']),
+                  file=sys.stderr)
+            results.append(result)
+            output.write(json.dumps(result, sort_keys=True) + '\n')
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = [json.loads(line) for line in f if line.strip()]
+        for result, ratio in compare(baseline, results):
+            if ratio is None:
+                summary = 'not comparable'
+            else:
+                summary = '{0:.2f}x the baseline time'.format(ratio)
+            print(case_name(result) + ':', summary, file=sys.stderr)
+
+
+def add_subparser(subparsers):
+    parser = subparsers.add_parser('benchmark-league', help=__description__,
+                                   description=__description__)
+    parser.add_argument('--teams', type=int_list,
+                        help='comma-separated numbers of teams')
+    parser.add_argument('--arenas', type=int_list,
+                        help='comma-separated numbers of arenas')
+    parser.add_argument('--separation', type=int_list,
+                        help='comma-separated spacings between appearances')
+    parser.add_argument('--max-matchups', type=int_list,
+                        help='comma-separated maximum repeated matchups')
+    parser.add_argument('--appearances-per-round', type=int_list,
+                        help='comma-separated appearances per round')
+    parser.add_argument('--lcg', type=bool_list,
+                        help='comma-separated LCG settings, "on" or "off"')
+    parser.add_argument('--construct', type=bool_list,
+                        help='comma-separated settings for trying direct '
+                             'constructions first, "on" or "off"')
+    parser.add_argument('--strategy', type=str_list,
+                        help='comma-separated search strategies')
+    parser.add_argument('--seed', type=int_list,
+                        help='comma-separated random seeds')
+    parser.add_argument('--rounds', type=int, default=4,
+                        help='number of rounds to schedule in each case '
+                             '(default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='seconds after which a case is abandoned '
+                             '(default: %(default)s)')
+    parser.add_argument('-o', '--output',
+                        help='file to write the results to, as JSON lines '
+                             '(default: stdout)')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='results of an earlier run to compare against')
+    parser.set_defaults(func=command)
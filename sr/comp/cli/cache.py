@@ -0,0 +1,68 @@
+"""
+A small on-disk cache for results which are expensive to compute but
+depend only on a few parameters.
+
+Each named cache is a JSON file in the user's cache directory, mapping
+JSON-encoded keys to values. The cache is only ever an optimisation: if
+it can't be read or written, values are simply computed afresh.
+"""
+
+import json
+import os
+
+
+def cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),
+                                                           '.cache')
+    return os.path.join(base, 'srcomp')
+
+
+def cache_path(name):
+    return os.path.join(cache_dir(), name + '.json')
+
+
+def _load(name):
+    try:
+        with open(cache_path(name)) as f:
+            entries = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if not isinstance(entries, dict):
+        return {}
+    return entries
+
+
+def _store(name, entries):
+    path = cache_path(name)
+    temporary = '{0}.{1}.tmp'.format(path, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(temporary, 'w') as f:
+            json.dump(entries, f, sort_keys=True)
+        try:
+            replace = os.replace
+        except AttributeError:
+            replace = os.rename
+        replace(temporary, path)
+    except (IOError, OSError):
+        pass
+
+
+def cached(name, key, compute):
+    """
+    Look up ``key`` (anything which can be encoded as JSON) in the named
+    cache, calling ``compute`` and storing its result if it's not there.
+    Values come back as they were decoded from JSON, so tuples come back
+    as lists.
+    """
+    encoded_key = json.dumps(key, sort_keys=True)
+    entries = _load(name)
+    if encoded_key in entries:
+        return entries[encoded_key]
+    value = compute()
+    # Re-read, in case another process has added to the cache meanwhile
+    entries = _load(name)
+    entries[encoded_key] = value
+    _store(name, entries)
+    return value
@@ -7,6 +7,7 @@ import sys
 
 from . import add_delay
 from . import awards
+from . import benchmark_league
 from . import delay
 from . import deploy
 from . import import_schedule
@@ -17,6 +18,7 @@ from . import list_midi_ports
 from . import match_order_teams
 from . import print_schedule
 from . import schedule_league
+from . import schedule_worker
 from . import scorer
 from . import shift_matches
 from . import show_schedule
@@ -47,6 +49,7 @@ def argument_parser():
 
     add_delay.add_subparser(subparsers)
     awards.add_subparser(subparsers)
+    benchmark_league.add_subparser(subparsers)
     delay.add_subparser(subparsers)
     deploy.add_subparser(subparsers)
     import_schedule.add_subparser(subparsers)
@@ -57,6 +60,7 @@ def argument_parser():
     match_order_teams.add_subparser(subparsers)
     print_schedule.add_subparser(subparsers)
     schedule_league.add_subparser(subparsers)
+    schedule_worker.add_subparser(subparsers)
     scorer.add_subparser(subparsers)
     shift_matches.add_subparser(subparsers)
     show_schedule.add_subparser(subparsers)
@@ -1,5 +1,6 @@
 from __future__ import print_function
 
+import threading
 from contextlib import contextmanager
 
 
@@ -12,6 +13,21 @@ OKBLUE = '\033[94m'
 ENDC = '\033[0m'
 
 
+# Stands in for a host state which hasn't been fetched yet
+NOT_PROBED = object()
+
+# Held while using the terminal, so that prompts and the output of hosts
+# being deployed to in parallel don't get mixed up
+TERMINAL_LOCK = threading.RLock()
+
+# Held while fetching into the local compstate repo, which git doesn't
+# like having done from several hosts at once
+COMPSTATE_LOCK = threading.Lock()
+
+# Per-thread buffer of output while deploying in parallel
+_output = threading.local()
+
+
 # Cope with Python 3 renaming raw_input
 try:
     input = raw_input
@@ -52,6 +68,84 @@ def print_buffer(buf):
     print(prefix + prefix.join(buf.readlines()).strip())
 
 
+class ThreadBufferedStdout(object):
+    """
+    Stand-in for stdout which sends the output of any thread which has a
+    buffer set up to that buffer rather than straight to the terminal.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        buf = getattr(_output, 'buffer', None)
+        if buf is None:
+            self.stream.write(text)
+        else:
+            buf.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+@contextmanager
+def buffered_output():
+    """Allow threads to buffer their output while in this context."""
+    import sys
+
+    stdout = sys.stdout
+    sys.stdout = ThreadBufferedStdout(stdout)
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+
+
+def release_output():
+    """Print and clear anything the current thread has buffered."""
+    import sys
+
+    buf = getattr(_output, 'buffer', None)
+    if buf is None:
+        return
+    _output.buffer = None
+    with TERMINAL_LOCK:
+        sys.stdout.write(buf.getvalue())
+        sys.stdout.flush()
+
+
+@contextmanager
+def host_output():
+    """
+    Buffer the current thread's output, printing it all at once at the
+    end so that it isn't interleaved with other hosts'.
+    """
+    from six import StringIO
+
+    _output.buffer = StringIO()
+    try:
+        yield
+    finally:
+        release_output()
+
+
+@contextmanager
+def unbuffered_output():
+    """
+    Print what the current thread has buffered so far and stop buffering
+    for the duration, so that prompts are seen with their context.
+    """
+    from six import StringIO
+
+    buffering = getattr(_output, 'buffer', None) is not None
+    release_output()
+    try:
+        yield
+    finally:
+        if buffering:
+            _output.buffer = StringIO()
+
+
 def get_input(prompt):
     # Wrapper to simplify mocking
     return input(prompt)
@@ -67,16 +161,17 @@ def query(question, options, default=None):
 
     query = format_fail("{0} [{1}]: ".format(question.rstrip(), opts))
 
-    while True:
-        # Loop until we get a suitable response from the user
-        resp = get_input(query).lower()
+    with TERMINAL_LOCK, unbuffered_output():
+        while True:
+            # Loop until we get a suitable response from the user
+            resp = get_input(query).lower()
 
-        if resp in options:
-            return resp
+            if resp in options:
+                return resp
 
-        # If there's a default value, use that
-        if default:
-            return default
+            # If there's a default value, use that
+            if default:
+                return default
 
 
 def query_bool(question, default_val = None):
@@ -101,35 +196,59 @@ def ref_compstate(host):
     return url
 
 
-def deploy_to(compstate, host, revision, verbose):
+def deploy_branch(revision):
+    return "refs/heads/deploy-{0}".format(revision)
+
+
+def deploy_revspec(revision):
+    """
+    The revspec for pushing a revision to a new branch for it, so that
+    it's visible to anything which fetches the repo; using the revision id
+    in the branch name avoids race conditions without needing to come up
+    with our own unique identifier.
+    This also means we don't need to worry about whether or not the
+    revision exists in the target, since a push will simply no-op if it's
+    already present.
+    """
+    return "{0}:{1}".format(revision, deploy_branch(revision))
+
+
+def deploy_to(compstate, host, revision, verbose, connections=None,
+              push=True):
+    """
+    Push the revision to the host, unless it's been got there already, and
+    update it, using the given ``SSHConnections`` (or ones just for this)
+    for both.
+    """
+    from sr.comp.cli.ssh_connections import SSHConnections
+
+    if connections is None:
+        with SSHConnections() as connections, connections.git_over_ssh([host]):
+            return deploy_to(compstate, host, revision, verbose, connections,
+                             push)
+
     print(BOLD + "Deploying to {0}:".format(host) + ENDC)
 
     # Make connection early to check if host is up.
-    with ssh_connection(host) as client:
-        # Push the repo
+    client = connections.client(host)
+
+    if push:
+        # Push the repo, over the same connection
         url = ref_compstate(host)
-        # Make a new branch for this revision so that it's visible to
-        # anything which fetches the repo; use the revision id in the
-        # branch name to avoid race conditions without needing to come
-        # up with our own unique identifier.
-        # This also means we don't need to worry about whether or not the
-        # revision exists in the target, since this push will simply no-op
-        # if it's already present
-        revspec = "{0}:refs/heads/deploy-{0}".format(revision)
         with exit_on_exception(kind=RuntimeError):
-            compstate.push(url, revspec,
+            compstate.push(url, deploy_revspec(revision),
                            err_msg="Failed to push to {0}.".format(host))
 
-        cmd = "./update '{0}'".format(revision)
-        _, stdout, stderr = client.exec_command(cmd)
-        retcode = stdout.channel.recv_exit_status()
+    cmd = "./update '{0}'".format(revision)
+    _, stdout, stderr = client.exec_command(cmd)
+    retcode = stdout.channel.recv_exit_status()
 
-        if verbose or retcode != 0:
-            print_buffer(stdout)
+    if verbose or retcode != 0:
+        print_buffer(stdout)
 
-        print_buffer(stderr)
+    print_buffer(stderr)
 
-        return retcode
+    return retcode
 
 
 def get_deployments(compstate):
@@ -137,35 +256,90 @@ def get_deployments(compstate):
         return compstate.deployments
 
 
+def fetch_state(session, host):
+    """
+    Get the revision of the state a host's API is serving, using the given
+    ``requests`` session (or the module itself); raises on failure.
+    """
+    url = "http://{0}/comp-api/state".format(host)
+    response = session.get(url, timeout=API_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    return response.json()['state']
+
+
 def get_current_state(host):
-    import simplejson as json
-    from six.moves.urllib.request import urlopen
+    import requests
 
-    url = "http://{0}/comp-api/state".format(host)
     try:
-        page = urlopen(url, timeout=API_TIMEOUT_SECONDS)
-        raw_state = json.load(page)
+        return fetch_state(requests, host)
     except Exception as e:
         print(e)
         return None
-    else:
-        return raw_state['state']
 
 
-def check_host_state(compstate, host, revision, verbose):
+def probe_host_states(hosts, verbose, session=None):
+    """
+    Get the states of all the hosts at once, through a shared pool of
+    keep-alive connections, so that an unreachable host only costs the
+    timeout once rather than adding to every other probe. Returns a dict
+    of the states by host, with None for hosts which couldn't be reached.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    if not hosts:
+        return {}
+
+    if verbose:
+        print("Checking host states for {0} (timeout {1} seconds)."
+              .format(', '.join(hosts), API_TIMEOUT_SECONDS))
+
+    own_session = session is None
+    if own_session:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        session.mount('http://', HTTPAdapter(pool_connections=len(hosts)))
+
+    def probe(host):
+        try:
+            return fetch_state(session, host), None
+        except Exception as e:
+            return None, e
+
+    pool = ThreadPool(len(hosts))
+    try:
+        results = pool.map(probe, hosts)
+    finally:
+        pool.close()
+        pool.join()
+        if own_session:
+            session.close()
+
+    states = {}
+    for host, (state, error) in zip(hosts, results):
+        if error is not None:
+            print("Failed to get state for {0}: {1}".format(host, error))
+        states[host] = state
+    return states
+
+
+def check_host_state(compstate, host, revision, verbose, state=NOT_PROBED):
     """
     Compares the host state to the revision we want to deploy. If the
     host's state isn't in the history of the deploy revision then various
-    options are presented to the user.
+    options are presented to the user. The host's state is fetched unless
+    it's passed in, as from ``probe_host_states``.
 
     Returrns whether or not to skip deploying to the host.
     """
     SKIP = True
     UPDATE = False
-    if verbose:
-        print("Checking host state for {0} (timeout {1} seconds)."
-              .format(host, API_TIMEOUT_SECONDS))
-    state = get_current_state(host)
+    if state is NOT_PROBED:
+        if verbose:
+            print("Checking host state for {0} (timeout {1} seconds)."
+                  .format(host, API_TIMEOUT_SECONDS))
+        state = get_current_state(host)
     if not state:
         tpl = "Failed to get state for {0}, cannot advise about history." \
               " Deploy anyway?"
@@ -187,8 +361,9 @@ def check_host_state(compstate, host, revision, verbose):
     if not compstate.has_commit(state):
         tpl = "Host {0} has unknown state '{1}'. Try to fetch it?"
         if query_bool(tpl.format(host, state), True):
-            compstate.fetch('origin', quiet=True)
-            compstate.fetch(ref_compstate(host), quiet=True)
+            with COMPSTATE_LOCK:
+                compstate.fetch('origin', quiet=True)
+                compstate.fetch(ref_compstate(host), quiet=True)
 
     # Old revision:
     if compstate.has_descendant(state):
@@ -233,22 +408,144 @@ def require_valid(compstate):
         query_warn("State has validation errors (see above)")
 
 
-def run_deployments(args, compstate, hosts):
-    revision = compstate.rev_parse('HEAD')
-    for host in hosts:
-        if not args.skip_host_check:
-            skip_host = check_host_state(compstate, host, revision,
-                                         args.verbose)
-            if skip_host:
-                print(BOLD + "Skipping {0}.".format(host) + ENDC)
-                continue
+def deploy_host(args, compstate, host, revision, state=NOT_PROBED,
+                connections=None):
+    """
+    Check a host's state, if wanted, and deploy to it; returns the exit
+    status of the update, which is zero if the host was skipped.
+    """
+    if not args.skip_host_check:
+        skip_host = check_host_state(compstate, host, revision, args.verbose,
+                                     state)
+        if skip_host:
+            print(BOLD + "Skipping {0}.".format(host) + ENDC)
+            return 0
+
+    return deploy_to(compstate, host, revision, args.verbose, connections)
+
+
+def deploy_host_buffered(deploy, host):
+    """
+    Deploy to a host from a worker thread, buffering its output and
+    turning any failure into an exit status rather than letting it end
+    the thread.
+    """
+    with host_output():
+        try:
+            return deploy(host)
+        except SystemExit as e:
+            return e.code or 1
+        except Exception as e:
+            print_fail("Error deploying to {0}: {1}".format(host, e))
+            return 1
 
-        retcode = deploy_to(compstate, host, revision, args.verbose)
+
+def run_parallel_deployments(args, hosts, deploy):
+    """
+    Deploy to up to ``args.parallel`` hosts at once, then report every
+    host which failed; returns the exit status of the first of those.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(max(min(args.parallel, len(hosts)), 1))
+    with buffered_output():
+        try:
+            retcodes = pool.map(lambda host: deploy_host_buffered(deploy, host),
+                                hosts)
+        finally:
+            pool.close()
+            pool.join()
+
+    failed = [(host, retcode) for host, retcode in zip(hosts, retcodes)
+              if retcode != 0]
+    for host, retcode in failed:
+        print_fail("Failed to deploy to '{0}' (exit status: {1})."
+                   .format(host, retcode))
+    return failed[0][1] if failed else 0
+
+
+def run_serial_deployments(hosts, deploy):
+    """
+    Deploy to each host in turn, stopping at the first failure; returns
+    its exit status.
+    """
+    for host in hosts:
+        retcode = deploy(host)
         if retcode != 0:
             # TODO: work out if it makes sense to try to rollback here?
             print_fail("Failed to deploy to '{0}' (exit status: {1})."
                        .format(host, retcode))
-            exit(retcode)
+            return retcode
+    return 0
+
+
+def distributing_deploy(args, compstate, hosts, revision, states,
+                        connections):
+    """
+    Check all the hosts, then get the revision to those being deployed to
+    by pushing it to the nearest and having the hosts pass it on between
+    themselves; returns the hosts to update and a function which updates
+    one of them.
+    """
+    from sr.comp.cli.deploy_distribution import SSHRunner, distribute
+
+    targets = []
+    for host in hosts:
+        if not args.skip_host_check:
+            if check_host_state(compstate, host, revision, args.verbose,
+                                states[host]):
+                print(BOLD + "Skipping {0}.".format(host) + ENDC)
+                continue
+        targets.append(host)
+
+    failed = {}
+    if targets:
+        failed = distribute(SSHRunner(connections), compstate, targets,
+                            revision, args.fan_out)
+
+    def deploy(host):
+        if host in failed:
+            print_fail("Failed to get revision to {0}: {1}"
+                       .format(host, failed[host]))
+            return 1
+        return deploy_to(compstate, host, revision, args.verbose,
+                         connections, push=False)
+
+    return targets, deploy
+
+
+def run_deployments(args, compstate, hosts):
+    from sr.comp.cli.ssh_connections import SSHConnections
+
+    revision = compstate.rev_parse('HEAD')
+
+    # Find out where all the hosts are up front, so that a host being down
+    # costs the timeout once and the prompts about them come together
+    if args.skip_host_check:
+        states = dict((host, NOT_PROBED) for host in hosts)
+    else:
+        states = probe_host_states(hosts, args.verbose)
+
+    # Keep one connection to each host for pushing and updating
+    with SSHConnections() as connections, connections.git_over_ssh(hosts):
+        if args.fan_out:
+            targets, deploy = distributing_deploy(args, compstate, hosts,
+                                                  revision, states,
+                                                  connections)
+        else:
+            targets = hosts
+
+            def deploy(host):
+                return deploy_host(args, compstate, host, revision,
+                                   states[host], connections)
+
+        if args.parallel > 1:
+            retcode = run_parallel_deployments(args, targets, deploy)
+        else:
+            retcode = run_serial_deployments(targets, deploy)
+
+    if retcode != 0:
+        exit(retcode)
 
     print(BOLD + OKBLUE + "Done" + ENDC)
 
@@ -265,10 +562,28 @@ def command(args):
     run_deployments(args, compstate, hosts)
 
 
+def positive_int(value):
+    import argparse
+
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1")
+    return number
+
+
 def add_options(parser):
     parser.add_argument('--verbose', action='store_true')
     parser.add_argument('--skip-host-check', action='store_true',
                         help='skips checking the current state of the hosts')
+    parser.add_argument('--fan-out', type=positive_int, metavar='N',
+                        help='push only to the nearest host, then have each '
+                             'host which has the revision pass it on to up to '
+                             'N others, rather than pushing to every host '
+                             'from here')
+    parser.add_argument('--parallel', type=int, default=1, metavar='N',
+                        help='deploy to up to N hosts at once; prompts are '
+                             'asked one at a time and each host\'s output is '
+                             'printed when it finishes (default: %(default)s)')
 
 
 def add_subparser(subparsers):
@@ -0,0 +1,161 @@
+"""
+Distribution of a compstate revision between the hosts being deployed to.
+
+Rather than pushing the same objects from here to every host, the
+revision is pushed once, to the host with the lowest latency, and then
+passed on in a tree: in each step, every host which has the revision has
+up to ``fan_out`` of those still waiting fetch it from them, all at once.
+Any host which can't fetch it from another has it pushed from here instead.
+Hosts are reached through a runner, which knows how to run commands on
+each host and the URL of its compstate repo as the other hosts see it.
+"""
+
+from __future__ import print_function
+
+import time
+
+from sr.comp.cli.deploy import (BOLD, ENDC, deploy_branch, deploy_revspec,
+                                format_fail, ref_compstate)
+
+
+class SSHRunner(object):
+    """Runs commands on the hosts over their shared SSH connections."""
+
+    git_dir = 'compstate.git'
+
+    def __init__(self, connections):
+        self.connections = connections
+
+    def url(self, host):
+        return ref_compstate(host)
+
+    def run(self, host, command):
+        """Run a command on a host; returns its exit status and output."""
+        client = self.connections.client(host)
+        _, stdout, stderr = client.exec_command(command)
+        retcode = stdout.channel.recv_exit_status()
+        output = stdout.read() + stderr.read()
+        return retcode, output.decode('utf-8', 'replace')
+
+    def latency(self, host):
+        """The round trip time to run a trivial command on a host."""
+        self.connections.client(host)
+        start = time.time()
+        self.run(host, 'true')
+        return time.time() - start
+
+
+def fetch_command(git_dir, url, revision):
+    from six.moves import shlex_quote
+
+    branch = deploy_branch(revision)
+    return 'git --git-dir={0} fetch --quiet {1} +{2}:{2}'.format(
+        shlex_quote(git_dir), shlex_quote(url), branch)
+
+
+def fan_out_steps(sources, waiting, fan_out):
+    """
+    Pair up to ``fan_out`` of the waiting hosts with each source, taking
+    the waiting hosts in order; returns a list of ``(source, host)``.
+    """
+    pairs = []
+    waiting = list(waiting)
+    for source in sources:
+        for n in range(fan_out):
+            if not waiting:
+                return pairs
+            pairs.append((source, waiting.pop(0)))
+    return pairs
+
+
+def _in_parallel(function, items):
+    from multiprocessing.pool import ThreadPool
+
+    if not items:
+        return []
+    pool = ThreadPool(len(items))
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def distribute(runner, compstate, hosts, revision, fan_out):
+    """
+    Get the revision to all the hosts, pushing it from here only to the
+    one with the lowest latency. Returns a dict of the hosts which didn't
+    get it, with why.
+    """
+    if fan_out < 1:
+        raise ValueError("Each host must pass the revision on to at least "
+                         "one other (fan out of {0})".format(fan_out))
+
+    failed = {}
+
+    def measure(host):
+        try:
+            return runner.latency(host), None
+        except Exception as e:
+            return None, e
+
+    latencies = {}
+    for host, (latency, error) in zip(hosts, _in_parallel(measure, hosts)):
+        if error is None:
+            latencies[host] = latency
+        else:
+            failed[host] = 'unreachable ({0})'.format(error)
+
+    order = sorted(latencies, key=lambda host: (latencies[host],
+                                                hosts.index(host)))
+    if not order:
+        return failed
+
+    seed = order[0]
+    print(BOLD + "Pushing to {0} ({1:.0f}ms away):".format(
+        seed, latencies[seed] * 1000) + ENDC)
+    try:
+        compstate.push(runner.url(seed), deploy_revspec(revision),
+                       err_msg="Failed to push to {0}.".format(seed))
+    except RuntimeError as e:
+        for host in order:
+            failed[host] = 'push to {0} failed ({1})'.format(seed, e)
+        return failed
+
+    def fetch(pair):
+        source, host = pair
+        command = fetch_command(runner.git_dir, runner.url(source), revision)
+        try:
+            return runner.run(host, command)
+        except Exception as e:
+            return None, str(e)
+
+    have = [seed]
+    waiting = order[1:]
+    unfetched = []
+    while waiting:
+        pairs = fan_out_steps(have, waiting, fan_out)
+        for source, host in pairs:
+            print("Passing revision from {0} to {1}.".format(source, host))
+        for (source, host), (retcode, output) in zip(pairs,
+                                                     _in_parallel(fetch, pairs)):
+            waiting.remove(host)
+            if retcode == 0:
+                have.append(host)
+            else:
+                print(format_fail("Failed to fetch from {0} to {1}:"
+                                  .format(source, host)), output.strip())
+                unfetched.append((source, host))
+
+    # The hosts may well not be able to reach each other (which needs keys
+    # for each other's deploy user), so push to any which couldn't fetch
+    for source, host in unfetched:
+        print(BOLD + "Pushing to {0} instead:".format(host) + ENDC)
+        try:
+            compstate.push(runner.url(host), deploy_revspec(revision),
+                           err_msg="Failed to push to {0}.".format(host))
+        except RuntimeError as e:
+            failed[host] = 'fetch from {0} and push failed ({1})'.format(
+                source, e)
+
+    return failed
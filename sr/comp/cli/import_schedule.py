@@ -4,6 +4,17 @@ import argparse
 
 TEAMS_PER_GAME = 4
 
+# Games with at least this many empty places are bad
+BAD_EMPTY_PLACES = TEAMS_PER_GAME - 2
+
+# Number of branches the search for which surplus ids to leave out may
+# explore before settling for the best it's found
+MAX_SEARCH_NODES = 200000
+
+# Number of times the local search for a starting point for that search is
+# restarted
+LOCAL_SEARCH_RESTARTS = 50
+
 def tidy(lines):
     "Strip comments and trailing whitespace"
     schedule = []
@@ -85,57 +96,6 @@ def ignore_ids(ids, ids_to_remove):
     for i in ids_to_remove:
         ids.remove(i)
 
-def get_id_subsets(ids, limit):
-    num_ids = len(ids)
-
-    extra = num_ids - limit
-
-    if extra == 0:
-        # Only one posibility -- use all of them
-        yield ids
-
-    elif extra == 1:
-        for idx in range(len(ids)):
-            ids_clone = ids[:]
-            ids_clone.pop(idx)
-            yield ids_clone
-
-    elif extra == 2:
-        for idx1 in range(len(ids)):
-            for idx2 in range(idx1+1, len(ids)):
-                ids_clone = ids[:]
-                ids_clone.pop(idx2)
-                ids_clone.pop(idx1)
-                yield ids_clone
-
-    elif extra == 3:
-        for idx1 in range(len(ids)):
-            for idx2 in range(idx1+1, len(ids)):
-                for idx3 in range(idx2+1, len(ids)):
-                    ids_clone = ids[:]
-                    ids_clone.pop(idx3)
-                    ids_clone.pop(idx2)
-                    ids_clone.pop(idx1)
-                    yield ids_clone
-
-    else:
-        # TODO: consider generalising the above or adding more handling
-        raise Exception("Too many empty slots to compensate for ({0}).".format(extra))
-
-def build_id_team_maps(ids, team_ids):
-    # If there are more ids than team_ids we want to ensure that we minimize
-    # the number of matches which have empty places and also the number of
-    # empty places in any given match.
-    # This function generates possible mappings of ids to teams as needed
-    # in order to explore excluding different ids.
-    #
-    # Note: this function does _not_ explore mapping the same subset of
-    # ids to the given teams since that doesn't achieve any changes in
-    # which matches have empty spaces.
-
-    for id_subset in get_id_subsets(ids, len(team_ids)):
-        yield dict(zip(id_subset, team_ids))
-
 def build_matches(id_team_map, schedule, arena_ids):
     from collections import namedtuple
     BadMatch = namedtuple('BadMatch', ['arena', 'num', 'num_teams'])
@@ -163,43 +123,297 @@ def build_matches(id_team_map, schedule, arena_ids):
 
     return matches, bad_matches
 
-def are_better_matches(best, new):
-    from collections import Counter
-    def get_empty_places_map(bad_matches):
-        empty_places_map = Counter()
-        for bad_match in bad_matches:
-            num_empty = TEAMS_PER_GAME - bad_match.num_teams
-            empty_places_map[num_empty] += 1
-        return empty_places_map
+def empty_places_key(empty_places_map):
+    """
+    A sort key for the counts of games with each number of empty places,
+    lower being better: fewest games with the most empty places first,
+    since even single matches with lots of empty places are bad.
+    """
+    return tuple(empty_places_map[num_empty]
+                 for num_empty in range(TEAMS_PER_GAME, BAD_EMPTY_PLACES - 1, -1))
 
-    best_map = get_empty_places_map(best)
-    new_map  = get_empty_places_map(new)
 
-    possible_empty_places = set(list(best_map.keys()) + list(new_map.keys()))
+class RemovalSearch(object):
+    """
+    Branch and bound search for which surplus ids to leave empty.
+
+    Each id's games are found up front, and the number of empty places in
+    each game and the counts of games with each number of empty places are
+    updated as ids are removed, rather than rebuilding the matches for
+    every candidate. Removing an id only ever moves games to more empty
+    places, which makes the empty places key worse, and by at least as much
+    as the removal would have by itself. So the key so far plus the
+    smallest increases the remaining candidate ids would make by themselves
+    is a lower bound on the key of any completion, and branches whose bound
+    can't beat the best removal so far are pruned.
+
+    Of the equally good removals, the one whose sorted removed indices
+    come first lexicographically is chosen (so the earliest ids are left
+    out first), and the result doesn't depend on the order the search
+    happens to find them in. The search gives up after ``max_nodes``
+    branches, keeping the best removal found by then.
+    """
 
-    # Even single matches with lots of empty slots are bad
-    for num_empty_places in sorted(possible_empty_places, reverse=True):
-        if new_map[num_empty_places] < best_map[num_empty_places]:
+    def __init__(self, ids, num_teams, schedule, max_nodes=MAX_SEARCH_NODES):
+        self.ids = ids
+        self.extra = len(ids) - num_teams
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.exhausted = False
+        id_indices = dict((id_, idx) for idx, id_ in enumerate(ids))
+        self.memberships = [[] for id_ in ids]
+        self.empty_places = []
+        for match_ids in schedule:
+            for game_ids in chunks_of_size(match_ids, TEAMS_PER_GAME):
+                game = len(self.empty_places)
+                members = [id_indices[id_] for id_ in game_ids
+                           if id_ in id_indices]
+                # Ignored ids are never given a team
+                self.empty_places.append(len(game_ids) - len(members))
+                for idx in members:
+                    self.memberships[idx].append(game)
+        self.empty_places_map = [0] * (TEAMS_PER_GAME + 1)
+        for num_empty in self.empty_places:
+            self.empty_places_map[num_empty] += 1
+        self.best = None
+
+    def _key(self):
+        return empty_places_key(self.empty_places_map)
+
+    def _increase(self, idx):
+        """The change to the key from removing the given id now."""
+        change = [0] * (TEAMS_PER_GAME + 1)
+        for game in self.memberships[idx]:
+            num_empty = self.empty_places[game]
+            change[num_empty] -= 1
+            change[num_empty + 1] += 1
+        return empty_places_key(change)
+
+    def _remove(self, idx, change=1):
+        for game in self.memberships[idx]:
+            num_empty = self.empty_places[game]
+            self.empty_places_map[num_empty] -= 1
+            self.empty_places_map[num_empty + change] += 1
+            self.empty_places[game] = num_empty + change
+
+    def _bound(self, start, remaining):
+        key = self._key()
+        increases = sorted(self._increase(idx)
+                           for idx in range(start, len(self.ids)))
+        return tuple(sum(values) for values in zip(key, *increases[:remaining]))
+
+    def _offer(self, removed):
+        candidate = (self._key(), tuple(sorted(removed)))
+        if self.best is None or candidate < self.best:
+            self.best = candidate
             return True
+        return False
+
+    def _descend(self, removed):
+        """
+        Repeatedly make whichever swap of a removed id for another most
+        improves the key, until none do.
+        """
+        while True:
+            key = self._key()
+            best = None
+            for n, out in enumerate(removed):
+                self._remove(out, -1)
+                for idx in range(len(self.ids)):
+                    if idx in removed:
+                        continue
+                    self._remove(idx)
+                    if self._key() < key and (best is None or self._key() < best[0]):
+                        best = (self._key(), n, idx)
+                    self._remove(idx, -1)
+                self._remove(out)
+            if best is None:
+                return
+            key, n, idx = best
+            self._remove(removed[n], -1)
+            self._remove(idx)
+            removed[n] = idx
+
+    def _initial(self):
+        """
+        Quickly find a good removal to start pruning against: remove the
+        ids one at a time, each time the one which makes least difference,
+        then improve that by local search, restarting a few times from
+        random changes to the best so far.
+        """
+        import random
+
+        removed = []
+        for n in range(self.extra):
+            idx = min((self._increase(idx), idx)
+                      for idx in range(len(self.ids)) if idx not in removed)[1]
+            self._remove(idx)
+            removed.append(idx)
+        if not removed:
+            self._offer(removed)
+            return
+        # Seeded so that the result is always the same
+        rng = random.Random(0)
+        for attempt in range(LOCAL_SEARCH_RESTARTS + 1):
+            if attempt:
+                for n in range(2):
+                    position = rng.randrange(len(removed))
+                    idx = rng.choice([idx for idx in range(len(self.ids))
+                                      if idx not in removed])
+                    self._remove(removed[position], -1)
+                    self._remove(idx)
+                    removed[position] = idx
+            self._descend(removed)
+            self._offer(removed)
+            for idx in removed:
+                self._remove(idx, -1)
+            removed = list(self.best[1])
+            for idx in removed:
+                self._remove(idx)
+        for idx in removed:
+            self._remove(idx, -1)
+
+    def _search(self, start, removed):
+        remaining = self.extra - len(removed)
+        if remaining == 0:
+            self._offer(removed)
+            return
+        self.nodes += 1
+        if self.nodes > self.max_nodes:
+            self.exhausted = True
+            return
+        best_key, best_removed = self.best
+        bound = self._bound(start, remaining)
+        if bound > best_key or (bound == best_key and
+                                tuple(removed) > best_removed[:len(removed)]):
+            return
+        for idx in range(start, len(self.ids) - remaining + 1):
+            self._remove(idx)
+            removed.append(idx)
+            self._search(idx + 1, removed)
+            removed.pop()
+            self._remove(idx, -1)
+            if self.exhausted:
+                return
+            if not any(self.best[0]):
+                # No removal can do better than this, and the rest start
+                # with later ids so would lose the tie
+                best_removed = self.best[1]
+                if tuple(removed) + (idx,) >= best_removed[:len(removed) + 1]:
+                    return
+
+    def run(self, start=0, removed=()):
+        """
+        Search the removals which start with the given ones, then carry
+        on from ``start``; returns the indices of the ids to remove.
+        """
+        removed = list(removed)
+        if self.best is None:
+            self._initial()
+        for idx in removed:
+            self._remove(idx)
+        self._search(start, removed)
+        for idx in removed:
+            self._remove(idx, -1)
+        return list(self.best[1])
+
+
+def _search_from(args):
+    """Search the removals which start with the given index, in a worker."""
+    ids, num_teams, schedule, max_nodes, best, idx = args
+    search = RemovalSearch(ids, num_teams, schedule, max_nodes)
+    search.best = best
+    search.run(idx + 1, (idx,))
+    return idx, search.best, search.exhausted
+
+
+def find_removal(ids, num_teams, schedule, processes=1):
+    """
+    Find which of the ids to leave out when fitting the given number of
+    teams to the schedule; returns the indices of those ids, the empty
+    places key that leaves and whether the search gave up before it was
+    sure they're the best.
+
+    With more than one process, the removals are split by the first id
+    removed, and each worker searches one of those branches against a
+    shared starting point. Since every search breaks ties the same way,
+    the result is the same as searching serially unless a worker gives
+    up. Once a removal with no bad games is found, only the branches
+    which could still win the tie need finishing.
+    """
+    from multiprocessing import Pool
+
+    search = RemovalSearch(ids, num_teams, schedule)
+    if processes <= 1 or search.extra == 0:
+        removed = search.run()
+        return removed, search.best[0], search.exhausted
+
+    search._initial()
+    best = search.best
+    firsts = list(range(len(ids) - search.extra + 1))
+    if not any(best[0]):
+        firsts = firsts[:best[1][0] + 1]
+
+    tasks = [(ids, num_teams, schedule, search.max_nodes, best, idx)
+             for idx in firsts]
+    pending = set(firsts)
+    exhausted = False
+    pool = Pool(processes)
+    try:
+        for idx, candidate, worker_exhausted in pool.imap_unordered(_search_from,
+                                                                    tasks):
+            pending.remove(idx)
+            exhausted = exhausted or worker_exhausted
+            best = min(best, candidate)
+            if not any(best[0]) and all(first > best[1][0] for first in pending):
+                # The rest of the branches start with later ids
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+    return list(best[1]), best[0], exhausted
+
+
+def fit_cache_key(schedule_lines, ids_to_ignore, num_teams):
+    """
+    The key under which the search for which ids to leave out of a
+    schedule is cached; it doesn't depend on the teams' names.
+    """
+    import hashlib
 
-    return False
+    text = '\n'.join(schedule_lines).encode('utf-8')
+    ignored = sorted(ids_to_ignore.split(',')) if ids_to_ignore else []
+    return [hashlib.sha256(text).hexdigest(), ignored, num_teams]
 
 
-def get_best_fit(ids, team_ids, schedule, arena_ids):
-    best = None
-    for id_team_map in build_id_team_maps(ids, team_ids):
-        matches, bad_matches = build_matches(id_team_map, schedule, arena_ids)
+def get_best_fit(ids, team_ids, schedule, arena_ids, processes=1,
+                 cache_key=None):
+    from sr.comp.cli.cache import cached
 
-        if len(bad_matches) == 0:
-            # Nothing bad about these, ship them
-            return matches, bad_matches
+    computed = []
 
-        if best is None or are_better_matches(best[1], bad_matches):
-            best = (matches, bad_matches)
+    def compute():
+        computed.append(True)
+        removed, key, exhausted = find_removal(ids, len(team_ids), schedule,
+                                               processes)
+        return {'removed': [ids[idx] for idx in removed],
+                'empty_places': list(key),
+                'exhausted': exhausted}
 
-    assert best is not None
+    if cache_key is None:
+        fit = compute()
+    else:
+        fit = cached('import-fits', cache_key, compute)
+        if not computed:
+            print("Reusing the earlier choice of ids to leave out ({0} bad "
+                  "games).".format(sum(fit['empty_places'])))
 
-    return best
+    if fit['exhausted']:
+        print("Warning: stopped searching after {0} branches; there may be "
+              "a better fit.".format(MAX_SEARCH_NODES))
+    removed = set(fit['removed'])
+    id_subset = [id_ for id_ in ids if id_ not in removed]
+    return build_matches(dict(zip(id_subset, team_ids)), schedule, arena_ids)
 
 
 def order_teams(compstate_path, team_ids):
@@ -245,7 +459,8 @@ def order_teams(compstate_path, team_ids):
     return ordered_teams
 
 
-def build_schedule(schedule_lines, ids_to_ignore, team_ids, arena_ids):
+def build_schedule(schedule_lines, ids_to_ignore, team_ids, arena_ids,
+                   processes=1, cache=False):
     # Collect up the ids used
     ids, schedule = load_ids_schedule(schedule_lines)
 
@@ -259,8 +474,13 @@ def build_schedule(schedule_lines, ids_to_ignore, team_ids, arena_ids):
     assert num_ids >= num_teams, "Not enough places in the schedule " \
                                  "(need {0}, got {1}).".format(num_ids, num_teams)
 
-    # Get matches
-    matches, bad_matches = get_best_fit(ids, team_ids, schedule, arena_ids)
+    # Get matches, reusing the search for which ids to leave out if we've
+    # fitted the same number of teams to this schedule before
+    cache_key = None
+    if cache:
+        cache_key = fit_cache_key(schedule_lines, ids_to_ignore, num_teams)
+    matches, bad_matches = get_best_fit(ids, team_ids, schedule, arena_ids,
+                                        processes, cache_key)
 
     return matches, bad_matches
 
@@ -282,7 +502,8 @@ def command(args):
     team_ids = order_teams(args.compstate, team_ids)
 
     matches, bad_matches = build_schedule(schedule_lines, args.ignore_ids,
-                                          team_ids, arena_ids)
+                                          team_ids, arena_ids, args.parallel,
+                                          cache=not args.no_cache)
 
     # Print any warnings about the matches
     for bad_match in bad_matches:
@@ -320,6 +541,13 @@ https://github.com/PeterJCLaw/srobo-schedules/tree/master/seed_schedules
                                    description=description,
                                    formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('-i', '--ignore-ids', help='comma separated list of ids to ignore')
+    parser.add_argument('--parallel', type=int, default=1,
+                        help='number of processes to search for the best fit '
+                             'in; the result is the same as searching in one')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="search afresh for which ids to leave out, rather "
+                             "than reusing the result for the same schedule "
+                             "and number of teams")
     parser.add_argument('compstate', help='competition state repository')
     parser.add_argument('schedule', help='schedule to import')
     parser.set_defaults(func=command)
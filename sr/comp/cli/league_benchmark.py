@@ -0,0 +1,153 @@
+"""
+Benchmarks for the league scheduler.
+
+Each case runs a ``Scheduler`` with a fixed seed in its own process, so
+that a case which can't be solved can be abandoned after a timeout and so
+that the peak memory of each case is measured separately. Results are
+dicts which are written out as JSON lines, keyed by the case settings so
+that the results from two commits can be compared.
+"""
+
+from __future__ import print_function, division
+
+import itertools
+import random
+import time
+
+from sr.comp.cli.league_scheduler import Scheduler
+
+# The settings which make up a case, in the order they're varied
+CASE_KEYS = ('teams', 'arenas', 'separation', 'max_matchups',
+             'appearances_per_round', 'lcg', 'construct', 'strategy', 'seed')
+
+DEFAULT_MATRIX = {
+    'teams': (24, 48, 96, 160),
+    'arenas': (1, 2),
+    'separation': (1, 2),
+    'max_matchups': (2, 3),
+    'appearances_per_round': (1, 2),
+    'lcg': (False, True),
+    'construct': (True,),
+    'strategy': ('shuffle',),
+    'seed': (0,),
+}
+
+# Number of corners per arena in every case
+NUM_CORNERS = 4
+
+
+def cases(matrix):
+    """Expand a matrix of settings into a list of cases."""
+    return [dict(zip(CASE_KEYS, values))
+            for values in itertools.product(*[matrix[key] for key in CASE_KEYS])]
+
+
+def case_name(case):
+    return ' '.join('{0}={1}'.format(key, case[key]) for key in CASE_KEYS)
+
+
+def build_case_scheduler(case, num_rounds):
+    epm = case['arenas'] * NUM_CORNERS
+    entrants = case['teams'] * case['appearances_per_round']
+    round_length = -(-entrants // epm)
+    scheduler = Scheduler(teams=['T{0:03}'.format(n) for n in range(case['teams'])],
+                          max_match_periods=round_length * num_rounds,
+                          arenas=['A{0}'.format(n) for n in range(case['arenas'])],
+                          num_corners=NUM_CORNERS,
+                          random=random.Random(case['seed']),
+                          appearances_per_round=case['appearances_per_round'],
+                          separation=case['separation'],
+                          max_matchups=case['max_matchups'],
+                          enable_lcg=case['lcg'],
+                          construct=case['construct'],
+                          strategy=case['strategy'])
+    scheduler.lprint = lambda *args, **kwargs: None
+    return scheduler
+
+
+def run_case(case, num_rounds):
+    """
+    Run a single case in this process, returning its timing and the
+    scheduler's work counters.
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+
+    if tracemalloc is not None:
+        tracemalloc.start()
+    try:
+        start = time.time()
+        scheduler = build_case_scheduler(case, num_rounds)
+        scheduler.run()
+        elapsed = time.time() - start
+        peak_memory = None
+        if tracemalloc is not None:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        if tracemalloc is not None:
+            tracemalloc.stop()
+
+    result = dict(case)
+    result.update(status='solved',
+                  time=round(elapsed, 4),
+                  ticks=scheduler.stats['ticks'],
+                  backtracks=scheduler.stats['backtracks'],
+                  partial_backtracks=scheduler.stats['partial_backtracks'],
+                  relaxations=scheduler.stats['relaxations'],
+                  lcg_rounds=scheduler.stats['lcg_rounds'],
+                  constructed=bool(scheduler.stats['constructed']),
+                  matches=scheduler.total_matches,
+                  peak_memory=peak_memory)
+    return result
+
+
+def _case_worker(queue, case, num_rounds):
+    import traceback
+
+    try:
+        queue.put(run_case(case, num_rounds))
+    except Exception:
+        result = dict(case, status='error', error=traceback.format_exc())
+        queue.put(result)
+
+
+def run_case_with_timeout(case, num_rounds, timeout):
+    """Run a single case in its own process, giving up after ``timeout``."""
+    from multiprocessing import Process, Queue
+    from six.moves.queue import Empty
+
+    queue = Queue()
+    process = Process(target=_case_worker, args=(queue, case, num_rounds))
+    process.daemon = True
+    process.start()
+    try:
+        return queue.get(timeout=timeout)
+    except Empty:
+        return dict(case, status='timeout', time=timeout)
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+
+def result_key(result):
+    return tuple(result[key] for key in CASE_KEYS)
+
+
+def compare(baseline, results):
+    """
+    Pair up the results of two benchmark runs by case, yielding the case
+    and the ratio of the new time to the baseline time (below 1 is
+    faster), or None where either run didn't solve the case.
+    """
+    baseline = dict((result_key(result), result) for result in baseline)
+    for result in results:
+        old = baseline.get(result_key(result))
+        if old is None:
+            continue
+        ratio = None
+        if old['status'] == result['status'] == 'solved' and old['time'] > 0:
+            ratio = result['time'] / old['time']
+        yield result, ratio
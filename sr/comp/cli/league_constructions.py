@@ -0,0 +1,219 @@
+"""
+Direct constructions of league schedules.
+
+For many combinations of team count, arenas and corners, a valid schedule
+can be built straight from a combinatorial design rather than searched for:
+
+``affine``
+    The team pool is laid out as a grid with a row per corner and ``q``
+    columns. In the round for each element ``r`` of a finite field of
+    order ``q``, the team in row ``i`` and column ``c`` plays in game
+    ``c - r * i``, so teams in different rows meet exactly once every
+    ``q`` rounds. This needs ``q`` to be a prime or a power of two (using
+    GF(2^n)) of at least the number of corners. When there are as many
+    columns as corners, a round of the rows themselves completes an affine
+    plane in which every pair of teams meets exactly once.
+``cyclic``
+    The same layout using the integers modulo ``q``, which works when the
+    difference between any two rows is invertible, as it is when none of
+    the prime factors of ``q`` are smaller than the number of corners.
+``round-robin``
+    For two-corner games, the circle method, in which every pair of
+    teams meets once every ``len(pool) - 1`` rounds.
+
+These only cover one appearance per round, and only schedules without
+base matches; anything else is left to the search.
+
+Teams are relabelled at random and the games in each round are ordered
+so that teams which played late in one round play late in the next, and
+whatever's built is checked against the scheduler's constraints before
+it's used.
+"""
+
+from __future__ import division
+
+from sr.comp.cli.league_scheduler import ScheduleState, prime_factors
+
+# Number of orderings of each construction's rounds to try
+CONSTRUCTION_ATTEMPTS = 20
+
+# Irreducible polynomials for GF(2^n), by n
+IRREDUCIBLE_POLYNOMIALS = {1: 0b11, 2: 0b111, 3: 0b1011, 4: 0b10011,
+                           5: 0b100101, 6: 0b1000011, 7: 0b10000011,
+                           8: 0b100011011}
+
+
+def _gf2_multiply(a, b, n):
+    polynomial = IRREDUCIBLE_POLYNOMIALS[n]
+    product = 0
+    while b:
+        if b & 1:
+            product ^= a
+        b >>= 1
+        a <<= 1
+        if a >> n:
+            a ^= polynomial
+    return product
+
+
+def field_operations(order):
+    """
+    Addition, negation and multiplication in a finite field of the given
+    order, or None if it's not one to hand (a prime or a small power of 2).
+    """
+    if order > 1 and order & (order - 1) == 0:
+        n = order.bit_length() - 1
+        if n not in IRREDUCIBLE_POLYNOMIALS:
+            return None
+        return (lambda a, b: a ^ b,
+                lambda a: a,
+                lambda a, b: _gf2_multiply(a, b, n))
+    if order > 1 and list(prime_factors(order)) == [order]:
+        return modular_operations(order)
+    return None
+
+
+def modular_operations(order):
+    """Addition, negation and multiplication modulo ``order``."""
+    return (lambda a, b: (a + b) % order,
+            lambda a: (order - a) % order,
+            lambda a, b: (a * b) % order)
+
+
+def transversal_classes(pool, num_corners, operations):
+    """
+    The parallel classes (rounds, as lists of games) of a transversal
+    design over the pool, using the given ring operations over the
+    columns.
+    """
+    add, negate, multiply = operations
+    num_columns = len(pool) // num_corners
+    grid = [pool[row * num_columns:(row + 1) * num_columns]
+            for row in range(num_corners)]
+    classes = []
+    for r in range(num_columns):
+        games = [[None] * num_corners for column in range(num_columns)]
+        for row in range(num_corners):
+            shift = multiply(negate(r), row)
+            for column, team in enumerate(grid[row]):
+                games[add(column, shift)][row] = team
+        classes.append(games)
+    return classes
+
+
+def round_robin_classes(pool):
+    """The rounds of a round-robin tournament by the circle method."""
+    if len(pool) % 2:
+        return None
+    fixed, rotating = pool[0], list(pool[1:])
+    classes = []
+    for r in range(len(rotating)):
+        games = [[fixed, rotating[0]]]
+        for n in range(1, len(pool) // 2):
+            games.append([rotating[n], rotating[-n]])
+        classes.append(games)
+        rotating = rotating[-1:] + rotating[:-1]
+    return classes
+
+
+class Constructor(object):
+    """Try the constructions for a scheduler's settings."""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.random = scheduler.random
+        self.num_corners = scheduler.num_corners
+        self.num_arenas = len(scheduler.arenas)
+        self.num_real_teams = scheduler._num_real_teams
+        self.separation = scheduler.separation
+
+    def _layout(self):
+        """
+        Lay out the team pool with any pseudo-teams at the end, so that if
+        they all fall in the last row no game gets more than one of them.
+        """
+        pool = self.scheduler._teams
+        num_columns = len(pool) // self.num_corners
+        if len(pool) - self.num_real_teams > num_columns:
+            return None
+        return sorted(pool)
+
+    def _relabel(self, entries):
+        real = list(range(self.num_real_teams))
+        shuffled = list(real)
+        self.random.shuffle(shuffled)
+        relabel = dict(zip(real, shuffled))
+        return [relabel.get(team, team) for team in entries]
+
+    def _order_round(self, games, last_appearance, first_match):
+        """
+        Order a round's games by the earliest match each could go in, given
+        when its teams last played.
+        """
+        def release(game):
+            earliest = 0
+            for team in game:
+                if team in last_appearance:
+                    earliest = max(earliest, last_appearance[team] +
+                                   self.separation + 1 - first_match)
+            return earliest
+        return sorted(games, key=release)
+
+    def _schedule(self, classes, num_rounds):
+        """Flatten a sequence of rounds, cycling through the classes."""
+        entries = []
+        last_appearance = {}
+        round_length = self.scheduler.round_length
+        for n in range(num_rounds):
+            games = self._order_round(classes[n % len(classes)],
+                                      last_appearance, n * round_length)
+            for index, game in enumerate(games):
+                match_id = n * round_length + index // self.num_arenas
+                for team in game:
+                    last_appearance[team] = match_id
+                entries.extend(game)
+        return entries
+
+    def _valid(self, entries):
+        state = ScheduleState(self.scheduler)
+        return state.check(entries, self.scheduler.max_matchups)
+
+    def construct(self):
+        """
+        Build the whole schedule as a flat list of entries, returning the
+        name of the construction used and the entries, or None if none of
+        the constructions fit.
+        """
+        scheduler = self.scheduler
+        num_corners = self.num_corners
+        if scheduler.appearances_per_round != 1:
+            # Teams meeting in one copy of a translated grid would meet
+            # again in the other, so these only work for one appearance
+            return None
+        constructions = []
+        layout = self._layout()
+        if layout is not None:
+            num_columns = len(layout) // num_corners
+            field = field_operations(num_columns)
+            if field is not None and num_columns >= num_corners:
+                classes = transversal_classes(layout, num_corners, field)
+                if num_columns == num_corners:
+                    classes.append([layout[row * num_columns:(row + 1) * num_columns]
+                                    for row in range(num_corners)])
+                constructions.append(('affine', classes))
+            constructions.append(('cyclic', transversal_classes(
+                layout, num_corners, modular_operations(num_columns))))
+        if num_corners == 2:
+            constructions.append(('round-robin',
+                                  round_robin_classes(scheduler._teams)))
+        for name, classes in constructions:
+            if not classes:
+                continue
+            for attempt in range(CONSTRUCTION_ATTEMPTS):
+                if attempt:
+                    classes = list(classes)
+                    self.random.shuffle(classes)
+                entries = self._schedule(classes, scheduler.num_rounds)
+                if self._valid(entries):
+                    return name, self._relabel(entries)
+        return None
@@ -0,0 +1,195 @@
+"""
+Distributed search for league schedules.
+
+A coordinator hands out scheduler options and worker specs (see
+``league_portfolio``) to workers which connect to it over TCP, collects
+their progress, and stops them all once one of them has found a schedule.
+Messages are JSON objects, one per line.
+"""
+
+from __future__ import print_function
+
+import json
+import socket
+import sys
+import threading
+
+from six.moves.queue import Empty, Queue
+
+from sr.comp.cli.league_portfolio import describe_spec, portfolio_worker
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host, int(port)
+
+
+def send_message(wfile, message):
+    wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+    wfile.flush()
+
+
+def read_messages(rfile):
+    for line in rfile:
+        yield json.loads(line.decode('utf-8'))
+
+
+class Coordinator(object):
+    def __init__(self, address, options, spec_for_worker, on_progress=None):
+        self.options = options
+        self.on_progress = on_progress
+        self.spec_for_worker = spec_for_worker
+        self.specs = {}
+        self.connections = []
+        self.events = Queue()
+        self._lock = threading.Lock()
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(address)
+        self._server.listen(5)
+        self.address = self._server.getsockname()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, peer = self._server.accept()
+            except (socket.error, OSError):
+                # The server socket has been closed
+                return
+            with self._lock:
+                worker_id = len(self.connections)
+                self.connections.append(connection)
+                self.specs[worker_id] = self.spec_for_worker(worker_id)
+            thread = threading.Thread(target=self._handle,
+                                      args=(connection, worker_id, peer))
+            thread.daemon = True
+            thread.start()
+
+    def _handle(self, connection, worker_id, peer):
+        spec = self.specs[worker_id]
+        rfile = connection.makefile('rb')
+        wfile = connection.makefile('wb')
+        try:
+            send_message(wfile, {'type': 'job',
+                                 'options': self.options,
+                                 'spec': spec,
+                                 'telemetry': self.on_progress is not None})
+            self.events.put(('log', worker_id, 'Connected from {0}, using {1}'.format(
+                                peer[0], describe_spec(spec))))
+            for message in read_messages(rfile):
+                self.events.put((message['type'], worker_id, message))
+        except (socket.error, OSError, ValueError) as e:
+            self.events.put(('error', worker_id, str(e)))
+        else:
+            self.events.put(('error', worker_id, 'Disconnected'))
+
+    def stop(self):
+        self._server.close()
+        with self._lock:
+            for connection in self.connections:
+                try:
+                    send_message(connection.makefile('wb'), {'type': 'stop'})
+                    connection.shutdown(socket.SHUT_RDWR)
+                except (socket.error, OSError):
+                    pass
+                connection.close()
+
+    def run(self):
+        """
+        Wait for a worker to find a schedule, forwarding progress to
+        stderr. Returns the winning spec and its schedule, or raises a
+        RuntimeError if every worker which has connected fails or
+        disconnects without finding one.
+        """
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+        print('Waiting for workers on {0}:{1}'.format(*self.address),
+              file=sys.stderr)
+        failed = set()
+        try:
+            while True:
+                kind, worker_id, message = self.events.get()
+                if kind == 'done':
+                    matches = dict((int(match_id), match)
+                                   for match_id, match in message['matches'].items())
+                    return self.specs[worker_id], matches
+                if kind == 'telemetry':
+                    self.on_progress(dict(message['message'], worker=worker_id))
+                    continue
+                if isinstance(message, dict):
+                    message = message['message']
+                print('[Worker {0}] {1}'.format(worker_id, message.rstrip()),
+                      file=sys.stderr)
+                if kind == 'error':
+                    # A worker which fails also disconnects, so may well
+                    # be reported twice
+                    failed.add(worker_id)
+                    with self._lock:
+                        if len(failed) == len(self.connections):
+                            raise RuntimeError('All workers failed')
+        finally:
+            self.stop()
+
+
+def run_worker(address):
+    """
+    Connect to a coordinator and search for a schedule on its behalf,
+    until either one is found or the coordinator says to stop.
+    """
+    from multiprocessing import Process
+    from multiprocessing import Queue as ProcessQueue
+
+    connection = socket.create_connection(parse_address(address))
+    rfile = connection.makefile('rb')
+    wfile = connection.makefile('wb')
+    messages = read_messages(rfile)
+    job = next(messages)
+    print('Running {0}'.format(describe_spec(job['spec'])), file=sys.stderr)
+
+    # The scheduler runs in its own process so that it can be stopped
+    results = ProcessQueue()
+    process = Process(target=portfolio_worker,
+                      args=(results, 0, job['options'], job['spec'],
+                            job.get('telemetry', False)))
+    process.daemon = True
+    process.start()
+
+    stopped = threading.Event()
+
+    def listen():
+        try:
+            for message in messages:
+                if message['type'] == 'stop':
+                    break
+        except (socket.error, OSError, ValueError):
+            pass
+        # Either told to stop, or the coordinator has gone away
+        stopped.set()
+
+    listener = threading.Thread(target=listen)
+    listener.daemon = True
+    listener.start()
+
+    try:
+        while not stopped.is_set():
+            try:
+                kind, _, data = results.get(timeout=0.5)
+            except Empty:
+                continue
+            if kind == 'done':
+                send_message(wfile, {'type': 'done', 'matches': data})
+                print('Found a schedule', file=sys.stderr)
+                break
+            send_message(wfile, {'type': kind, 'message': data})
+            if kind == 'error':
+                break
+        else:
+            print('Stopped by the coordinator', file=sys.stderr)
+    except (socket.error, OSError):
+        print('Lost connection to the coordinator', file=sys.stderr)
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        connection.close()
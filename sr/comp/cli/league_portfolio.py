@@ -0,0 +1,200 @@
+"""Portfolio search for league schedules across several processes."""
+
+from __future__ import print_function
+
+import random
+import sys
+import time
+import traceback
+
+from sr.comp.cli.league_quality import (describe_quality, quality_key,
+                                        schedule_quality)
+from sr.comp.cli.league_scheduler import STRATEGIES, Scheduler
+
+
+def derive_seed(base_seed, worker_id):
+    return base_seed + worker_id
+
+
+def worker_spec(base_seed, worker_id, strategy, enable_lcg, vary=False):
+    """
+    Describe what a worker in a portfolio should run: its seed and, if
+    ``vary`` is set, a strategy and LCG setting which differ between the
+    workers.
+    """
+    spec = {'seed': derive_seed(base_seed, worker_id),
+            'strategy': strategy,
+            'enable_lcg': enable_lcg}
+    if vary:
+        spec['strategy'] = STRATEGIES[worker_id % len(STRATEGIES)]
+        spec['enable_lcg'] = (worker_id // len(STRATEGIES)) % 2 == 0
+    return spec
+
+
+def worker_specs(base_seed, num_workers, strategy, enable_lcg, vary=False):
+    return [worker_spec(base_seed, worker_id, strategy, enable_lcg, vary)
+            for worker_id in range(num_workers)]
+
+
+def describe_spec(spec):
+    options = '--seed {seed} --strategy {strategy}'.format(**spec)
+    if spec['enable_lcg']:
+        options += ' --lcg'
+    return options
+
+
+def build_scheduler(options, spec):
+    """
+    Build a Scheduler from keyword ``options`` and a worker spec, exactly
+    as a single-process run with the same settings would.
+    """
+    options = dict(options,
+                   random=random.Random(spec['seed']),
+                   strategy=spec['strategy'],
+                   enable_lcg=spec['enable_lcg'])
+    return Scheduler(**options)
+
+
+def portfolio_worker(queue, worker_id, options, spec, telemetry=False):
+    """
+    Run a scheduler in a worker process, reporting back over a queue, along
+    with its progress events if ``telemetry`` is set.
+    """
+    def lprint(*args, **kwargs):
+        queue.put(('log', worker_id, ' '.join(str(arg) for arg in args)))
+
+    def on_progress(event):
+        queue.put(('telemetry', worker_id, event))
+
+    try:
+        scheduler = build_scheduler(options, spec)
+        scheduler.lprint = lprint
+        if telemetry:
+            scheduler.on_progress = on_progress
+        output = scheduler.run()
+    except Exception:
+        queue.put(('error', worker_id, traceback.format_exc()))
+    else:
+        queue.put(('done', worker_id, output))
+
+
+def run_portfolio(options, specs, on_progress=None):
+    """
+    Run one scheduler process per spec, forwarding their progress to
+    stderr, and their progress events, tagged with the worker id, to
+    ``on_progress`` if given. The first schedule found wins and the other
+    processes are stopped; returns the winning spec and its schedule.
+    """
+    from multiprocessing import Process, Queue
+
+    queue = Queue()
+    telemetry = on_progress is not None
+    workers = [Process(target=portfolio_worker,
+                       args=(queue, worker_id, options, spec, telemetry))
+               for worker_id, spec in enumerate(specs)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    failures = 0
+    try:
+        while True:
+            kind, worker_id, data = queue.get()
+            if kind == 'done':
+                return specs[worker_id], data
+            if kind == 'telemetry':
+                on_progress(dict(data, worker=worker_id))
+                continue
+            print('[Worker {0}] {1}'.format(worker_id, data.rstrip()),
+                  file=sys.stderr)
+            if kind == 'error':
+                failures += 1
+                if failures == len(workers):
+                    raise RuntimeError('All workers failed')
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in workers:
+            worker.join()
+
+
+def anytime_worker(queue, worker_id, options, spec, stride):
+    """
+    Keep generating schedules in a worker process, reporting each one and
+    its quality back over a queue. The seed advances by ``stride`` each
+    time, so that workers started with consecutive seeds never overlap.
+    """
+    attempt = 0
+    while True:
+        attempt_spec = dict(spec, seed=spec['seed'] + attempt * stride)
+        try:
+            scheduler = build_scheduler(options, attempt_spec)
+            scheduler.lprint = lambda *args, **kwargs: None
+            output = scheduler.run()
+            quality = schedule_quality(output, scheduler.arenas,
+                                       scheduler.num_corners)
+        except Exception:
+            queue.put(('error', worker_id, traceback.format_exc()))
+            return
+        queue.put(('result', worker_id, (attempt_spec, quality, output)))
+        attempt += 1
+
+
+def run_anytime(options, specs, time_limit, on_progress=None):
+    """
+    Run one process per spec, each generating schedule after schedule,
+    until ``time_limit`` seconds have passed (or, if none has been found by
+    then, until the first is). Returns the spec, quality and output of the
+    best schedule found, as ranked by ``quality_key``.
+    """
+    from multiprocessing import Process, Queue
+    from six.moves.queue import Empty
+
+    deadline = time.time() + time_limit
+    queue = Queue()
+    workers = [Process(target=anytime_worker,
+                       args=(queue, worker_id, options, spec, len(specs)))
+               for worker_id, spec in enumerate(specs)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    best = None
+    failures = 0
+    try:
+        while True:
+            remaining = deadline - time.time()
+            if best is not None and remaining <= 0:
+                return best
+            try:
+                if best is None and remaining <= 0:
+                    message = queue.get()
+                else:
+                    message = queue.get(timeout=remaining)
+            except Empty:
+                continue
+            kind, worker_id, data = message
+            if kind == 'error':
+                print('[Worker {0}] {1}'.format(worker_id, data.rstrip()),
+                      file=sys.stderr)
+                failures += 1
+                if failures == len(workers):
+                    raise RuntimeError('All workers failed')
+                continue
+            spec, quality, output = data
+            improved = best is None or quality_key(quality) < quality_key(best[1])
+            if improved:
+                best = data
+                print('[Worker {0}] New best schedule: {1}'.format(
+                          worker_id, describe_quality(quality)),
+                      file=sys.stderr)
+            if on_progress is not None:
+                on_progress(dict(quality, event='schedule', worker=worker_id,
+                                 seed=spec['seed'], best=improved))
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in workers:
+            worker.join()
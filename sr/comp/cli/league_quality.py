@@ -0,0 +1,71 @@
+"""Measures of how good a league schedule is, beyond being valid."""
+
+from __future__ import division
+
+from collections import Counter, defaultdict
+from itertools import combinations
+
+
+def schedule_quality(matches, arenas, num_corners):
+    """
+    Measure the quality of a schedule, as output by ``Scheduler.run``.
+
+    Returns a dict of:
+
+    ``repeat_matchups``
+        the number of times any pair of teams meets after their first
+        meeting;
+    ``max_matchups``
+        the most times any pair of teams meets;
+    ``min_gap`` and ``mean_gap``
+        the smallest and mean number of match periods between a team's
+        consecutive appearances;
+    ``corner_imbalance``
+        the total, over the teams, of the difference between the number
+        of times they start in their most and least used corners.
+    """
+    appearances = defaultdict(list)
+    corners = defaultdict(Counter)
+    matchups = Counter()
+    for match_id in sorted(matches):
+        for arena in arenas:
+            game = matches[match_id][arena]
+            for corner, team in enumerate(game):
+                if team is not None:
+                    appearances[team].append(match_id)
+                    corners[team][corner] += 1
+            teams = sorted(set(team for team in game if team is not None))
+            matchups.update(combinations(teams, 2))
+
+    gaps = [later - earlier
+            for team_appearances in appearances.values()
+            for earlier, later in zip(team_appearances, team_appearances[1:])]
+
+    corner_imbalance = 0
+    for counts in corners.values():
+        usage = [counts[corner] for corner in range(num_corners)]
+        corner_imbalance += max(usage) - min(usage)
+
+    return {'repeat_matchups': sum(count - 1 for count in matchups.values()),
+            'max_matchups': max(matchups.values()) if matchups else 0,
+            'min_gap': min(gaps) if gaps else None,
+            'mean_gap': round(sum(gaps) / len(gaps), 3) if gaps else None,
+            'corner_imbalance': corner_imbalance}
+
+
+def quality_key(quality):
+    """
+    A sort key for schedule qualities, lower being better: fewest repeated
+    matchups first, then the widest minimum gap, the best corner balance
+    and finally the widest mean gap.
+    """
+    return (quality['repeat_matchups'],
+            -(quality['min_gap'] or 0),
+            quality['corner_imbalance'],
+            -(quality['mean_gap'] or 0))
+
+
+def describe_quality(quality):
+    return ('{repeat_matchups} repeated matchups, gaps of at least {min_gap} '
+            '(mean {mean_gap}), corner imbalance {corner_imbalance}'
+            .format(**quality))
@@ -0,0 +1,182 @@
+from __future__ import print_function, division
+
+import math
+import time
+from array import array
+
+
+class ScheduleRepairer(object):
+    """
+    Repair a nearly-valid schedule by simulated annealing over team swaps.
+
+    The schedule is a flat list of the scheduler's integer team ids. The
+    first ``frozen`` matches are left alone; in the rest, pairs of entries
+    are swapped either within a match or between matches in the same
+    round, which keeps the number of appearances each team makes per round
+    unchanged. Swaps are guided by a penalty built from the same
+    constraints that ``ScheduleState.check`` tests.
+    """
+
+    def __init__(self, scheduler, entries, frozen=0, matchup_max=None):
+        if matchup_max is None:
+            matchup_max = scheduler.max_matchups
+        self.random = scheduler.random
+        self.num_real_teams = scheduler._num_real_teams
+        self.num_corners = scheduler.num_corners
+        self.entrants_per_match_period = scheduler.entrants_per_match_period
+        self.round_length = scheduler.round_length
+        self.separation = scheduler.separation
+        self.matchup_max = matchup_max
+        self.frozen = frozen
+        self.entries = list(entries)
+
+        self.appearances = [[] for _ in range(self.num_real_teams)]
+        num_teams = self.num_real_teams
+        self.matchups = array('i', [0]) * (num_teams * (num_teams - 1) // 2)
+        for position, entrant in enumerate(self.entries):
+            if entrant < num_teams:
+                self.appearances[entrant].append(position // self.entrants_per_match_period)
+                for opponent in self._opponents(position):
+                    if opponent > entrant:
+                        self.matchups[self._pair_index(entrant, opponent)] += 1
+
+        self.penalty = self._total_penalty()
+
+    @property
+    def num_matches(self):
+        return len(self.entries) // self.entrants_per_match_period
+
+    def _pair_index(self, a, b):
+        if a > b:
+            return a * (a - 1) // 2 + b
+        return b * (b - 1) // 2 + a
+
+    def _opponents(self, position):
+        num_corners = self.num_corners
+        start = position - position % num_corners
+        entrant = self.entries[position]
+        for n in range(start, start + num_corners):
+            opponent = self.entries[n]
+            if n != position and opponent < self.num_real_teams and opponent != entrant:
+                yield opponent
+
+    def _team_penalty(self, team):
+        if team >= self.num_real_teams:
+            return 0
+        penalty = 0
+        limit = self.separation + 1
+        appearances = sorted(self.appearances[team])
+        for earlier, later in zip(appearances, appearances[1:]):
+            if later - earlier < limit:
+                penalty += limit - (later - earlier)
+        return penalty
+
+    def _game_penalty(self, position):
+        num_corners = self.num_corners
+        start = position - position % num_corners
+        num_pseudo = sum(1 for entrant in self.entries[start:start+num_corners]
+                         if entrant >= self.num_real_teams)
+        return 1 if 1 < num_pseudo < num_corners else 0
+
+    def _total_penalty(self):
+        penalty = sum(self._team_penalty(team) for team in range(self.num_real_teams))
+        penalty += sum(self._game_penalty(position) for position in
+                       range(0, len(self.entries), self.num_corners))
+        penalty += sum(max(0, count - self.matchup_max) for count in self.matchups)
+        return penalty
+
+    def _update_matchups(self, position, change):
+        entrant = self.entries[position]
+        if entrant >= self.num_real_teams:
+            return 0
+        delta = 0
+        for opponent in self._opponents(position):
+            index = self._pair_index(entrant, opponent)
+            before = self.matchups[index]
+            self.matchups[index] = before + change
+            delta += (max(0, before + change - self.matchup_max) -
+                      max(0, before - self.matchup_max))
+        return delta
+
+    def _move_appearance(self, team, old_match, new_match):
+        if team < self.num_real_teams and old_match != new_match:
+            appearances = self.appearances[team]
+            appearances.remove(old_match)
+            appearances.append(new_match)
+
+    def swap(self, p, q):
+        """Swap the entries at two positions, returning the penalty change."""
+        epm = self.entrants_per_match_period
+        a, b = self.entries[p], self.entries[q]
+        before = (self._team_penalty(a) + self._team_penalty(b) +
+                  self._game_penalty(p) + self._game_penalty(q))
+        delta = self._update_matchups(p, -1) + self._update_matchups(q, -1)
+        self.entries[p], self.entries[q] = b, a
+        delta += self._update_matchups(p, 1) + self._update_matchups(q, 1)
+        self._move_appearance(a, p // epm, q // epm)
+        self._move_appearance(b, q // epm, p // epm)
+        after = (self._team_penalty(a) + self._team_penalty(b) +
+                 self._game_penalty(p) + self._game_penalty(q))
+        delta += after - before
+        self.penalty += delta
+        return delta
+
+    def _random_move(self):
+        epm = self.entrants_per_match_period
+        num_corners = self.num_corners
+        start = self.frozen * epm
+        p = self.random.randrange(start, len(self.entries))
+        # Stay within the round, so that each team's appearances per round
+        # are unaffected
+        round_start = (p // epm) // self.round_length * self.round_length * epm
+        round_start = max(start, round_start)
+        round_end = min(len(self.entries), round_start + self.round_length * epm)
+        q = self.random.randrange(round_start, round_end)
+        if p // num_corners == q // num_corners:
+            return None
+        if self.entries[p] == self.entries[q]:
+            return None
+        return p, q
+
+    def run(self, time_limit, target=0, initial_temperature=2.0,
+            final_temperature=0.05):
+        """
+        Anneal until the penalty drops to ``target`` or ``time_limit``
+        seconds have passed. Returns the best entries found and their
+        penalty.
+        """
+        best_entries = list(self.entries)
+        best_penalty = self.penalty
+        if self.num_matches <= self.frozen:
+            return best_entries, best_penalty
+        start = time.time()
+        temperature = initial_temperature
+        iterations = 0
+        while self.penalty > target:
+            iterations += 1
+            if iterations % 100 == 0:
+                elapsed = time.time() - start
+                if elapsed >= time_limit:
+                    break
+                temperature = initial_temperature * (
+                    final_temperature / initial_temperature) ** (elapsed / time_limit)
+            move = self._random_move()
+            if move is None:
+                continue
+            delta = self.swap(*move)
+            if delta > 0 and self.random.random() >= math.exp(-delta / temperature):
+                self.swap(*move)
+                continue
+            if self.penalty < best_penalty:
+                best_penalty = self.penalty
+                best_entries = list(self.entries)
+        return best_entries, best_penalty
+
+
+def frozen_penalty(scheduler, entries, frozen, matchup_max=None):
+    """
+    The penalty of just the first ``frozen`` matches of a schedule, which
+    is the best that a repair can achieve.
+    """
+    frozen_entries = entries[:frozen * scheduler.entrants_per_match_period]
+    return ScheduleRepairer(scheduler, frozen_entries, frozen, matchup_max).penalty
@@ -1,24 +1,493 @@
 from __future__ import print_function, division
 
+import json
+import os
 import random
 import sys
+import time
+from array import array
 from collections import Counter
-from itertools import product
-from fractions import gcd
+from itertools import permutations, product
 
-class PatienceCounter(object):
-    def __init__(self, threshold):
-        self.threshold = threshold
-        self.level = 0
+try:
+    from math import gcd
+except ImportError:
+    from fractions import gcd
+
+STRATEGIES = ('shuffle', 'batch', 'propagate')
+
+# Number of candidate rounds to try before giving up on the current round
+ROUND_TICKS = 10000
+
+# Number of attempts the 'propagate' strategy makes at building a round,
+# and the number of placements (including those which get backtracked)
+# each attempt may make
+PROPAGATE_ATTEMPTS = 100
+PROPAGATE_PLACEMENTS = 5000
+
+# Last appearance of a team which hasn't appeared yet
+NEVER = -(1 << 30)
+
+# Number of candidate rounds generated and checked at once by the 'batch'
+# strategy
+BATCH_SIZE = 250
+
+# Number of passes made over the games when balancing the corners teams
+# start in, and the most corners for which every arrangement of a game is
+# tried (beyond which teams are placed one at a time)
+CORNER_BALANCE_PASSES = 10
+MAX_PERMUTED_CORNERS = 6
+
+# Number of times the previous round is partially re-placed before it's
+# dropped entirely, and the number of candidates tried for each
+PARTIAL_BACKTRACK_ATTEMPTS = 2
+PARTIAL_BACKTRACK_TICKS = 1000
+
+# Number of failed attempts at a round without getting any further through
+# the schedule, and the share of the candidates meeting every other constraint
+# which must have been rejected for repeating a matchup, before the matchup
+# limit is relaxed
+RELAX_STALLED_ATTEMPTS = 6
+RELAX_MATCHUP_SHARE = 0.5
+
+# Number of rounds in a row which must be found with at most this share of
+# matchup rejections before a relaxed matchup limit is tightened again
+RETIGHTEN_ROUNDS = 4
+RETIGHTEN_MATCHUP_SHARE = 0.1
+
+class RelaxationPolicy(object):
+    """
+    Decides when to relax the matchup limit, and when to tighten it again,
+    from how the search is going rather than after a fixed number of
+    rejections.
+
+    The limit is relaxed when the search has stalled, failing to find a
+    number of rounds without getting any further through the schedule,
+    and most of the candidates which met every other constraint meanwhile
+    were rejected for repeating matchups; if candidates were hardly ever
+    getting that far, relaxing the limit wouldn't help. Once relaxed, the
+    limit is tightened again after a run of rounds found with few matchup
+    rejections, each run needing to be twice as long as the last.
+    """
+
+    def __init__(self, max_matchups):
+        self.max_matchups = max_matchups
+        self.limit = max_matchups
+        self.furthest = 0
+        self.stalled = 0
+        self.stalled_rejections = Counter()
+        self.rejections = Counter()
+        self.matchup_share = 0
+        self.last_rejections = Counter()
+        self.easy_rounds = 0
+        self.retighten_rounds = RETIGHTEN_ROUNDS
 
     def bump(self):
-        self.level += 1
+        """Note a candidate rejected for repeating a matchup."""
+        self.rejections['matchups'] += 1
+
+    def reject(self, reason, count=1):
+        self.rejections[reason] += count
+
+    def _share(self, rejections):
+        # Separation is checked first, so only candidates which passed it
+        # (and were either accepted or rejected for their matchups) tell us
+        # anything about the matchup limit
+        matchups = rejections['matchups']
+        if not matchups:
+            return 0
+        return matchups / (matchups + rejections['accepted'])
 
-    def reset(self):
-        self.level = 0
+    def end_round(self, progress, accepted, ticks):
+        """
+        Record the outcome of an attempt at a round, where ``progress`` is
+        the number of matches scheduled after it, ``accepted`` is whether
+        a round was found and ``ticks`` is the number of candidates tried.
+        Returns a description of any change made to the limit, or None.
+        """
+        rejections = self.rejections
+        self.rejections = Counter()
+        # Candidates which weren't rejected for their matchups were
+        # rejected for something else, even if they weren't counted
+        others = sum(count for reason, count in rejections.items()
+                     if reason != 'matchups')
+        rejections = Counter(matchups=rejections['matchups'],
+                             other=max(others, ticks - int(accepted) -
+                                       rejections['matchups']),
+                             accepted=int(accepted))
+        self.last_rejections = rejections
+        self.matchup_share = self._share(rejections)
 
-    def reached(self):
-        return self.level >= self.threshold
+        if progress > self.furthest:
+            self.furthest = progress
+            self.stalled = 0
+            self.stalled_rejections = Counter()
+        elif not accepted:
+            self.stalled += 1
+            self.stalled_rejections.update(rejections)
+        else:
+            # Finding a round again after backtracking isn't progress,
+            # but nor is it another failure
+            self.stalled_rejections.update(rejections)
+
+        if (self.stalled >= RELAX_STALLED_ATTEMPTS and
+                self._share(self.stalled_rejections) >= RELAX_MATCHUP_SHARE):
+            decision = {'action': 'relax',
+                        'stalled': self.stalled,
+                        'matchup_share': round(self._share(self.stalled_rejections), 4)}
+            self.limit += 1
+            self.stalled = 0
+            self.stalled_rejections = Counter()
+            self.easy_rounds = 0
+            decision['matchup_limit'] = self.limit
+            return decision
+
+        if self.limit > self.max_matchups:
+            if accepted and self.matchup_share <= RETIGHTEN_MATCHUP_SHARE:
+                self.easy_rounds += 1
+            else:
+                self.easy_rounds = 0
+            if self.easy_rounds >= self.retighten_rounds:
+                decision = {'action': 'tighten',
+                            'easy_rounds': self.easy_rounds}
+                self.limit -= 1
+                self.easy_rounds = 0
+                self.retighten_rounds *= 2
+                decision['matchup_limit'] = self.limit
+                return decision
+        return None
+
+    def checkpoint(self):
+        return {'limit': self.limit,
+                'furthest': self.furthest,
+                'stalled': self.stalled,
+                'stalled_rejections': dict(self.stalled_rejections),
+                'easy_rounds': self.easy_rounds,
+                'retighten_rounds': self.retighten_rounds}
+
+    def restore(self, checkpoint):
+        self.limit = checkpoint['limit']
+        self.furthest = checkpoint['furthest']
+        self.stalled = checkpoint['stalled']
+        self.stalled_rejections = Counter(checkpoint['stalled_rejections'])
+        self.easy_rounds = checkpoint['easy_rounds']
+        self.retighten_rounds = checkpoint['retighten_rounds']
+
+class ScheduleState(object):
+    """
+    Constraint state for the matches which have been accepted so far.
+
+    Rather than re-walking the whole schedule for every candidate, this
+    keeps a running count of matchups and the index of each team's last
+    appearance so that candidate matches can be checked against just the
+    ``separation``-wide boundary of what's already been accepted.
+
+    Teams are the scheduler's integer ids. Accepted matches are stored as
+    rows of a flat preallocated array and the matchup counts as a
+    triangular array, indexed by ``hi * (hi - 1) // 2 + lo``.
+    """
+
+    def __init__(self, scheduler, capacity=0):
+        self.num_real_teams = scheduler._num_real_teams
+        self.num_corners = scheduler.num_corners
+        self.entrants_per_match_period = scheduler.entrants_per_match_period
+        self.separation = scheduler.separation
+        self.entries = array('i', [0]) * (capacity * self.entrants_per_match_period)
+        self.num_matches = 0
+        num_teams = self.num_real_teams
+        self.matchups = array('i', [0]) * (num_teams * (num_teams - 1) // 2)
+        self.last_appearance = array('i', [NEVER]) * num_teams
+
+    def __len__(self):
+        return self.num_matches
+
+    @property
+    def matches(self):
+        epm = self.entrants_per_match_period
+        return [self.entries[n*epm:(n+1)*epm].tolist()
+                for n in range(self.num_matches)]
+
+    def _pair_indices(self, entries):
+        num_real_teams = self.num_real_teams
+        num_corners = self.num_corners
+        for start in range(0, len(entries), num_corners):
+            game = entries[start:start+num_corners]
+            for n, a in enumerate(game):
+                if a >= num_real_teams:
+                    continue
+                for b in game[n+1:]:
+                    if b >= num_real_teams or a == b:
+                        continue
+                    if a > b:
+                        yield a * (a - 1) // 2 + b
+                    else:
+                        yield b * (b - 1) // 2 + a
+
+    def check(self, entries, matchup_max, matchup_impatience_bump=lambda: None):
+        """
+        Check whether the given entries, a whole number of matches' worth,
+        could be appended to the accepted matches without violating any of
+        the constraints.
+        """
+        num_real_teams = self.num_real_teams
+        num_corners = self.num_corners
+        epm = self.entrants_per_match_period
+        separation = self.separation
+        last_appearance = self.last_appearance
+        # 4 tests in this function:
+        #  (1) validate that teams aren't scheduled too tightly
+        #  (2) validate that matchups aren't too frequent
+        #  (3) validate that no match has two teams sitting out (or if it is, that it's blank)
+        # if operating multiple appearances per match, also:
+        #  (4) make sure that a team doesn't appear in a match twice
+        seen = {}
+        match_id = self.num_matches
+        for start in range(0, len(entries), epm):
+            for entrant in entries[start:start+epm]:
+                if entrant >= num_real_teams:
+                    continue
+                # Test constraints (1) and (4); an entrant appearing twice
+                # in a match is seen at a separation of zero
+                last = seen.get(entrant)
+                if last is None:
+                    last = last_appearance[entrant]
+                if match_id - last <= separation:
+                    return False
+                seen[entrant] = match_id
+            # Test constraint (3)
+            for game_start in range(start, start+epm, num_corners):
+                num_pseudo = 0
+                for entrant in entries[game_start:game_start+num_corners]:
+                    if entrant >= num_real_teams:
+                        num_pseudo += 1
+                if 1 < num_pseudo < num_corners:
+                    return False
+            match_id += 1
+        # Test constraint (2)
+        matchups = self.matchups
+        new_matchups = {}
+        for index in self._pair_indices(entries):
+            count = new_matchups.get(index, 0) + 1
+            if matchups[index] + count > matchup_max:
+                # team faces off against one other team too many times
+                matchup_impatience_bump()
+                return False
+            new_matchups[index] = count
+        # No objections, your honour!
+        return True
+
+    def push(self, entries):
+        """Accept the given entries, appending them as matches."""
+        epm = self.entrants_per_match_period
+        start = self.num_matches * epm
+        missing = start + len(entries) - len(self.entries)
+        if missing > 0:
+            self.entries.extend([0] * missing)
+        self.entries[start:start+len(entries)] = array('i', entries)
+        matchups = self.matchups
+        for index in self._pair_indices(entries):
+            matchups[index] += 1
+        for n, entrant in enumerate(entries):
+            if entrant < self.num_real_teams:
+                self.last_appearance[entrant] = self.num_matches + n // epm
+        self.num_matches += len(entries) // epm
+
+    def pop(self, count):
+        """
+        Roll back the last ``count`` accepted matches, returning their
+        entries.
+        """
+        epm = self.entrants_per_match_period
+        self.num_matches -= count
+        start = self.num_matches * epm
+        removed = self.entries[start:start+count*epm].tolist()
+        matchups = self.matchups
+        for index in self._pair_indices(removed):
+            matchups[index] -= 1
+        for entrant in removed:
+            if entrant < self.num_real_teams:
+                self.last_appearance[entrant] = NEVER
+        # Only appearances within the separation window can cause
+        # collisions, so that's all we need to restore
+        window = max(0, self.num_matches - self.separation)
+        for n in range(window * epm, start):
+            entrant = self.entries[n]
+            if entrant < self.num_real_teams:
+                self.last_appearance[entrant] = n // epm
+        return removed
+
+def require_numpy(feature):
+    """
+    Import numpy, which is an optional dependency, raising an ImportError
+    which says how to install it if it's missing.
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('{0} needs numpy, which can be installed with '
+                          '"pip install sr.comp.cli[league]"'.format(feature))
+    return numpy
+
+
+def check_batch(candidates, num_corners, entrants_per_match_period,
+                num_real_teams, separation, first_match, last_appearance,
+                matchups, matchup_max, num_pool_teams=None):
+    """
+    Check a batch of candidate rounds at once.
+
+    ``candidates`` is a 2D array of integer-encoded teams, one candidate
+    round per row. Ids below ``num_real_teams`` are real teams and the
+    rest are pseudo-teams. The first ``num_pool_teams`` ids (by default,
+    all the real teams) are those being scheduled, each of which must
+    appear the same number of times in every row; any other real teams
+    only appear in base matches. ``last_appearance`` gives the index of
+    each team's last accepted match (or anything far enough in the past) and
+    ``matchups`` is a triangular array of the accepted matchup counts,
+    indexed by ``hi * (hi - 1) // 2 + lo``.
+
+    Returns a tuple of boolean arrays ``(valid, matchup_failures)``, the
+    latter marking the candidates which fail only on repeated matchups.
+    """
+    import numpy as np
+
+    if num_pool_teams is None:
+        num_pool_teams = num_real_teams
+
+    num_candidates, num_entrants = candidates.shape
+    appearances = num_entrants
+    if num_pool_teams:
+        appearances = (candidates < num_pool_teams).sum(axis=1)[0] // num_pool_teams
+    last_appearance = last_appearance[:num_pool_teams]
+
+    # Constraints (1) and (4): find the match index of each appearance of
+    # each team, by sorting the positions by team id
+    match_of_position = np.arange(num_entrants) // entrants_per_match_period
+    order = np.argsort(candidates, axis=1, kind='mergesort')
+    appearance_matches = match_of_position[order[:, :num_pool_teams*appearances]]
+    appearance_matches = appearance_matches.reshape(num_candidates,
+                                                    num_pool_teams,
+                                                    appearances)
+    gaps = first_match + appearance_matches[:, :, 0] - last_appearance
+    bad = (gaps <= separation).any(axis=1)
+    if appearances > 1:
+        gaps = np.diff(appearance_matches, axis=2)
+        bad |= (gaps <= separation).any(axis=(1, 2))
+
+    # Constraint (3)
+    games = candidates.reshape(num_candidates, -1, num_corners)
+    num_pseudo = (games >= num_real_teams).sum(axis=2)
+    bad |= ((num_pseudo > 1) & (num_pseudo < num_corners)).any(axis=1)
+
+    # Constraint (2), only for the candidates which are otherwise valid
+    survivors = np.flatnonzero(~bad)
+    matchup_failures = np.zeros(num_candidates, dtype=bool)
+    if len(survivors):
+        games = games[survivors]
+        indices = []
+        for a, b in product(range(num_corners), repeat=2):
+            if a >= b:
+                continue
+            lo = np.minimum(games[:, :, a], games[:, :, b])
+            hi = np.maximum(games[:, :, a], games[:, :, b])
+            index = hi * (hi - 1) // 2 + lo
+            index[(hi >= num_real_teams) | (hi == lo)] = -1
+            indices.append(index)
+        indices = np.concatenate(indices, axis=1)
+        num_pairs = len(matchups)
+        rows = np.repeat(np.arange(len(survivors)), indices.shape[1])
+        indices = indices.ravel()
+        counted = indices >= 0
+        counts = np.bincount(rows[counted] * num_pairs + indices[counted],
+                             minlength=len(survivors) * num_pairs)
+        counts = counts.reshape(len(survivors), num_pairs) + matchups
+        too_many = (counts > matchup_max).any(axis=1)
+        matchup_failures[survivors[too_many]] = True
+        bad[survivors[too_many]] = True
+
+    return ~bad, matchup_failures
+
+class CornerBalancer(object):
+    """
+    Arrange the teams in each game across the corners so as to even out
+    how often each team starts in each corner.
+
+    The aim is to minimise the sum over teams and corners of the square of
+    the number of times the team starts there; the change in that from
+    placing a team in a corner is proportional to how often it's already
+    been there, so each game is arranged to minimise the total of those
+    counts. Games are arranged greedily in order, then refined by
+    rearranging each in turn given all of the others. An arrangement is
+    only changed for a strict improvement, so ties keep whatever order
+    the game was given in.
+    """
+
+    def __init__(self, num_corners, num_real_teams):
+        self.num_corners = num_corners
+        self.num_real_teams = num_real_teams
+        self.counts = [[0] * num_corners for team in range(num_real_teams)]
+        if num_corners <= MAX_PERMUTED_CORNERS:
+            self.orders = list(permutations(range(num_corners)))
+        else:
+            self.orders = None
+
+    def add(self, game, change=1):
+        for corner, team in enumerate(game):
+            if team < self.num_real_teams:
+                self.counts[team][corner] += change
+
+    def arrange(self, game):
+        """The best arrangement of a game given the current counts."""
+        if self.orders is None:
+            return self._arrange_greedily(game)
+        counts = self.counts
+        num_real_teams = self.num_real_teams
+        best_order = None
+        best_cost = None
+        for order in self.orders:
+            cost = 0
+            for corner, n in enumerate(order):
+                team = game[n]
+                if team < num_real_teams:
+                    cost += counts[team][corner]
+            if best_cost is None or cost < best_cost:
+                best_order = order
+                best_cost = cost
+        return [game[n] for n in best_order]
+
+    def _arrange_greedily(self, game):
+        arranged = [None] * len(game)
+        free = list(range(len(game)))
+        for team in game:
+            if team < self.num_real_teams:
+                corner = min(free, key=lambda corner: self.counts[team][corner])
+                free.remove(corner)
+                arranged[corner] = team
+        for team in game:
+            if team >= self.num_real_teams:
+                arranged[free.pop(0)] = team
+        return arranged
+
+    def balance(self, games, fixed=0, passes=CORNER_BALANCE_PASSES):
+        """
+        Rearrange the given games in place, leaving the first ``fixed`` of
+        them as they are (though they count towards the balance).
+        """
+        for game in games[:fixed]:
+            self.add(game)
+        for game in games[fixed:]:
+            game[:] = self.arrange(game)
+            self.add(game)
+        for n in range(passes):
+            changed = False
+            for game in games[fixed:]:
+                self.add(game, -1)
+                arranged = self.arrange(game)
+                if arranged != game:
+                    game[:] = arranged
+                    changed = True
+                self.add(game)
+            if not changed:
+                break
 
 def prime_factors(n):
     d = 2
@@ -30,6 +499,21 @@ def prime_factors(n):
     if n > 1:
         yield n
 
+def save_checkpoint(path, checkpoint):
+    """Save a scheduler checkpoint, replacing any previous one whole."""
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(checkpoint, f)
+    try:
+        replace = os.replace
+    except AttributeError:
+        replace = os.rename
+    replace(temporary, path)
+
+def load_checkpoint(path):
+    with open(path) as f:
+        return json.load(f)
+
 class Scheduler(object):
     def __init__(self,
                  teams,
@@ -41,19 +525,37 @@ class Scheduler(object):
                  separation=2,
                  max_matchups=2,
                  enable_lcg=True,
-                 base_matches=()):
+                 base_matches=(),
+                 strategy='shuffle',
+                 repair_time=0,
+                 construct=True):
+        if strategy not in STRATEGIES:
+            raise ValueError('Unknown scheduling strategy {0!r}'.format(strategy))
+        if strategy == 'batch':
+            require_numpy("The 'batch' strategy")
         self.tag = ''
+        # Counts of the work done by the last run, and a record of each
+        # attempt at a round, for benchmarking and progress reporting
+        self.stats = Counter()
+        self.round_stats = []
+        # Called with each progress event as a dict, if set
+        self.on_progress = None
+        # File to save the progress of a run to, every so many seconds
+        self.checkpoint_file = None
+        self.checkpoint_interval = 60
+        # Stream to write each match to as it's accepted, if set, in which
+        # case corners are balanced a match at a time rather than at the end
+        self.stream = None
+        self.strategy = strategy
+        self.repair_time = repair_time
+        self.construct = construct
         self.num_corners = num_corners
         self.random = random
         self.arenas = tuple(arenas)
         self.max_match_periods = max_match_periods
         self.appearances_per_round = appearances_per_round
-        self._base_matches = list(base_matches)
-        for match in base_matches:
-            for n, entry in enumerate(match):
-                if entry is None:
-                    match[n] = '~'
-        self._calculate_teams(teams)
+        self._calculate_teams(teams, base_matches)
+        self._base_matches = [self._encode_match(match) for match in base_matches]
         self._calculate_rounds()
         if len(self._base_matches) % self.round_length > 0:
             self.lprint('Warning: matches for partial reschedule are not a multiple of the round-length')
@@ -64,6 +566,13 @@ class Scheduler(object):
         else:
             self._lcg_params = None
 
+    def _report(self, event, **data):
+        data['event'] = event
+        data['elapsed'] = round(time.time() - self._start_time, 3)
+        if self.on_progress is not None:
+            self.on_progress(data)
+        return data
+
     def lprint(self, *args, **kwargs):
         if self.tag:
             print(self.tag, end='', file=sys.stderr)
@@ -74,18 +583,41 @@ class Scheduler(object):
         return len(self.arenas) * self.num_corners
 
     def _is_pseudo(self, team):
-        return team[0] == '~'
+        return team >= self._num_real_teams
 
-    def _calculate_teams(self, base_teams):
-        teams = list(base_teams) * self.appearances_per_round
+    def _calculate_teams(self, base_teams, base_matches=()):
+        # Teams are identified internally by dense integer ids: real teams
+        # first, including any which only appear in the base matches (for
+        # example because they've since dropped out), then pseudo-teams.
+        base_teams = list(base_teams)
+        names = list(base_teams)
+        known = set(names)
+        for match in base_matches:
+            for entry in match:
+                if entry is not None and entry not in known:
+                    known.add(entry)
+                    names.append(entry)
+        self._num_real_teams = len(names)
+        self._num_pool_teams = len(base_teams)
+        teams = list(range(len(base_teams))) * self.appearances_per_round
         # account for overflow
         overflow = (self.entrants_per_match_period -
                      (len(teams) % self.entrants_per_match_period))
         if overflow < self.entrants_per_match_period:
             for n in range(overflow):
-                teams.append('~{}'.format(n))
+                teams.append(len(names))
+                names.append('~{}'.format(n))
+        # A pseudo-team for the empty places in the base matches
+        self._blank = len(names)
+        names.append('~')
+        self._team_names = names
+        self._team_ids = dict((name, n) for n, name in enumerate(names))
         self._teams = teams
 
+    def _encode_match(self, match):
+        return [self._blank if entry is None else self._team_ids[entry]
+                for entry in match]
+
     @property
     def total_matches(self):
         return self.num_rounds * self.round_length
@@ -97,84 +629,77 @@ class Scheduler(object):
 
     def _validate(self, schedule,
                   matchup_max=None, matchup_impatience_bump=lambda: None):
-        is_pseudo = self._is_pseudo
         if matchup_max is None:
             matchup_max = self.max_matchups
-        multi_per_match_mode = self.appearances_per_round > 1
-        # 4 tests in this function:
-        #  (1) validate that teams aren't scheduled too tightly
-        #  (2) validate that matchups aren't too frequent
-        #  (3) validate that no match has two teams sitting out (or if it is, that it's blank)
-        # if operating multiple appearances per match, also:
-        #  (4) make sure that a team doesn't appear in a match twice
-        matchups = Counter()
-        for match_id, match in enumerate(schedule):
-            entrants = set(entrant for entrant in match
-                            if not is_pseudo(entrant))
-            if multi_per_match_mode:
-                # Test constraint (4)
-                if len(entrants) != len([entrant for entrant in match if not is_pseudo(entrant)]):
-                    return False
-            # Test constraint (1)
-            previous_matches = schedule[match_id-self.separation:match_id]
-            for previous_match in previous_matches:
-                for previous_entrant in previous_match:
-                    if is_pseudo(previous_entrant):
-                        continue
-                    if previous_entrant in entrants:
-                        return False
-            # Update constraint (2)
-            for arena_id in range(len(self.arenas)):
-                game = match[arena_id*self.num_corners:(arena_id+1)*self.num_corners]
-                for a, b in product(game, repeat=2):
-                    if a >= b:
-                        continue
-                    a_pseudo, b_pseudo = is_pseudo(a), is_pseudo(b)
-                    # Check constraint (3) while we're here
-                    if (a_pseudo and b_pseudo and
-                            not all(is_pseudo(x) for x in game)):
-                        return False
-                    elif not a_pseudo and not b_pseudo:
-                        matchups.update([(a, b)])
-        # No collisions, determine whether teams face a broad range of other teams
-        top_repeated_matchups = max(matchups.values())
-        if top_repeated_matchups > self.max_matchups:
-            # team faces off against one other team too many times
-            matchup_impatience_bump()
-            return False
-        # No objections, your honour!
-        return True
+        state = ScheduleState(self)
+        entries = [entrant for match in schedule for entrant in match]
+        return state.check(entries, matchup_max, matchup_impatience_bump)
 
     def _compute_lcg_params(self):
+        from sr.comp.cli.cache import cached
+
+        key = [len(self._teams), self.entrants_per_match_period,
+               self.round_length, self.separation]
+        params = cached('lcg-params', key, self._search_lcg_params)
+        if params is None:
+            self.lprint('No valid LCG parameters')
+            self._lcg_params = None
+        else:
+            self._lcg_params = tuple(params)
+            self.lprint('Found LCG settings: ({}, {})'.format(*params))
+
+    def _search_lcg_params(self):
+        """
+        Find the largest multiplier ``a``, and for it the largest increment
+        ``c``, of a full-period LCG over the team pool which never moves the
+        teams at the end of one round to within ``separation`` matches of
+        the start of the next. Returns them as a list, or None if there
+        aren't any. Each multiplier's increments are checked at once with
+        numpy if it's installed.
+        """
         m = len(self._teams)
-        for a in range(m - 1, 1, -1):
-            am1 = a - 1
-            if am1 % 4 != 0:
-                continue
-            if any(am1 % factor != 0 for factor in prime_factors(m)):
-                continue
-            for c in range(m - 1, 0, -1):
-                if gcd(c, m) != 1:
-                    continue
-                epm = self.entrants_per_match_period
-                acceptable = True
-                for sm in range(1, self.separation+1):
-                    overlap = 1 + self.separation - sm
-                    dst_a = 0
-                    dst_b = epm * overlap
-                    src_a = (self.round_length-sm)*epm
-                    src_b = (1+self.round_length-sm)*epm
-                    src = set((a*x + c) % m for x in range(src_a, src_b))
-                    dst = set(range(dst_a, dst_b))
-                    if not src.isdisjoint(dst):
-                        acceptable = False
-                if not acceptable:
-                    continue
-                self._lcg_params = (a, c)
-                self.lprint('Found LCG settings: ({}, {})'.format(a, c))
-                return
-        self.lprint('No valid LCG parameters')
-        self._lcg_params = None
+        epm = self.entrants_per_match_period
+        # Hull-Dobell: c must be coprime to m and a - 1 divisible by each
+        # prime factor of m; a - 1 is also always required to be divisible
+        # by 4. So a - 1 steps through multiples of their lcm.
+        step = 4
+        for factor in set(prime_factors(m)):
+            if step % factor != 0:
+                step *= factor
+        increments = [c for c in range(m - 1, 0, -1) if gcd(c, m) == 1]
+        if not increments:
+            return None
+        # The source positions at the end of a round, each paired with the
+        # number of places at the start of the next round it mustn't land in
+        sources = []
+        limits = []
+        for sm in range(1, self.separation+1):
+            overlap = 1 + self.separation - sm
+            src_a = (self.round_length-sm)*epm
+            sources.extend(range(src_a, src_a + epm))
+            limits.extend([epm * overlap] * epm)
+        multipliers = range((m - 2) // step * step + 1, 1, -step)
+
+        try:
+            import numpy as np
+        except ImportError:
+            bounds = list(zip(sources, limits))
+            for a in multipliers:
+                for c in increments:
+                    if all((a * source + c) % m >= limit
+                           for source, limit in bounds):
+                        return [a, c]
+            return None
+
+        increments = np.array(increments)
+        sources = np.array(sources, dtype=np.int64).reshape(-1, 1)
+        limits = np.array(limits, dtype=np.int64).reshape(-1, 1)
+        for a in multipliers:
+            acceptable = ((a * sources + increments) % m >= limits).all(axis=0)
+            found = np.flatnonzero(acceptable)
+            if len(found):
+                return [a, int(increments[found[0]])]
+        return None
 
     def _lcg_permute(self, teams):
         if self._lcg_params is None:
@@ -188,42 +713,581 @@ class Scheduler(object):
             raise ValueError('permutation fault')
         return permutation
 
-    def run(self):
-        matchup_impatience = PatienceCounter(200000)
-        max_matchups = self.max_matchups
-        matches = list(self._base_matches)
-        teams = list(self._teams)
-        self.random.shuffle(teams)
-        while (len(matches) < self.total_matches and
-               len(matches) + self.round_length <= self.max_match_periods):
-            this_round = len(matches) // self.round_length
-            self.lprint('Scheduling round {round} ({prev}/{tot} complete)'.format(
-                            round=this_round,
-                            prev=len(matches),
-                            tot=self.total_matches))
-            # Attempt the LCG
-            lcg_round = self._lcg_permute(teams)
-            if lcg_round is not None:
-                matches_prime = matches + self._match_partition(lcg_round)
-                if self._validate(matches_prime, max_matchups, matchup_impatience.bump):
-                    matches = matches_prime
-                    self.lprint('  completed via LCG permutation')
+    def _adapt_matchup_limit(self, num_matches, accepted, ticks):
+        decision = self._relaxation.end_round(num_matches, accepted, ticks)
+        if decision is None:
+            return
+        self._matchup_limit = self._relaxation.limit
+        if decision['action'] == 'relax':
+            self.lprint('  Easing off on matchup constraint, to {matchup_limit}: '
+                        '{stalled} rounds not found without progress, with '
+                        '{share:.0%} of rejections for repeated matchups'.format(
+                            share=decision['matchup_share'], **decision))
+            self.stats['relaxations'] += 1
+        else:
+            self.lprint('  Tightening matchup constraint again, to {matchup_limit}: '
+                        '{easy_rounds} rounds found with few repeated '
+                        'matchups'.format(**decision))
+            self.stats['tightenings'] += 1
+        self._report('relaxation', **decision)
+
+    def _shuffle_round(self, state, teams):
+        for tick in range(ROUND_TICKS):
+            self.stats['ticks'] += 1
+            self.random.shuffle(teams)
+            if state.check(teams, self._matchup_limit,
+                           self._relaxation.bump):
+                return list(teams)
+        return None
+
+    def _batch_round(self, state, teams):
+        import numpy as np
+
+        encoded = np.array(teams)
+        last_appearance = np.asarray(state.last_appearance)
+        matchups = np.asarray(state.matchups)
+
+        rng = np.random.RandomState(self.random.randrange(2**32))
+        for tick in range(0, ROUND_TICKS, BATCH_SIZE):
+            self.stats['ticks'] += BATCH_SIZE
+            permutations = np.argsort(rng.random_sample((BATCH_SIZE, len(teams))),
+                                      axis=1)
+            candidates = encoded[permutations]
+            valid, matchup_failures = check_batch(candidates,
+                                                  self.num_corners,
+                                                  self.entrants_per_match_period,
+                                                  self._num_real_teams,
+                                                  self.separation,
+                                                  len(state),
+                                                  last_appearance,
+                                                  matchups,
+                                                  self._matchup_limit,
+                                                  self._num_pool_teams)
+            self._relaxation.reject('matchups', int(matchup_failures.sum()))
+            accepted = np.flatnonzero(valid)
+            if len(accepted):
+                return candidates[accepted[0]].tolist()
+        return None
+
+    def _propagate_round(self, state, teams):
+        for attempt in range(PROPAGATE_ATTEMPTS):
+            self.stats['ticks'] += 1
+            entries = self._build_round(state, teams)
+            if entries is not None:
+                return entries
+        return None
+
+    def _build_round(self, state, teams):
+        """
+        Build a round slot-by-slot, only ever placing teams which are
+        eligible given what's been placed so far, backtracking (within a
+        bounded number of placements) on dead ends.
+        """
+        num_real_teams = self._num_real_teams
+        num_corners = self.num_corners
+        epm = self.entrants_per_match_period
+        separation = self.separation
+        matchup_limit = self._matchup_limit
+        first_match = len(state)
+        num_matches = len(teams) // epm
+        matchups = state.matchups
+        last_appearance = state.last_appearance
+
+        remaining = Counter(team for team in teams if team < num_real_teams)
+        pseudo_teams = [team for team in teams if team >= num_real_teams]
+        last = {}
+        new_matchups = Counter()
+        entries = []
+        placements = [PROPAGATE_PLACEMENTS]
+        # Options are checked afresh each time a position is revisited, so
+        # these only say what mostly got in the way, not how many
+        # candidates were rejected
+        rejections = Counter()
+
+        def last_seen(team):
+            return last.get(team, last_appearance[team])
+
+        def pair_index(a, b):
+            if a > b:
+                return a * (a - 1) // 2 + b
+            return b * (b - 1) // 2 + a
+
+        def can_fit_remaining(slot):
+            # Forward check: each remaining appearance has an earliest slot
+            # it can go in; there must be room for them all from there on.
+            earliest = Counter()
+            for team, copies in remaining.items():
+                match_id = max(last_seen(team) + separation + 1,
+                               first_match + slot)
+                for n in range(copies):
+                    earliest[match_id - first_match] += 1
+                    match_id += separation + 1
+            later = sum(earliest.values())
+            for slot in range(slot, num_matches):
+                later -= earliest[slot]
+                if later > (num_matches - 1 - slot) * epm:
+                    return False
+            return True
+
+        def options(position):
+            match_id = first_match + position // epm
+            game = entries[position - position % num_corners:]
+            opponents = [entrant for entrant in game if entrant < num_real_teams]
+            num_pseudo = len(game) - len(opponents)
+            eligible = []
+            if num_pseudo <= 1:
+                for team, copies in remaining.items():
+                    if not copies:
+                        continue
+                    if match_id - last_seen(team) <= separation:
+                        rejections['separation'] += 1
+                        continue
+                    if any(matchups[index] + new_matchups[index] >= matchup_limit
+                           for index in (pair_index(team, opponent)
+                                         for opponent in opponents)):
+                        rejections['matchups'] += 1
+                        continue
+                    eligible.append(team)
+                # Randomise, but place teams with more appearances left to
+                # make first since they need spreading out
+                self.random.shuffle(eligible)
+                eligible.sort(key=lambda team: -remaining[team])
+            # A second pseudo-team is only allowed in a game if the whole
+            # game can be made up of them
+            if pseudo_teams and (num_pseudo == 0 or
+                                 (not opponents and
+                                  len(pseudo_teams) >= num_corners - len(game))):
+                eligible.insert(self.random.randint(0, len(eligible)), None)
+            return eligible, opponents
+
+        def place(position):
+            if position == len(teams):
+                return True
+            if position % epm == 0 and not can_fit_remaining(position // epm):
+                return False
+            eligible, opponents = options(position)
+            for team in eligible:
+                placements[0] -= 1
+                if placements[0] < 0:
+                    return False
+                if team is None:
+                    entries.append(pseudo_teams.pop())
+                    if place(position + 1):
+                        return True
+                    pseudo_teams.append(entries.pop())
                     continue
-            for tick in range(10000):
-                if matchup_impatience.reached():
-                    matchup_impatience.reset()
-                    self.lprint('  Easing off on matchup constraint.')
-                    max_matchups += 1
-                self.random.shuffle(teams)
-                matches_prime = matches + self._match_partition(teams)
-                if self._validate(matches_prime, max_matchups, matchup_impatience.bump):
-                    matches = matches_prime
+                indices = [pair_index(team, opponent) for opponent in opponents]
+                previous = last.get(team)
+                entries.append(team)
+                remaining[team] -= 1
+                last[team] = first_match + position // epm
+                new_matchups.update(indices)
+                if place(position + 1):
+                    return True
+                new_matchups.subtract(indices)
+                if previous is None:
+                    del last[team]
+                else:
+                    last[team] = previous
+                remaining[team] += 1
+                entries.pop()
+            return False
+
+        found = place(0)
+        self.stats['placements'] += PROPAGATE_PLACEMENTS - max(placements[0], 0)
+        if found:
+            return entries
+        if rejections:
+            # Count the failed attempt once, as a single rejected candidate
+            # would be, against whatever mostly got in its way
+            reason, _ = rejections.most_common(1)[0]
+            self._relaxation.reject(reason)
+        return None
+
+    def _conflict_positions(self, state, previous):
+        """
+        Find the positions in the last accepted round, ``previous``, of the
+        teams most likely to be blocking the next one: those close enough
+        to its end to collide with the start of the next round, and those
+        in games with a matchup which has reached the limit.
+        """
+        num_real_teams = self._num_real_teams
+        num_corners = self.num_corners
+        boundary = len(previous) - self.separation * self.entrants_per_match_period
+        positions = set(range(max(0, boundary), len(previous)))
+        for start in range(0, len(previous), num_corners):
+            game = previous[start:start+num_corners]
+            for index in state._pair_indices(game):
+                if state.matchups[index] >= self._matchup_limit:
+                    positions.update(n for n in range(start, start+num_corners)
+                                     if previous[n] < num_real_teams)
                     break
+        return sorted(positions)
+
+    def _replace_positions(self, state, previous, positions):
+        """
+        Re-place the teams at the given positions of a round by swapping
+        each of them with a team from elsewhere in the round, leaving the
+        rest of the round where it was.
+        """
+        others = [n for n in range(len(previous)) if n not in set(positions)]
+        if not others:
+            return None
+        for tick in range(PARTIAL_BACKTRACK_TICKS):
+            self.stats['ticks'] += 1
+            candidate = list(previous)
+            for position, other in zip(positions,
+                                       self.random.sample(others,
+                                                          min(len(others),
+                                                              len(positions)))):
+                candidate[position], candidate[other] = candidate[other], candidate[position]
+            if state.check(candidate, self._matchup_limit):
+                return candidate
+        return None
+
+    def _partial_backtrack(self, state, teams, search_round):
+        """
+        Having failed to find the next round, re-place just the conflicting
+        part of the previous round and search again. Returns the next round
+        if that works, otherwise None with the previous round dropped.
+        """
+        epm = self.entrants_per_match_period
+        previous = state.entries[(len(state) - self.round_length) * epm:
+                                 len(state) * epm].tolist()
+        positions = self._conflict_positions(state, previous)
+        state.pop(self.round_length)
+        for attempt in range(PARTIAL_BACKTRACK_ATTEMPTS):
+            replaced = self._replace_positions(state, previous, positions)
+            if replaced is None:
+                continue
+            state.push(replaced)
+            round_entries = search_round(state, teams)
+            if round_entries is not None:
+                return round_entries
+            state.pop(self.round_length)
+        return None
+
+    def _repair_round(self, state, teams):
+        from sr.comp.cli.league_repair import ScheduleRepairer, frozen_penalty
+
+        accepted = state.entries[:len(state)*self.entrants_per_match_period].tolist()
+        candidate = list(teams)
+        self.random.shuffle(candidate)
+        repairer = ScheduleRepairer(self, accepted + candidate, len(state),
+                                    self._matchup_limit)
+        target = frozen_penalty(self, accepted, len(state), self._matchup_limit)
+        entries, penalty = repairer.run(self.repair_time, target)
+        round_entries = entries[len(accepted):]
+        if penalty == target and state.check(round_entries, self._matchup_limit):
+            self.lprint('  completed via repair')
+            self.stats['repaired_rounds'] += 1
+            return round_entries
+        return None
+
+    def _checkpoint_settings(self):
+        lcg_params = self._lcg_params
+        if lcg_params is not None:
+            lcg_params = list(lcg_params)
+        return {'team_names': self._team_names,
+                'arenas': list(self.arenas),
+                'num_corners': self.num_corners,
+                'max_match_periods': self.max_match_periods,
+                'appearances_per_round': self.appearances_per_round,
+                'separation': self.separation,
+                'max_matchups': self.max_matchups,
+                'strategy': self.strategy,
+                'lcg_params': lcg_params,
+                'base_matches': self._base_matches}
+
+    def _checkpoint(self, state, teams):
+        version, internal_state, gauss_next = self.random.getstate()
+        epm = self.entrants_per_match_period
+        return {'settings': self._checkpoint_settings(),
+                'entries': state.entries[:len(state)*epm].tolist(),
+                'teams': list(teams),
+                'random_state': [version, list(internal_state), gauss_next],
+                'matchup_limit': self._matchup_limit,
+                'relaxation': self._relaxation.checkpoint(),
+                'stream_seed': self._stream_seed,
+                'stats': dict(self.stats)}
+
+    def _update_checkpoint(self, state, teams):
+        if self.checkpoint_file is None:
+            return
+        self._checkpoint_data = self._checkpoint(state, teams)
+        if time.time() - self._last_checkpoint >= self.checkpoint_interval:
+            save_checkpoint(self.checkpoint_file, self._checkpoint_data)
+            self._last_checkpoint = time.time()
+
+    def _resume(self, state, checkpoint):
+        if checkpoint['settings'] != self._checkpoint_settings():
+            raise ValueError('Checkpoint was made with different settings')
+        version, internal_state, gauss_next = checkpoint['random_state']
+        self.random.setstate((version, tuple(internal_state), gauss_next))
+        self._matchup_limit = checkpoint['matchup_limit']
+        self._relaxation.restore(checkpoint['relaxation'])
+        self.stats.update(checkpoint['stats'])
+        state.push(checkpoint['entries'])
+        self.lprint('Resuming from {0} matches'.format(len(state)))
+        return list(checkpoint['teams'])
+
+    def run(self, resume=None):
+        """
+        Generate the schedule, either from scratch (after the base matches)
+        or continuing from a ``resume`` checkpoint as saved while running
+        with ``checkpoint_file`` set.
+        """
+        self.stats = Counter()
+        self.round_stats = []
+        self._start_time = time.time()
+        self._last_checkpoint = self._start_time
+        self._checkpoint_data = None
+        self._stream_seed = None
+        self._relaxation = RelaxationPolicy(self.max_matchups)
+        self._matchup_limit = self.max_matchups
+        search_round = {'shuffle': self._shuffle_round,
+                        'batch': self._batch_round,
+                        'propagate': self._propagate_round}[self.strategy]
+        state = ScheduleState(self, max(self.max_match_periods,
+                                        len(self._base_matches)))
+        if resume is None:
+            state.push([entrant for match in self._base_matches for entrant in match])
+            teams = list(self._teams)
+            self.random.shuffle(teams)
+            if self.construct and not self._base_matches:
+                self._try_constructions(state)
+        else:
+            # Continue exactly where the checkpointed run left off
+            teams = self._resume(state, resume)
+        if self.stream is not None:
+            if resume is None:
+                self._start_stream(self.random.getrandbits(32))
             else:
-                if len(matches) > len(self._base_matches):
+                # The random numbers have been restored to where the run
+                # left off, so mustn't be drawn from again; any seed will do
+                # if the resumed run wasn't streamed
+                self._start_stream(resume.get('stream_seed') or 0)
+            self._update_stream(state)
+        self.lprint('Relaxing the matchup limit after {0} rounds not found '
+                    'without progress, if at least {1:.0%} of rejections are '
+                    'for repeated matchups'.format(RELAX_STALLED_ATTEMPTS,
+                                               RELAX_MATCHUP_SHARE))
+        self._report('start',
+                     strategy=self.strategy,
+                     teams=self._num_real_teams,
+                     round_length=self.round_length,
+                     total_matches=self.total_matches,
+                     base_matches=len(self._base_matches),
+                     relax_stalled_attempts=RELAX_STALLED_ATTEMPTS,
+                     relax_matchup_share=RELAX_MATCHUP_SHARE)
+        try:
+            while (len(state) < self.total_matches and
+                   len(state) + self.round_length <= self.max_match_periods):
+                this_round = len(state) // self.round_length
+                self.lprint('Scheduling round {round} ({prev}/{tot} complete)'.format(
+                                round=this_round,
+                                prev=len(state),
+                                tot=self.total_matches))
+                round_start = time.time()
+                round_ticks = self.stats['ticks']
+                self.stats['round_attempts'] += 1
+                # Attempt the LCG
+                outcome = 'lcg'
+                round_entries = self._lcg_permute(teams)
+                if round_entries is not None:
+                    if state.check(round_entries, self._matchup_limit,
+                                   self._relaxation.bump):
+                        self.lprint('  completed via LCG permutation')
+                        self.stats['lcg_rounds'] += 1
+                    else:
+                        round_entries = None
+                if round_entries is None:
+                    outcome = 'search'
+                    round_entries = search_round(state, teams)
+                if round_entries is None and self.repair_time:
+                    outcome = 'repair'
+                    round_entries = self._repair_round(state, teams)
+                if (round_entries is None and
+                        len(state) - self.round_length >= len(self._base_matches)):
+                    # Rather than dropping the whole of the previous round,
+                    # first try moving just the teams which are in the way
+                    round_entries = self._partial_backtrack(state, teams,
+                                                            search_round)
+                    if round_entries is not None:
+                        outcome = 'partial'
+                        self.lprint('  completed after re-placing part of '
+                                    'the previous round')
+                        self.stats['partial_backtracks'] += 1
+                    else:
+                        outcome = 'backtrack'
+                        self.lprint('  backtracking')
+                        self.stats['backtracks'] += 1
+                if round_entries is not None:
+                    state.push(round_entries)
+                    self.stats['rounds'] += 1
+                elif outcome == 'backtrack':
+                    # The previous round has already been dropped
+                    pass
+                elif len(state) > len(self._base_matches):
+                    outcome = 'backtrack'
                     self.lprint('  backtracking')
-                    matches = matches[:-self.round_length]
-        return self._clean(matches)
+                    self.stats['backtracks'] += 1
+                    state.pop(self.round_length)
+                else:
+                    outcome = 'retry'
+                self._adapt_matchup_limit(len(state), round_entries is not None,
+                                          self.stats['ticks'] - round_ticks)
+                self._update_stream(state)
+                self._report_round(this_round, outcome, round_start, round_ticks,
+                                   len(state))
+                self._update_checkpoint(state, teams)
+        except KeyboardInterrupt:
+            if self._checkpoint_data is not None:
+                self.lprint('Interrupted, saving checkpoint')
+                save_checkpoint(self.checkpoint_file, self._checkpoint_data)
+            raise
+        self._report('finish',
+                     matches=len(state),
+                     ticks=self.stats['ticks'],
+                     backtracks=self.stats['backtracks'])
+        if self.checkpoint_file is not None:
+            save_checkpoint(self.checkpoint_file, self._checkpoint(state, teams))
+        if self.stream is not None:
+            return {match_id: self._match_data(games)
+                    for match_id, (entries, games) in enumerate(self._streamed)}
+        return self._clean(state.matches)
+
+    def _start_stream(self, seed):
+        self._streamed = []
+        self._stream_balancer = CornerBalancer(self.num_corners,
+                                               self._num_real_teams)
+        # Kept apart so that streaming doesn't change the search itself
+        self._stream_seed = seed
+        self._stream_random = random.Random(seed)
+
+    def _update_stream(self, state):
+        """
+        Bring the stream into line with the accepted matches: take back any
+        which have changed since they were streamed, then stream any new
+        ones with their corners balanced against those before them.
+        """
+        if self.stream is None:
+            return
+        epm = self.entrants_per_match_period
+        streamed = self._streamed
+        balancer = self._stream_balancer
+        keep = 0
+        while (keep < min(len(streamed), len(state)) and
+               streamed[keep][0] == state.entries[keep*epm:(keep+1)*epm]):
+            keep += 1
+        for entries, games in streamed[keep:]:
+            for game in games:
+                balancer.add(game, -1)
+        del streamed[keep:]
+        self.stream.truncate(keep)
+        for match_id in range(keep, len(state)):
+            entries = state.entries[match_id*epm:(match_id+1)*epm]
+            games = []
+            for start in range(0, epm, self.num_corners):
+                game = entries[start:start+self.num_corners].tolist()
+                if match_id >= len(self._base_matches):
+                    self._stream_random.shuffle(game)
+                    game = balancer.arrange(game)
+                balancer.add(game)
+                games.append(game)
+            streamed.append((entries, games))
+            self.stream.write(match_id, self._match_data(games))
+        self.stream.flush()
+
+    def _try_constructions(self, state):
+        from sr.comp.cli.league_constructions import Constructor
+
+        constructed = Constructor(self).construct()
+        if constructed is not None:
+            name, entries = constructed
+            state.push(entries)
+            self.stats['constructed'] = 1
+            self.lprint('Constructed schedule using the {0} construction'.format(name))
+
+    def _report_round(self, this_round, outcome, round_start, round_ticks,
+                      num_matches):
+        stats = self.stats
+        data = self._report('round',
+                            round=this_round,
+                            outcome=outcome,
+                            time=round(time.time() - round_start, 4),
+                            ticks=stats['ticks'] - round_ticks,
+                            total_ticks=stats['ticks'],
+                            acceptance_rate=round(stats['rounds'] /
+                                                  stats['round_attempts'], 4),
+                            backtracks=stats['backtracks'],
+                            partial_backtracks=stats['partial_backtracks'],
+                            lcg_rounds=stats['lcg_rounds'],
+                            matchup_limit=self._matchup_limit,
+                            matchup_share=round(self._relaxation.matchup_share, 4),
+                            rejections=dict(self._relaxation.last_rejections),
+                            stalled=self._relaxation.stalled,
+                            matches=num_matches,
+                            total_matches=self.total_matches)
+        self.round_stats.append(data)
+
+    def repair(self, time_limit, frozen=0):
+        """
+        Repair the base matches, leaving the first ``frozen`` of them as
+        they are, by simulated annealing for up to ``time_limit`` seconds.
+        """
+        from sr.comp.cli.league_repair import ScheduleRepairer, frozen_penalty
+
+        entries = [entrant for match in self._base_matches for entrant in match]
+        repairer = ScheduleRepairer(self, entries, frozen)
+        target = frozen_penalty(self, entries, frozen)
+        self.lprint('Repairing schedule with penalty {0} (best possible {1})'.format(
+                        repairer.penalty, target))
+        entries, penalty = repairer.run(time_limit, target)
+        self.lprint('Repaired schedule has penalty {0}'.format(penalty))
+        return self._clean(self._match_partition(entries))
+
+    def reschedule(self, frozen, repair_time):
+        """
+        Reschedule the base matches after the first ``frozen`` of them,
+        changing as few as possible: the rest are kept if they're still
+        valid, otherwise repaired for up to ``repair_time`` seconds, and
+        only if that fails are they replaced by a fresh search.
+        """
+        from sr.comp.cli.league_repair import ScheduleRepairer, frozen_penalty
+
+        frozen_matches = self._base_matches[:frozen]
+        if not self._validate(frozen_matches):
+            self.lprint('Warning: the frozen matches already break the constraints')
+
+        remaining_teams = set(entrant for match in self._base_matches[frozen:]
+                              for entrant in match
+                              if not self._is_pseudo(entrant))
+        teams = set(team for team in self._teams if not self._is_pseudo(team))
+        if remaining_teams != teams:
+            self.lprint('The remaining matches don\'t include every team, '
+                        'so must be scheduled afresh')
+        elif self._validate(self._base_matches):
+            self.lprint('The remaining matches are still valid')
+            return self._clean(self._base_matches)
+        elif repair_time:
+            entries = [entrant for match in self._base_matches for entrant in match]
+            repairer = ScheduleRepairer(self, entries, frozen)
+            target = frozen_penalty(self, entries, frozen)
+            self.lprint('Repairing the remaining matches')
+            entries, penalty = repairer.run(repair_time, target)
+            if penalty == target:
+                return self._clean(self._match_partition(entries))
+
+        self.lprint('Searching for new matches after match {0}'.format(frozen))
+        num_old_matches = len(self._base_matches)
+        self._base_matches = frozen_matches
+        output = self.run()
+        if len(output) < num_old_matches:
+            self.lprint('Warning: the rescheduled league has {0} matches, '
+                        'fewer than the {1} before'.format(len(output),
+                                                          num_old_matches))
+        return output
 
     def _match_partition(self, teams):
         entries = []
@@ -232,15 +1296,30 @@ class Scheduler(object):
         return entries
 
     def _clean(self, matches):
-        def get_match(match_id, match):
-            data = {}
+        games = []
+        for match_id, match in enumerate(matches):
             for arena_id, arena in enumerate(self.arenas):
                 entrants = match[arena_id*self.num_corners:(arena_id+1)*self.num_corners]
-                # Shuffle entrants to get statistically sensible zone distribution
+                # Shuffle entrants, so that balancing starts from (and breaks
+                # ties with) a statistically sensible zone distribution
                 if match_id >= len(self._base_matches): # don't shuffle provided matches!
                     self.random.shuffle(entrants)
-                entrants = [None if self._is_pseudo(entrant) else entrant
-                             for entrant in entrants]
-                data[arena] = entrants
-            return data
-        return {match_id: get_match(match_id, match) for match_id, match in enumerate(matches)}
+                games.append(entrants)
+        # Then even out the corners each team starts in, again leaving the
+        # provided matches alone
+        balancer = CornerBalancer(self.num_corners, self._num_real_teams)
+        balancer.balance(games, len(self._base_matches) * len(self.arenas))
+
+        num_arenas = len(self.arenas)
+        return {match_id: self._match_data(games[match_id*num_arenas:
+                                                 (match_id+1)*num_arenas])
+                for match_id in range(len(matches))}
+
+    def _match_data(self, games):
+        """The output form of a match, given its games in arena order."""
+        data = {}
+        for arena, entrants in zip(self.arenas, games):
+            data[arena] = [None if self._is_pseudo(entrant)
+                           else self._team_names[entrant]
+                           for entrant in entrants]
+        return data
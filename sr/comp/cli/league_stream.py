@@ -0,0 +1,47 @@
+"""
+Streaming of a league schedule to a file while it's being generated.
+"""
+
+import yaml
+
+
+class ScheduleStream(object):
+    """
+    Write a schedule to a file a match at a time, in the same form as the
+    output of ``schedule-league``, truncating it again when matches are
+    taken back by backtracking. The file always holds just the matches
+    accepted so far, so it can be reviewed (or imported) while the rest of
+    the schedule is still being searched for.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w')
+        self.file.write('matches:\n')
+        self.file.flush()
+        # Offset in the file at which each match starts
+        self.offsets = []
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def write(self, match_id, match):
+        if match_id != len(self.offsets):
+            raise ValueError('Match {0} streamed out of order'.format(match_id))
+        self.offsets.append(self.file.tell())
+        text = yaml.dump({match_id: match}, default_flow_style=False)
+        self.file.write(''.join('  ' + line for line in text.splitlines(True)))
+
+    def truncate(self, num_matches):
+        """Take back all but the first ``num_matches`` matches."""
+        if num_matches >= len(self.offsets):
+            return
+        self.file.seek(self.offsets[num_matches])
+        self.file.truncate()
+        del self.offsets[num_matches:]
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -10,62 +10,222 @@ def max_possible_match_periods(sched_db):
                              timedelta())
     return int(total_league_time.total_seconds() // match_period_length)
 
+def live_cut_over(comp, margin):
+    """
+    The first league match which can still be changed in a live
+    reschedule: the one after every match which has been scored or which
+    is due to start within ``margin`` of now.
+    """
+    from datetime import datetime
+
+    cut_over = 0
+    for arena, num in comp.scores.league.game_points:
+        cut_over = max(cut_over, num + 1)
+    horizon = datetime.now(comp.timezone) + margin
+    for slot in comp.schedule.matches:
+        for match in slot.values():
+            if match.type.value == 'league' and match.start_time < horizon:
+                cut_over = max(cut_over, match.num + 1)
+    return cut_over
+
+def league_matches(comp, arenas):
+    """The teams in each league match of a compstate, arena by arena."""
+    matches = []
+    for slot in comp.schedule.matches:
+        if not any(match.type.value == 'league' for match in slot.values()):
+            continue
+        match_slot = []
+        for arena in arenas:
+            match_slot.extend(slot[arena].teams)
+        matches.append(match_slot)
+    return matches
+
+def count_changed_matches(old_matches, new_matches, arenas, first):
+    """
+    Count the matches from ``first`` on which differ between the old
+    matches (as from ``league_matches``) and the new ones (as output by
+    the scheduler), including any which only one of them has.
+    """
+    num_matches = max([len(old_matches)] + [num + 1 for num in new_matches])
+    changed = 0
+    for num in range(first, num_matches):
+        if num >= len(old_matches) or num not in new_matches:
+            changed += 1
+            continue
+        new_slot = []
+        for arena in arenas:
+            new_slot.extend(new_matches[num][arena])
+        if new_slot != old_matches[num]:
+            changed += 1
+    return changed
+
 def command(args):
-    from multiprocessing import Pool
     import os.path
     import random
     import sys
     import yaml
 
-    from sr.comp.cli.league_scheduler import Scheduler
+    from sr.comp.cli.league_portfolio import (build_scheduler, describe_spec,
+                                              run_anytime, run_portfolio,
+                                              worker_spec, worker_specs)
+    from sr.comp.cli.league_quality import describe_quality
+    from sr.comp.cli.league_scheduler import load_checkpoint
+
+    if (args.checkpoint or args.resume) and (args.parallel > 1 or args.coordinate):
+        print('Checkpoints are only supported when searching in a single process')
+        exit(1)
+
+    if args.live and (args.parallel > 1 or args.coordinate or args.repair or
+                      args.time_limit is not None or args.reschedule_from):
+        print('Live rescheduling finds its own starting point, in a single process')
+        exit(1)
+
+    if args.stream and (args.parallel > 1 or args.coordinate or args.live or
+                        args.time_limit is not None or args.repair):
+        print('Streaming is only supported when searching in a single process')
+        exit(1)
+
+    if args.coordinate and args.time_limit is not None:
+        print('Searching for a time limit is only supported on this machine')
+        exit(1)
 
     with open(os.path.join(args.compstate, 'arenas.yaml')) as f:
         arenas_db = yaml.load(f)
-        arenas = arenas_db['arenas'].keys()
+        arenas = list(arenas_db['arenas'].keys())
         num_corners = len(arenas_db['corners'])
 
     with open(os.path.join(args.compstate, 'teams.yaml')) as f:
-        teams = yaml.load(f)['teams'].keys()
+        teams = list(yaml.load(f)['teams'].keys())
 
     with open(os.path.join(args.compstate, 'schedule.yaml')) as f:
         sched_db = yaml.load(f)
         max_periods = max_possible_match_periods(sched_db)
 
+    if args.live:
+        from datetime import timedelta
+
+        from sr.comp.comp import SRComp
+
+        comp = SRComp(os.path.realpath(args.compstate))
+        matches_db = league_matches(comp, arenas)
+        num_base_matches = len(matches_db)
+        max_periods = max(max_periods, num_base_matches)
+        cut_over = live_cut_over(comp, timedelta(minutes=args.live_margin))
+        teams = [tla for tla in teams if comp.teams[tla].is_still_around(cut_over)]
+        print('Rescheduling from match {0}'.format(cut_over), file=sys.stderr)
+    elif args.repair:
+        with open(args.repair) as f:
+            matches_db = yaml.load(f)['matches']
+        num_base_matches = len(matches_db)
+        max_periods = max(max_periods, num_base_matches)
+    else:
+        matches_db = sched_db['matches']
+        num_base_matches = args.reschedule_from
+
     base_matches = []
-    for n in range(args.reschedule_from):
+    for n in range(num_base_matches):
         match_slot = []
-        for arena in arenas:
-            match_slot.extend(sched_db['matches'][n][arena])
+        if args.live:
+            match_slot = matches_db[n]
+        else:
+            for arena in arenas:
+                match_slot.extend(matches_db[n][arena])
         base_matches.append(match_slot)
 
-    scheduler = Scheduler(teams=teams,
-                          max_match_periods=max_periods,
-                          arenas=arenas,
-                          num_corners=num_corners,
-                          separation=args.spacing,
-                          max_matchups=args.max_repeated_matchups,
-                          appearances_per_round=args.appearances_per_round,
-                          base_matches=base_matches,
-                          enable_lcg=args.lcg)
-    if args.parallel > 1:
-        scheduler.lprint('Using {} threads'.format(args.parallel))
-        pool = Pool(args.parallel)
-        def get_output(data):
-            yaml.dump({'matches': data}, sys.stdout)
-            pool.terminate()
-        for n in range(args.parallel):
-            scheduler.random = random.Random()
-            scheduler.tag = '[Thread {}] '.format(n)
-            pool.apply_async(scheduler.run,
-                             callback=get_output)
-        pool.close()
-        pool.join()
+    options = dict(teams=teams,
+                   max_match_periods=max_periods,
+                   arenas=arenas,
+                   num_corners=num_corners,
+                   separation=args.spacing,
+                   max_matchups=args.max_repeated_matchups,
+                   appearances_per_round=args.appearances_per_round,
+                   base_matches=base_matches,
+                   repair_time=args.repair_time or 0,
+                   construct=args.construct)
+
+    on_progress = None
+    if args.telemetry_fd is not None:
+        import json
+
+        telemetry = os.fdopen(args.telemetry_fd, 'w')
+
+        def on_progress(event):
+            telemetry.write(json.dumps(event, sort_keys=True) + '\n')
+            telemetry.flush()
+
+    seed = args.seed
+    if seed is None:
+        seed = random.SystemRandom().randrange(2**31)
+    num_workers = max(args.parallel, 1)
+    if args.time_limit is not None and args.parallel <= 1:
+        from multiprocessing import cpu_count
+        num_workers = cpu_count()
+    specs = worker_specs(seed, num_workers, args.strategy, args.lcg,
+                         vary=args.portfolio)
+
+    if args.live:
+        scheduler = build_scheduler(options, specs[0])
+        scheduler.on_progress = on_progress
+        output_data = scheduler.reschedule(cut_over, args.repair_time or 60)
+        print('Changed {0} of the {1} matches from match {2}'.format(
+                  count_changed_matches(matches_db, output_data, arenas, cut_over),
+                  len(matches_db) - cut_over, cut_over),
+              file=sys.stderr)
+    elif args.repair:
+        scheduler = build_scheduler(options, specs[0])
+        output_data = scheduler.repair(args.repair_time or 60,
+                                       frozen=args.reschedule_from)
+    elif args.time_limit is not None:
+        print('Searching for {0}s using {1} processes'.format(args.time_limit,
+                                                             num_workers),
+              file=sys.stderr)
+        spec, quality, output_data = run_anytime(options, specs,
+                                                 args.time_limit, on_progress)
+        print('Best schedule found with {0}: {1}'.format(describe_spec(spec),
+                                                        describe_quality(quality)),
+              file=sys.stderr)
+    elif args.coordinate:
+        from sr.comp.cli.league_distributed import Coordinator, parse_address
+
+        def spec_for_worker(worker_id):
+            return worker_spec(seed, worker_id, args.strategy, args.lcg,
+                               vary=args.portfolio)
+
+        coordinator = Coordinator(parse_address(args.coordinate), options,
+                                  spec_for_worker, on_progress)
+        spec, output_data = coordinator.run()
+        print('Schedule found with {0}'.format(describe_spec(spec)),
+              file=sys.stderr)
+    elif args.parallel > 1:
+        print('Using {0} processes'.format(args.parallel), file=sys.stderr)
+        spec, output_data = run_portfolio(options, specs, on_progress)
+        print('Schedule found with {0}'.format(describe_spec(spec)),
+              file=sys.stderr)
     else:
-        output_data = scheduler.run()
-        yaml.dump({'matches': output_data}, sys.stdout)
+        print('Using {0}'.format(describe_spec(specs[0])), file=sys.stderr)
+        scheduler = build_scheduler(options, specs[0])
+        scheduler.on_progress = on_progress
+        scheduler.checkpoint_file = args.checkpoint or args.resume
+        scheduler.checkpoint_interval = args.checkpoint_interval
+        resume = None
+        if args.resume:
+            resume = load_checkpoint(args.resume)
+        if args.stream:
+            from sr.comp.cli.league_stream import ScheduleStream
+
+            scheduler.stream = ScheduleStream(args.stream)
+        try:
+            output_data = scheduler.run(resume)
+        finally:
+            if scheduler.stream is not None:
+                scheduler.stream.close()
+
+    yaml.dump({'matches': output_data}, sys.stdout)
 
 
 def add_subparser(subparsers):
+    from sr.comp.cli.league_scheduler import STRATEGIES
+
     parser = subparsers.add_parser('schedule-league',
                                    help='generate a schedule for a league')
     parser.add_argument('compstate',
@@ -87,12 +247,96 @@ def add_subparser(subparsers):
                         action='store_true',
                         dest='lcg',
                         help='enable LCG permutation')
+    parser.add_argument('--no-constructions',
+                        action='store_false',
+                        dest='construct',
+                        help="don't try building the schedule directly from a "
+                             "combinatorial design before searching")
+    parser.add_argument('--strategy',
+                        choices=STRATEGIES,
+                        default='shuffle',
+                        help='how to search for each round; batch checks many '
+                             'shuffles at once using numpy, propagate builds each '
+                             'round slot by slot (default: %(default)s)')
     parser.add_argument('--parallel',
                         type=int,
                         default=1,
-                        help='number of parallel threads')
+                        help='number of processes to search in parallel; the '
+                             'first to find a schedule wins')
+    parser.add_argument('--portfolio',
+                        action='store_true',
+                        help='vary the strategy and LCG setting between the '
+                             'parallel processes or workers')
+    parser.add_argument('--time-limit',
+                        type=float,
+                        metavar='SECONDS',
+                        help='keep generating schedules for this long, using '
+                             'all cores (or --parallel processes), and output '
+                             'the best, preferring fewer repeated matchups, then '
+                             'wider gaps between matches and better corner '
+                             'balance')
+    parser.add_argument('--coordinate',
+                        metavar='HOST:PORT',
+                        help='listen on the given address and hand out the search '
+                             'to workers started with schedule-worker, rather than '
+                             'searching locally')
+    parser.add_argument('--seed',
+                        type=int,
+                        help='random seed; each parallel process uses a seed '
+                             'derived from this one (default: random)')
+    parser.add_argument('--telemetry-fd',
+                        type=int,
+                        metavar='FD',
+                        help='write progress events as JSON lines to the given '
+                             'file descriptor, for example 3 with 3>progress.jsonl')
+    parser.add_argument('--checkpoint',
+                        metavar='FILE',
+                        help='periodically save the progress of the search to '
+                             'the given file')
+    parser.add_argument('--checkpoint-interval',
+                        type=float,
+                        default=60,
+                        metavar='SECONDS',
+                        help='time between checkpoints (default: %(default)s)')
+    parser.add_argument('--resume',
+                        metavar='FILE',
+                        help='continue the search saved in the given checkpoint, '
+                             'which must have been made with the same options; '
+                             'further checkpoints go to the same file unless '
+                             '--checkpoint is given')
+    parser.add_argument('--stream',
+                        metavar='FILE',
+                        help='write each round to the given file as soon as '
+                             'it is accepted, taking rounds back out on '
+                             'backtracking, so that the early rounds can be '
+                             'used before the rest are found; corners are then '
+                             'balanced a match at a time')
     parser.add_argument('-f', '--reschedule-from',
                         type=int,
                         default=0,
                         help='first match to reschedule from')
+    parser.add_argument('--live',
+                        action='store_true',
+                        help='reschedule the rest of the league from the '
+                             'compstate, for example after a team has dropped '
+                             'out, keeping every match which has been scored or '
+                             'is about to start and changing as few of the rest '
+                             'as possible')
+    parser.add_argument('--live-margin',
+                        type=float,
+                        default=10,
+                        metavar='MINUTES',
+                        help='with --live, also keep the matches starting within '
+                             'this long of now (default: %(default)s)')
+    parser.add_argument('--repair',
+                        metavar='LEAGUE_YAML',
+                        help='repair the given schedule rather than generating one; '
+                             'matches before --reschedule-from are left alone')
+    parser.add_argument('--repair-time',
+                        type=float,
+                        metavar='SECONDS',
+                        help='time to spend repairing: the whole schedule with '
+                             '--repair or the remaining matches with --live '
+                             '(default 60), otherwise each round for which the '
+                             'search fails (default: no repair)')
     parser.set_defaults(func=command)
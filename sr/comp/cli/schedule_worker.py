@@ -0,0 +1,14 @@
+def command(args):
+    from sr.comp.cli.league_distributed import run_worker
+
+    run_worker(args.coordinator)
+
+
+def add_subparser(subparsers):
+    parser = subparsers.add_parser('schedule-worker',
+                                   help='search for a league schedule on behalf '
+                                        'of schedule-league --coordinate')
+    parser.add_argument('coordinator',
+                        metavar='HOST:PORT',
+                        help='address of the coordinator')
+    parser.set_defaults(func=command)
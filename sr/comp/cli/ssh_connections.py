@@ -0,0 +1,239 @@
+"""
+Reuse of SSH connections to the hosts being deployed to.
+
+Deploying to a host needs an SSH connection both for ``git push`` and to
+run ``./update``. Rather than letting git make its own connection, git is
+pointed (via ``GIT_SSH_COMMAND``) at the ``ssh_relay`` script, which
+hands the command git wants to run back to this process over a local
+socket. It's then run on an exec channel of the connection which is
+already open to the host, with its input and output relayed back to git.
+
+Messages from the relay server to the relay are framed as a one byte
+kind, a four byte length and the data:
+
+``o`` and ``e``
+    output of the command, to stdout and stderr respectively;
+``x``
+    the command's exit status, as a four byte signed integer.
+"""
+
+import json
+import os
+import socket
+import sys
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from sr.comp.cli.ssh_relay import (BUFFER_SIZE, EXIT_STATUS, FRAME_HEADER,
+                                   RELAY_DESTINATIONS_VARIABLE,
+                                   RELAY_FALLBACK_VARIABLE,
+                                   RELAY_PORT_VARIABLE, RELAY_TOKEN_VARIABLE,
+                                   REQUEST_LENGTH, recv_exactly)
+
+
+def send_frame(sock, kind, data):
+    sock.sendall(FRAME_HEADER.pack(kind, len(data)) + data)
+
+
+class SSHConnections(object):
+    """
+    One authenticated SSH connection per host, opened on first use and
+    kept for the duration of the command. Safe to use from several
+    threads; connections to different hosts are made concurrently.
+    """
+
+    def __init__(self, connect=None):
+        if connect is None:
+            from sr.comp.cli.deploy import ssh_connection as connect
+        self._connect = connect
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._host_locks = defaultdict(threading.Lock)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def client(self, host):
+        """The ``SSHClient`` connected to the host, connecting if needed."""
+        with self._lock:
+            host_lock = self._host_locks[host]
+        with host_lock:
+            client = self._clients.get(host)
+            transport = client.get_transport() if client is not None else None
+            if transport is None or not transport.is_active():
+                client = self._connect(host)
+                self._clients[host] = client
+            return client
+
+    def open_channel(self, host):
+        return self.client(host).get_transport().open_session()
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.close()
+
+    @contextmanager
+    def git_over_ssh(self, hosts, user=None):
+        """
+        Have git (run by this process) make its SSH connections to the
+        given hosts, as the deploy user, through these connections while
+        in this context. Connections anywhere else, or as anyone else, are
+        made by the ssh command git would otherwise have used.
+        """
+        from six.moves import shlex_quote
+
+        from sr.comp.cli import ssh_relay
+
+        if user is None:
+            from sr.comp.cli.deploy import DEPLOY_USER as user
+
+        if os.environ.get('GIT_SSH_COMMAND'):
+            fallback = os.environ['GIT_SSH_COMMAND']
+        elif os.environ.get('GIT_SSH'):
+            fallback = shlex_quote(os.environ['GIT_SSH'])
+        else:
+            fallback = 'ssh'
+
+        relay = RelayServer(self, hosts)
+        relay.start()
+        script = os.path.splitext(ssh_relay.__file__)[0] + '.py'
+        command = '{0} {1}'.format(shlex_quote(sys.executable),
+                                   shlex_quote(script))
+        variables = {
+            'GIT_SSH_COMMAND': command,
+            # Stop git probing the relay for the options it takes, while
+            # still passing on those (like ports) the fallback needs
+            'GIT_SSH_VARIANT': os.environ.get('GIT_SSH_VARIANT') or 'ssh',
+            RELAY_PORT_VARIABLE: str(relay.port),
+            RELAY_TOKEN_VARIABLE: relay.token,
+            RELAY_DESTINATIONS_VARIABLE: ' '.join('{0}@{1}'.format(user, host)
+                                                  for host in hosts),
+            RELAY_FALLBACK_VARIABLE: fallback,
+        }
+        previous = dict((name, os.environ.get(name)) for name in variables)
+        os.environ.update(variables)
+        try:
+            yield
+        finally:
+            for name, value in previous.items():
+                if value is None:
+                    del os.environ[name]
+                else:
+                    os.environ[name] = value
+            relay.stop()
+
+
+class RelayServer(object):
+    """
+    Listen locally for relays started by git, running the commands they
+    ask for on channels of the given connections to the given hosts.
+    """
+
+    def __init__(self, connections, hosts):
+        import binascii
+
+        self.connections = connections
+        self.hosts = set(hosts)
+        self.token = binascii.hexlify(os.urandom(16)).decode('ascii')
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.port = self.listener.getsockname()[1]
+
+    def start(self):
+        self.listener.listen(5)
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.listener.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except (socket.error, OSError):
+                # Closed by stop()
+                return
+            thread = threading.Thread(target=self._serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _read_request(self, conn):
+        import hmac
+
+        header = recv_exactly(conn, REQUEST_LENGTH.size)
+        if header is None:
+            return None
+        body = recv_exactly(conn, REQUEST_LENGTH.unpack(header)[0])
+        if body is None:
+            return None
+        request = json.loads(body.decode('utf-8'))
+        if not hmac.compare_digest(request.get('token', ''), self.token):
+            return None
+        if request.get('host') not in self.hosts:
+            return None
+        return request
+
+    def _serve(self, conn):
+        try:
+            request = self._read_request(conn)
+            if request is None:
+                return
+            try:
+                channel = self.connections.open_channel(request['host'])
+                channel.exec_command(request['command'])
+            except Exception as e:
+                message = 'Failed to run command on {0}: {1}\n'.format(
+                    request['host'], e)
+                send_frame(conn, b'e', message.encode('utf-8'))
+                send_frame(conn, b'x', EXIT_STATUS.pack(255))
+                return
+            try:
+                self._relay(conn, channel)
+            finally:
+                channel.close()
+        finally:
+            conn.close()
+
+    def _relay(self, conn, channel):
+        send_lock = threading.Lock()
+
+        def forward_input():
+            try:
+                while True:
+                    data = conn.recv(BUFFER_SIZE)
+                    if not data:
+                        break
+                    channel.sendall(data)
+            except (socket.error, OSError):
+                pass
+            finally:
+                channel.shutdown_write()
+
+        def forward_output(kind, recv):
+            while True:
+                data = recv(BUFFER_SIZE)
+                if not data:
+                    break
+                with send_lock:
+                    send_frame(conn, kind, data)
+
+        input_thread = threading.Thread(target=forward_input)
+        input_thread.daemon = True
+        input_thread.start()
+        stderr_thread = threading.Thread(target=forward_output,
+                                         args=(b'e', channel.recv_stderr))
+        stderr_thread.start()
+        forward_output(b'o', channel.recv)
+        stderr_thread.join()
+        status = channel.recv_exit_status()
+        with send_lock:
+            send_frame(conn, b'x', EXIT_STATUS.pack(status))
@@ -0,0 +1,113 @@
+"""
+Stand-in for ``ssh`` which git runs (via ``GIT_SSH_COMMAND``) while
+deploying, relaying the command git wants to run to the deploying process
+so that it's run over that process' existing connection to the host. See
+``sr.comp.cli.ssh_connections``.
+
+Called as ``ssh_relay.py [options] [user@]host command``, as git calls
+ssh. Only the destinations being deployed to are relayed; for anything
+else (such as fetching from the origin) it runs the ssh command git would
+otherwise have used. It's run as a script, from wherever git happens to
+be, so it only uses the standard library.
+"""
+
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+
+BUFFER_SIZE = 32 * 1024
+
+FRAME_HEADER = struct.Struct('!cI')
+EXIT_STATUS = struct.Struct('!i')
+REQUEST_LENGTH = struct.Struct('!I')
+
+# Environment variables through which the relay finds the deploying process
+RELAY_PORT_VARIABLE = 'SRCOMP_SSH_RELAY_PORT'
+RELAY_TOKEN_VARIABLE = 'SRCOMP_SSH_RELAY_TOKEN'
+# The space separated ``user@host`` destinations to relay; any others are
+# handed to the ssh command which git would otherwise have used
+RELAY_DESTINATIONS_VARIABLE = 'SRCOMP_SSH_RELAY_DESTINATIONS'
+RELAY_FALLBACK_VARIABLE = 'SRCOMP_SSH_RELAY_FALLBACK'
+
+
+def recv_exactly(sock, size):
+    """Receive exactly ``size`` bytes, or None if the socket closes first."""
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def forward_input(source, sock):
+    try:
+        while True:
+            data = os.read(source.fileno(), BUFFER_SIZE)
+            if not data:
+                break
+            sock.sendall(data)
+        sock.shutdown(socket.SHUT_WR)
+    except (socket.error, OSError):
+        pass
+
+
+def relay(host, command):
+    """Run the command on the host through the deploying process."""
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    stderr = getattr(sys.stderr, 'buffer', sys.stderr)
+
+    sock = socket.create_connection(('127.0.0.1',
+                                     int(os.environ[RELAY_PORT_VARIABLE])))
+    request = json.dumps({'token': os.environ[RELAY_TOKEN_VARIABLE],
+                          'host': host,
+                          'command': command}).encode('utf-8')
+    sock.sendall(REQUEST_LENGTH.pack(len(request)) + request)
+
+    thread = threading.Thread(target=forward_input, args=(stdin, sock))
+    thread.daemon = True
+    thread.start()
+
+    outputs = {b'o': stdout, b'e': stderr}
+    while True:
+        header = recv_exactly(sock, FRAME_HEADER.size)
+        if header is None:
+            # Lost the deploying process
+            return 255
+        kind, length = FRAME_HEADER.unpack(header)
+        data = recv_exactly(sock, length)
+        if data is None:
+            return 255
+        if kind == b'x':
+            return EXIT_STATUS.unpack(data)[0]
+        outputs[kind].write(data)
+        outputs[kind].flush()
+
+
+def fall_back(args):
+    """Run the ssh command git would have used, with the same arguments."""
+    fallback = os.environ.get(RELAY_FALLBACK_VARIABLE) or 'ssh'
+    for name in (RELAY_PORT_VARIABLE, RELAY_TOKEN_VARIABLE,
+                 RELAY_DESTINATIONS_VARIABLE, RELAY_FALLBACK_VARIABLE):
+        os.environ.pop(name, None)
+    # Like git, run the command through the shell
+    os.execv('/bin/sh', ['sh', '-c', fallback + ' "$@"', fallback] + args)
+
+
+def main(args):
+    # The destination and command come last, after any options
+    destination, command = args[-2:]
+    relayed = os.environ.get(RELAY_DESTINATIONS_VARIABLE, '').split()
+    if destination not in relayed:
+        fall_back(args)
+    host = destination.split('@')[-1]
+    return relay(host, command)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
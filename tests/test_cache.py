@@ -0,0 +1,31 @@
+import mock
+
+from sr.comp.cli.cache import cache_path, cached
+
+from utils import temp_dir
+
+
+def test_cached_computes_once():
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return [1, 2]
+
+    with temp_dir() as tmp, \
+            mock.patch('sr.comp.cli.cache.cache_dir', return_value=tmp):
+        assert cached('things', [3, 4], compute) == [1, 2]
+        assert cached('things', [3, 4], compute) == [1, 2]
+        assert cached('things', [3, 5], lambda: None) is None
+        assert cached('things', [3, 5], compute) is None
+
+    assert calls == [1]
+
+
+def test_cached_survives_corrupt_cache():
+    with temp_dir() as tmp, \
+            mock.patch('sr.comp.cli.cache.cache_dir', return_value=tmp):
+        with open(cache_path('things'), 'w') as f:
+            f.write('{not json')
+        assert cached('things', 'key', lambda: 'value') == 'value'
+        assert cached('things', 'key', lambda: 'other') == 'value'
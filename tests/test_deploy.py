@@ -0,0 +1,172 @@
+import threading
+import time
+
+import mock
+from six import StringIO
+
+from sr.comp.cli import deploy
+
+
+def make_args(**kwargs):
+    args = mock.Mock(skip_host_check=False, verbose=False, parallel=3,
+                     fan_out=0)
+    for key, value in kwargs.items():
+        setattr(args, key, value)
+    return args
+
+
+def test_parallel_deploy_keeps_host_output_together():
+    def deploy_to(compstate, host, revision, verbose, connections):
+        for n in range(3):
+            print('{0} line {1}'.format(host, n))
+            time.sleep(0.01)
+        return 0
+
+    hosts = ['alpha', 'beta', 'gamma']
+    with mock.patch('sr.comp.cli.deploy.probe_host_states',
+                    return_value=dict.fromkeys(hosts)), \
+            mock.patch('sr.comp.cli.deploy.check_host_state', return_value=False), \
+            mock.patch('sr.comp.cli.deploy.deploy_to', side_effect=deploy_to), \
+            mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+        deploy.run_deployments(make_args(), mock.Mock(), hosts)
+
+    lines = stdout.getvalue().splitlines()
+    host_lines = [line for line in lines if ' line ' in line]
+    assert len(host_lines) == 9
+    for n in range(0, 9, 3):
+        host = host_lines[n].split()[0]
+        assert host_lines[n:n + 3] == ['{0} line {1}'.format(host, m)
+                                       for m in range(3)]
+
+
+def test_parallel_deploy_fails_if_any_host_fails():
+    retcodes = {'alpha': 0, 'beta': 3, 'gamma': 0}
+    deployed = []
+
+    def deploy_to(compstate, host, revision, verbose, connections):
+        deployed.append(host)
+        return retcodes[host]
+
+    with mock.patch('sr.comp.cli.deploy.deploy_to', side_effect=deploy_to), \
+            mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+        try:
+            deploy.run_deployments(make_args(skip_host_check=True),
+                                   mock.Mock(), sorted(retcodes))
+        except SystemExit as e:
+            assert e.code == 3
+        else:
+            assert False, "Should fail if any host fails"
+
+    assert sorted(deployed) == sorted(retcodes), "Should deploy to every host"
+    assert "Failed to deploy to 'beta'" in stdout.getvalue()
+
+
+def test_parallel_deploy_asks_one_question_at_a_time():
+    asking = []
+    overlapped = []
+    lock = threading.Lock()
+
+    def get_input(prompt):
+        with lock:
+            asking.append(prompt)
+            if len(asking) > 1:
+                overlapped.append(prompt)
+        time.sleep(0.02)
+        with lock:
+            asking.remove(prompt)
+        return 'y'
+
+    def check_host_state(compstate, host, revision, verbose, state):
+        return not deploy.query_bool('Deploy to {0}?'.format(host))
+
+    hosts = ['alpha', 'beta', 'gamma', 'delta']
+    with mock.patch('sr.comp.cli.deploy.probe_host_states',
+                    return_value=dict.fromkeys(hosts)), \
+            mock.patch('sr.comp.cli.deploy.get_input', side_effect=get_input), \
+            mock.patch('sr.comp.cli.deploy.check_host_state',
+                       side_effect=check_host_state), \
+            mock.patch('sr.comp.cli.deploy.deploy_to', return_value=0) as deploy_to:
+        deploy.run_deployments(make_args(parallel=4), mock.Mock(), hosts)
+
+    assert overlapped == [], "Should not prompt from two hosts at once"
+    assert deploy_to.call_count == len(hosts)
+
+
+def test_fetching_host_state_does_not_block_prompts():
+    prompted = threading.Event()
+    blocked = []
+
+    def get_input(prompt):
+        if 'beta' in prompt:
+            prompted.set()
+        return 'y'
+
+    def fetch(where, quiet):
+        # Wait for the other host's prompt while this fetch is going on
+        if not prompted.wait(2):
+            blocked.append(where)
+
+    compstate = mock.Mock()
+    compstate.has_ancestor.return_value = False
+    compstate.has_commit.return_value = False
+    compstate.fetch.side_effect = fetch
+
+    def check(host):
+        if host == 'beta':
+            time.sleep(0.1)
+        return deploy.check_host_state(compstate, host, 'abc', False, host)
+
+    with mock.patch('sr.comp.cli.deploy.get_input', side_effect=get_input), \
+            mock.patch('sys.stdout'):
+        threads = [threading.Thread(target=check, args=(host,))
+                   for host in ('alpha', 'beta')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert blocked == [], "Should prompt while fetching for another host"
+
+
+class FakeSession(object):
+    def __init__(self, states, delay):
+        self.states = states
+        self.delay = delay
+
+    def get(self, url, timeout):
+        host = url.split('/')[2]
+        time.sleep(self.delay)
+        state = self.states[host]
+        if state is None:
+            raise IOError('{0} is down'.format(host))
+        response = mock.Mock()
+        response.json.return_value = {'state': state}
+        return response
+
+
+def test_probe_host_states_probes_concurrently():
+    states = {'alpha': 'aaa', 'beta': None, 'gamma': 'ccc', 'delta': 'ddd'}
+    session = FakeSession(states, delay=0.2)
+
+    with mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+        start = time.time()
+        probed = deploy.probe_host_states(sorted(states), False, session)
+        duration = time.time() - start
+
+    assert probed == states
+    assert duration < 0.6, "Should probe the hosts at the same time"
+    assert 'Failed to get state for beta' in stdout.getvalue()
+
+
+def test_run_deployments_uses_probed_states():
+    states = {'alpha': 'aaa', 'beta': 'bbb'}
+    with mock.patch('sr.comp.cli.deploy.probe_host_states',
+                    return_value=states) as probe_host_states, \
+            mock.patch('sr.comp.cli.deploy.check_host_state',
+                       return_value=True) as check_host_state:
+        deploy.run_deployments(make_args(parallel=1), mock.Mock(),
+                               sorted(states))
+
+    probe_host_states.assert_called_once_with(['alpha', 'beta'], False)
+    assert [call[0][1::3] for call in check_host_state.call_args_list] == \
+        [('alpha', 'aaa'), ('beta', 'bbb')]
@@ -0,0 +1,195 @@
+import os
+import subprocess
+
+import mock
+
+from sr.comp.cli.deploy_distribution import distribute, fan_out_steps
+
+from utils import temp_dir
+
+
+def git(cwd, *args):
+    return subprocess.check_output(('git',) + args, cwd=cwd,
+                                   stderr=subprocess.STDOUT).decode('utf-8').strip()
+
+
+class LocalRunner(object):
+    """Stands in for the hosts with local bare repos."""
+
+    def __init__(self, repos, latencies):
+        self.repos = repos
+        self.latencies = latencies
+        self.git_dir = '.'
+        self.commands = []
+
+    def url(self, host):
+        return self.repos[host]
+
+    def run(self, host, command):
+        self.commands.append((host, command))
+        process = subprocess.Popen(command, shell=True, cwd=self.repos[host],
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        output, _ = process.communicate()
+        return process.returncode, output.decode('utf-8')
+
+    def latency(self, host):
+        latency = self.latencies[host]
+        if latency is None:
+            raise IOError('{0} is down'.format(host))
+        return latency
+
+
+class LocalCompstate(object):
+    def __init__(self, path):
+        self.path = path
+        self.pushes = []
+
+    def push(self, where, revspec, err_msg=''):
+        self.pushes.append(where)
+        try:
+            git(self.path, 'push', '-q', where, revspec)
+        except subprocess.CalledProcessError:
+            raise RuntimeError(err_msg)
+
+
+def make_hosts(tmp, latencies):
+    source = os.path.join(tmp, 'source')
+    os.mkdir(source)
+    git(source, 'init', '-q')
+    git(source, 'config', 'user.name', 'Test')
+    git(source, 'config', 'user.email', 'test@example.com')
+    with open(os.path.join(source, 'schedule.yaml'), 'w') as f:
+        f.write('delays: []\n')
+    git(source, 'add', 'schedule.yaml')
+    git(source, 'commit', '-q', '-m', 'Initial')
+
+    repos = {}
+    for host in latencies:
+        repos[host] = os.path.join(tmp, host + '.git')
+        git(tmp, 'init', '-q', '--bare', repos[host])
+
+    revision = git(source, 'rev-parse', 'HEAD')
+    return LocalCompstate(source), LocalRunner(repos, latencies), revision
+
+
+def has_revision(runner, host, revision):
+    try:
+        return git(runner.repos[host], 'rev-parse', 'deploy-' + revision) == revision
+    except subprocess.CalledProcessError:
+        return False
+
+
+def test_fan_out_steps():
+    pairs = fan_out_steps(['a', 'b'], ['c', 'd', 'e', 'f', 'g'], 2)
+
+    assert pairs == [('a', 'c'), ('a', 'd'), ('b', 'e'), ('b', 'f')]
+
+
+def test_distribute_pushes_once_to_nearest_host():
+    latencies = {'alpha': 0.03, 'beta': 0.01, 'gamma': 0.02, 'delta': 0.05,
+                 'epsilon': 0.04}
+    with temp_dir() as tmp:
+        compstate, runner, revision = make_hosts(tmp, latencies)
+
+        with mock.patch('sys.stdout'):
+            failed = distribute(runner, compstate, sorted(latencies),
+                                revision, 2)
+
+        for host in latencies:
+            assert has_revision(runner, host, revision), host
+
+    assert failed == {}
+    assert compstate.pushes == [runner.repos['beta']], "Should only push to the nearest host"
+
+    first_step = set(host for host, command in runner.commands[:2])
+    assert first_step == set(['gamma', 'alpha']), "Should pass on to the nearest first"
+    assert all(runner.repos['beta'] in command
+               for host, command in runner.commands[:2])
+
+
+def test_distribute_carries_on_past_failures():
+    latencies = {'alpha': 0.01, 'beta': 0.02, 'gamma': None, 'delta': 0.03}
+    with temp_dir() as tmp:
+        compstate, runner, revision = make_hosts(tmp, latencies)
+        # Break one host's repo so that neither fetching nor pushing works
+        runner.repos['beta'] = os.path.join(tmp, 'missing.git')
+        os.mkdir(runner.repos['beta'])
+
+        with mock.patch('sys.stdout'):
+            failed = distribute(runner, compstate, sorted(latencies),
+                                revision, 1)
+
+        assert has_revision(runner, 'alpha', revision)
+        assert has_revision(runner, 'delta', revision)
+
+    assert sorted(failed) == ['beta', 'gamma']
+    assert compstate.pushes == [runner.repos['alpha'], runner.repos['beta']]
+
+
+def test_distribute_pushes_when_hosts_cannot_fetch():
+    latencies = {'alpha': 0.01, 'beta': 0.02, 'gamma': 0.03}
+    with temp_dir() as tmp:
+        compstate, runner, revision = make_hosts(tmp, latencies)
+        # As when the hosts don't have keys for each other
+        runner.run = mock.Mock(return_value=(128, 'Permission denied'))
+
+        with mock.patch('sys.stdout'):
+            failed = distribute(runner, compstate, sorted(latencies),
+                                revision, 2)
+
+        for host in latencies:
+            assert has_revision(runner, host, revision), host
+
+    assert failed == {}
+    assert compstate.pushes == [runner.repos[host]
+                                for host in ('alpha', 'beta', 'gamma')]
+
+
+def test_run_deployments_updates_after_distributing():
+    from sr.comp.cli import deploy
+
+    args = mock.Mock(skip_host_check=True, verbose=False, parallel=1, fan_out=2)
+    hosts = ['alpha', 'beta', 'gamma']
+
+    with mock.patch('sr.comp.cli.deploy_distribution.distribute',
+                    return_value={'gamma': 'unreachable'}) as distribute, \
+            mock.patch('sr.comp.cli.deploy.deploy_to', return_value=0) as deploy_to, \
+            mock.patch('sys.stdout'):
+        try:
+            deploy.run_deployments(args, mock.Mock(), hosts)
+        except SystemExit as e:
+            assert e.code == 1
+        else:
+            assert False, "Should fail for the host which didn't get the revision"
+
+    assert distribute.call_args[0][2] == hosts
+    assert [call[0][1] for call in deploy_to.call_args_list] == ['alpha', 'beta']
+    assert all(call[1]['push'] is False for call in deploy_to.call_args_list)
+
+
+def test_fan_out_must_be_positive():
+    import argparse
+
+    from sr.comp.cli import deploy
+
+    parser = argparse.ArgumentParser()
+    deploy.add_options(parser)
+
+    assert parser.parse_args(['--fan-out', '2']).fan_out == 2
+    assert parser.parse_args([]).fan_out is None
+    for value in ('0', '-1'):
+        with mock.patch('sys.stderr'):
+            try:
+                parser.parse_args(['--fan-out', value])
+            except SystemExit:
+                pass
+            else:
+                assert False, "Should reject a fan out of {0}".format(value)
+
+    try:
+        distribute(None, None, ['alpha'], 'abc', 0)
+    except ValueError:
+        pass
+    else:
+        assert False, "Should refuse to distribute with no fan out"
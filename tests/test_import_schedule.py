@@ -1,59 +1,7 @@
 
-from sr.comp.cli.import_schedule import get_id_subsets, build_schedule
+from sr.comp.cli.import_schedule import build_schedule
 
 
-def test_num_ids_equasl_num_teams():
-    ids = list(range(4))
-    maps = list(get_id_subsets(ids, 4))
-
-    expected = [ids]
-
-    assert maps == expected, "Only one possible combination when same number of ids as teams"
-
-def test_one_spare_id():
-    ids = list(range(3))
-    num_teams = 2
-
-    ids_set = set(ids)
-
-    subsets = list(get_id_subsets(ids, num_teams))
-
-    assert len(subsets) == 3, "Should have as many maps as valid permutations"
-
-    # Don't actually care what the mappings are, only that all are explored
-    ids_omitted = []
-    for subset in subsets:
-        ids_used = set(subset)
-        omitted = ids_set - ids_used
-
-        assert len(omitted) == 1, "Omitted wrong number of ids"
-        ids_omitted.append(omitted.pop())
-
-    assert set(ids_omitted) == ids_set, "Should have omitted each id once"
-
-def test_two_spare_ids():
-    ids = list(range(4))
-    num_teams = 2
-
-    ids_set = set(ids)
-
-    subsets = list(get_id_subsets(ids, num_teams))
-
-    expected_omitted = set(["0,1", "0,2", "0,3", "1,2", "1,3", "2,3"])
-
-    assert len(subsets) == len(expected_omitted), "Should have as many maps as valid permutations"
-
-    # Don't actually care what the mappings are, only that all are explored
-    ids_omitted = []
-    for subset in subsets:
-        ids_used = set(subset)
-        omitted = ids_set - ids_used
-
-        assert len(omitted) == 2, "Omitted wrong number of ids"
-        ids_omitted.append(",".join(map(str, sorted(omitted))))
-
-    assert set(ids_omitted) == expected_omitted, "Should have omitted each id pair once"
-
 def test_build_schedule():
     lines = ['0|1|2|3', '1|2|3|4']
     teams = ['ABC', 'DEF', 'GHI']
@@ -83,3 +31,95 @@ def test_build_schedule_appaerance_order():
     assert expected_matches == matches, "Wrong matches"
 
     assert bad == [], "Should not be any 'bad' matches"
+
+def test_removal_search_finds_best_removal():
+    import random
+    from collections import Counter
+    from itertools import combinations
+
+    from sr.comp.cli.import_schedule import (RemovalSearch, chunks_of_size,
+                                             empty_places_key)
+
+    rng = random.Random(4)
+    ids = list(range(12))
+    schedule = []
+    for n in range(6):
+        rng.shuffle(ids)
+        schedule.append(ids[:8])
+
+    def key(removed):
+        empty_places_map = Counter()
+        for match_ids in schedule:
+            for game_ids in chunks_of_size(match_ids, 4):
+                empty_places_map[len(set(game_ids) & set(removed))] += 1
+        return empty_places_key(empty_places_map)
+
+    ids = list(range(12))
+    expected = min(combinations(ids, 5), key=key)
+
+    removed = RemovalSearch(ids, 7, schedule).run()
+
+    assert tuple(removed) == expected, "Should find the first of the best removals"
+
+def test_build_schedule_many_spare_ids():
+    lines = ['0|1|2|3|4|5|6|7', '8|9|0|4|1|5|2|6']
+    teams = ['ABC', 'DEF', 'GHI', 'JKL', 'MNO']
+
+    matches, bad = build_schedule(lines, '', teams, ['A', 'B'])
+
+    used = [team for match in matches.values() for game in match.values()
+            for team in game if team is not None]
+
+    assert set(used) == set(teams), "Should use every team"
+    assert len(bad) == 2, "Should spread the teams over as few bad games as possible"
+
+def test_parallel_search_matches_serial():
+    import random
+
+    from sr.comp.cli.import_schedule import find_removal
+
+    rng = random.Random(7)
+    ids = list(range(16))
+    schedule = []
+    for n in range(6):
+        rng.shuffle(ids)
+        schedule.append(ids[:8])
+        schedule.append(ids[8:])
+
+    ids = list(range(16))
+    for num_teams in (15, 13, 11):
+        serial = find_removal(ids, num_teams, schedule)
+        parallel = find_removal(ids, num_teams, schedule, processes=2)
+
+        assert serial == parallel, "Should find the same removal in parallel"
+
+def test_build_schedule_reuses_cached_fit():
+    import mock
+
+    from utils import temp_dir
+
+    lines = ['0|1|2|3|4|5|6|7', '8|9|0|4|1|5|2|6']
+
+    with temp_dir() as tmp, mock.patch('sr.comp.cli.cache.cache_dir', return_value=tmp):
+        first, first_bad = build_schedule(lines, '', ['ABC', 'DEF', 'GHI', 'JKL', 'MNO'],
+                                          ['A', 'B'], cache=True)
+
+        with mock.patch('sr.comp.cli.import_schedule.find_removal') as find_removal:
+            renamed, renamed_bad = build_schedule(lines, '', ['AAA', 'BBB', 'CCC', 'DDD', 'EEE'],
+                                                  ['A', 'B'], cache=True)
+
+            assert not find_removal.called, "Should reuse the cached search"
+
+            find_removal.return_value = ([0, 1, 2, 3, 4, 5], (0, 0, 2), False)
+            build_schedule(lines, '', ['ABC', 'DEF', 'GHI', 'JKL'], ['A', 'B'],
+                           cache=True)
+
+            assert find_removal.called, "Should search again for a different number of teams"
+
+    renames = dict(zip(['ABC', 'DEF', 'GHI', 'JKL', 'MNO'], ['AAA', 'BBB', 'CCC', 'DDD', 'EEE']))
+    expected = dict((num, dict((arena, [renames.get(team) for team in game])
+                               for arena, game in match.items()))
+                    for num, match in first.items())
+
+    assert renamed == expected, "Should leave the same places empty"
+    assert len(renamed_bad) == len(first_bad), "Should have the same bad matches"
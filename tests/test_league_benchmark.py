@@ -0,0 +1,45 @@
+
+from sr.comp.cli.league_benchmark import (CASE_KEYS, DEFAULT_MATRIX, cases,
+                                          compare, run_case,
+                                          run_case_with_timeout)
+
+
+CASE = dict(teams=16, arenas=1, separation=1, max_matchups=2,
+            appearances_per_round=1, lcg=False, construct=False,
+            strategy='shuffle', seed=0)
+
+
+def test_cases_cover_matrix():
+    matrix = dict(DEFAULT_MATRIX, teams=(24, 48), arenas=(1,))
+    expanded = cases(matrix)
+
+    assert len(expanded) == 2 * 2 * 2 * 2 * 2
+    assert all(set(case) == set(CASE_KEYS) for case in expanded)
+
+
+def test_run_case():
+    result = run_case(CASE, 3)
+
+    assert result['status'] == 'solved'
+    assert result['matches'] == 12
+    assert result['ticks'] > 0
+    assert result == dict(run_case(CASE, 3), time=result['time'],
+                          peak_memory=result['peak_memory'])
+
+
+def test_run_case_timeout():
+    # Impossible: every team would need to play in every match
+    case = dict(CASE, separation=4)
+    result = run_case_with_timeout(case, 3, 0.5)
+
+    assert result['status'] == 'timeout'
+
+
+def test_compare():
+    baseline = [dict(CASE, status='solved', time=2.0),
+                dict(CASE, seed=1, status='timeout', time=60)]
+    results = [dict(CASE, status='solved', time=1.0),
+               dict(CASE, seed=1, status='solved', time=3.0),
+               dict(CASE, seed=2, status='solved', time=3.0)]
+
+    assert [ratio for _, ratio in compare(baseline, results)] == [0.5, None]
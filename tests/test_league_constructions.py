@@ -0,0 +1,76 @@
+
+from sr.comp.cli.league_constructions import (Constructor, field_operations,
+                                              modular_operations,
+                                              round_robin_classes,
+                                              transversal_classes)
+
+from utils import make_scheduler
+
+
+def meetings(classes):
+    counts = {}
+    for games in classes:
+        for game in games:
+            for a in game:
+                for b in game:
+                    if a < b:
+                        counts[a, b] = counts.get((a, b), 0) + 1
+    return counts
+
+
+def test_affine_plane_of_order_four():
+    classes = transversal_classes(list(range(16)), 4, field_operations(4))
+    classes.append([list(range(n, n + 4)) for n in range(0, 16, 4)])
+
+    assert all(sorted(sum(games, [])) == list(range(16)) for games in classes)
+    counts = meetings(classes)
+    assert len(counts) == 16 * 15 // 2
+    assert set(counts.values()) == set([1])
+
+
+def test_cyclic_classes_meet_once_for_prime_columns():
+    classes = transversal_classes(list(range(28)), 4, modular_operations(7))
+
+    assert all(sorted(sum(games, [])) == list(range(28)) for games in classes)
+    assert set(meetings(classes).values()) == set([1])
+
+
+def test_round_robin():
+    classes = round_robin_classes(list(range(8)))
+
+    assert len(classes) == 7
+    counts = meetings(classes)
+    assert len(counts) == 8 * 7 // 2
+    assert set(counts.values()) == set([1])
+
+
+def test_construct_valid_schedule():
+    scheduler = make_scheduler(28, max_match_periods=70, construct=True)
+    name, entries = Constructor(scheduler).construct()
+
+    assert name in ('affine', 'cyclic')
+    assert sorted(entries[:28]) == list(range(28))
+    assert scheduler._validate(scheduler._match_partition(entries))
+
+
+def test_run_uses_construction():
+    scheduler = make_scheduler(56, arenas=('A', 'B'), max_match_periods=60,
+                               construct=True)
+    output = scheduler.run()
+
+    assert scheduler.stats['constructed']
+    assert scheduler.stats['ticks'] == 0
+    schedule = [scheduler._encode_match(output[n]['A'] + output[n]['B'])
+                for n in range(len(output))]
+    assert len(schedule) == scheduler.total_matches
+    assert scheduler._validate(schedule)
+
+
+def test_construction_not_used_with_base_matches():
+    base = [['T{0:02}'.format(n) for n in range(4 * m, 4 * m + 4)]
+            for m in range(7)]
+    scheduler = make_scheduler(28, max_match_periods=21, base_matches=base,
+                               construct=True)
+    scheduler.run()
+
+    assert not scheduler.stats['constructed']
@@ -0,0 +1,66 @@
+
+import socket
+import threading
+
+import mock
+
+from sr.comp.cli.league_distributed import Coordinator, parse_address, run_worker
+from sr.comp.cli.league_portfolio import build_scheduler, worker_spec
+
+
+OPTIONS = dict(teams=['T{0:02}'.format(n) for n in range(16)],
+               max_match_periods=16,
+               separation=1)
+
+
+def test_parse_address():
+    assert parse_address('localhost:1234') == ('localhost', 1234)
+    assert parse_address(':1234') == ('', 1234)
+
+
+def test_distributed_result_is_reproducible():
+    coordinator = Coordinator(('127.0.0.1', 0), OPTIONS,
+                              lambda n: worker_spec(5, n, 'shuffle', False))
+    address = '{0}:{1}'.format(*coordinator.address)
+
+    workers = [threading.Thread(target=run_worker, args=(address,))
+               for n in range(2)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    spec, output = coordinator.run()
+    for worker in workers:
+        worker.join(10)
+
+    assert spec['seed'] in (5, 6)
+    scheduler = build_scheduler(OPTIONS, spec)
+    scheduler.lprint = lambda *args, **kwargs: None
+    assert scheduler.run() == output
+    assert not any(worker.is_alive() for worker in workers)
+
+
+def test_coordinator_gives_up_when_workers_disconnect():
+    coordinator = Coordinator(('127.0.0.1', 0), OPTIONS,
+                              lambda n: worker_spec(5, n, 'shuffle', False))
+    errors = []
+
+    def run():
+        try:
+            coordinator.run()
+        except RuntimeError as e:
+            errors.append(e)
+
+    with mock.patch('sys.stderr'):
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+        # The only worker takes its job, then goes away
+        connection = socket.create_connection(coordinator.address)
+        connection.makefile('rb').readline()
+        connection.close()
+        thread.join(10)
+
+    assert not thread.is_alive(), "Should stop waiting with no workers left"
+    assert len(errors) == 1
@@ -0,0 +1,61 @@
+
+from sr.comp.cli.league_portfolio import (build_scheduler, run_anytime,
+                                          run_portfolio, worker_specs)
+from sr.comp.cli.league_quality import quality_key, schedule_quality
+from sr.comp.cli.league_scheduler import STRATEGIES
+
+
+OPTIONS = dict(teams=['T{0:02}'.format(n) for n in range(16)],
+               max_match_periods=16,
+               separation=1)
+
+
+def test_worker_specs_seeds():
+    specs = worker_specs(10, 3, 'shuffle', False)
+
+    assert [spec['seed'] for spec in specs] == [10, 11, 12]
+    assert all(spec['strategy'] == 'shuffle' for spec in specs)
+
+
+def test_worker_specs_vary():
+    specs = worker_specs(0, 2 * len(STRATEGIES), 'shuffle', False, vary=True)
+
+    assert set(spec['strategy'] for spec in specs) == set(STRATEGIES)
+    assert set((spec['strategy'], spec['enable_lcg']) for spec in specs) == \
+        set((strategy, lcg) for strategy in STRATEGIES for lcg in (True, False))
+
+
+def test_portfolio_result_is_reproducible():
+    specs = worker_specs(1, 2, 'shuffle', False)
+
+    spec, output = run_portfolio(OPTIONS, specs)
+
+    scheduler = build_scheduler(OPTIONS, spec)
+    scheduler.lprint = lambda *args, **kwargs: None
+    assert scheduler.run() == output
+
+
+def test_portfolio_forwards_progress():
+    events = []
+    specs = worker_specs(1, 2, 'shuffle', False)
+
+    spec, output = run_portfolio(OPTIONS, specs, events.append)
+
+    assert events
+    assert set(event['worker'] for event in events) <= set([0, 1])
+    assert any(event['event'] == 'round' for event in events)
+
+
+def test_anytime_returns_best_reproducible_schedule():
+    events = []
+    specs = worker_specs(1, 2, 'shuffle', False)
+
+    spec, quality, output = run_anytime(OPTIONS, specs, 1, events.append)
+
+    scheduler = build_scheduler(OPTIONS, spec)
+    scheduler.lprint = lambda *args, **kwargs: None
+    assert scheduler.run() == output
+    assert schedule_quality(output, scheduler.arenas, 4) == quality
+    results = [event for event in events if event['event'] == 'schedule']
+    assert len(results) > 1
+    assert all(quality_key(quality) <= quality_key(event) for event in results)
@@ -0,0 +1,31 @@
+
+from sr.comp.cli.league_quality import quality_key, schedule_quality
+
+
+def test_schedule_quality():
+    matches = {0: {'A': ['T0', 'T1', 'T2', 'T3']},
+               1: {'A': ['T4', 'T5', None, None]},
+               2: {'A': ['T1', 'T0', 'T4', None]},
+               3: {'A': ['T0', 'T2', 'T5', 'T3']}}
+
+    quality = schedule_quality(matches, ['A'], 4)
+
+    assert quality['repeat_matchups'] == 4, \
+        "T0 meets T1, T2 and T3 twice, as do T2 and T3"
+    assert quality['max_matchups'] == 2
+    assert quality['min_gap'] == 1
+    assert quality['mean_gap'] == 2.0
+    # T0: 2/1/0/0, T1: 1/1/0/0, T2: 0/1/1/0, T3: 0/0/0/2, T4: 1/0/1/0,
+    # T5: 0/1/1/0
+    assert quality['corner_imbalance'] == 2 + 1 + 1 + 2 + 1 + 1
+
+
+def test_quality_key_prefers_fewer_repeats():
+    base = dict(repeat_matchups=2, max_matchups=2, min_gap=3, mean_gap=4.0,
+                corner_imbalance=10)
+
+    assert quality_key(dict(base, repeat_matchups=1)) < quality_key(base)
+    assert quality_key(dict(base, min_gap=4)) < quality_key(base)
+    assert quality_key(dict(base, corner_imbalance=2)) < quality_key(base)
+    assert quality_key(dict(base, repeat_matchups=1, min_gap=1)) < \
+        quality_key(base)
@@ -0,0 +1,66 @@
+
+import random
+
+from sr.comp.cli.league_repair import ScheduleRepairer, frozen_penalty
+
+from utils import make_scheduler
+
+
+def valid_entries(scheduler):
+    output = scheduler.run()
+    return [entrant for n in range(len(output))
+            for entrant in scheduler._encode_match(output[n]['main'])]
+
+
+def test_penalty_of_valid_schedule():
+    scheduler = make_scheduler(20, max_match_periods=25, separation=1,
+                               random=random.Random(1))
+    repairer = ScheduleRepairer(scheduler, valid_entries(scheduler))
+
+    assert repairer.penalty == 0
+
+
+def test_swap_keeps_penalty_consistent():
+    scheduler = make_scheduler(20, max_match_periods=25, separation=1,
+                               random=random.Random(1))
+    repairer = ScheduleRepairer(scheduler, valid_entries(scheduler))
+
+    for n in range(500):
+        move = repairer._random_move()
+        if move is not None:
+            repairer.swap(*move)
+        assert repairer.penalty == repairer._total_penalty()
+
+
+def test_repair_broken_schedule():
+    scheduler = make_scheduler(20, max_match_periods=25, separation=1,
+                               random=random.Random(1))
+    entries = valid_entries(scheduler)
+    round_size = scheduler.round_length * scheduler.entrants_per_match_period
+    # Scramble the second round
+    second_round = entries[round_size:2 * round_size]
+    random.Random(2).shuffle(second_round)
+    entries[round_size:2 * round_size] = second_round
+
+    repairer = ScheduleRepairer(scheduler, entries)
+    assert repairer.penalty > 0
+
+    repaired, penalty = repairer.run(5)
+
+    assert penalty == 0
+    assert scheduler._validate(scheduler._match_partition(repaired))
+
+
+def test_repair_leaves_frozen_matches():
+    scheduler = make_scheduler(20, max_match_periods=25, separation=1,
+                               random=random.Random(1))
+    entries = valid_entries(scheduler)
+    epm = scheduler.entrants_per_match_period
+    frozen = scheduler.round_length
+    entries[-1], entries[-epm - 1] = entries[-epm - 1], entries[-1]
+
+    repairer = ScheduleRepairer(scheduler, entries, frozen)
+    repaired, penalty = repairer.run(5)
+
+    assert penalty == frozen_penalty(scheduler, entries, frozen) == 0
+    assert repaired[:frozen * epm] == entries[:frozen * epm]
@@ -0,0 +1,580 @@
+
+import os
+import random
+
+import mock
+
+from sr.comp.cli.league_scheduler import (NEVER, RELAX_STALLED_ATTEMPTS,
+                                          RETIGHTEN_ROUNDS, CornerBalancer,
+                                          RelaxationPolicy, Scheduler,
+                                          ScheduleState, check_batch,
+                                          load_checkpoint)
+
+from utils import make_scheduler, temp_dir
+
+
+def entries(scheduler, *matches):
+    return [team for match in matches for team in scheduler._encode_match(match)]
+
+
+def test_state_separation_against_accepted():
+    scheduler = make_scheduler()
+    state = ScheduleState(scheduler)
+    state.push(entries(scheduler, ['T00', 'T01', 'T02', 'T03']))
+
+    assert not state.check(entries(scheduler, ['T00', 'T04', 'T05', 'T06']), 2)
+    assert not state.check(entries(scheduler,
+                                   ['T04', 'T05', 'T06', 'T07'],
+                                   ['T08', 'T09', 'T10', 'T01']), 2)
+    assert state.check(entries(scheduler,
+                               ['T04', 'T05', 'T06', 'T07'],
+                               ['T08', 'T09', 'T10', 'T11'],
+                               ['T00', 'T01', 'T02', 'T03']), 2)
+
+
+def test_state_matchups():
+    scheduler = make_scheduler(separation=0)
+    state = ScheduleState(scheduler)
+    state.push(entries(scheduler, *[['T00', 'T01', 'T02', 'T03']] * 2))
+
+    bumps = []
+    candidate = entries(scheduler, ['T00', 'T01', 'T04', 'T05'])
+    ok = state.check(candidate, 2, lambda: bumps.append(1))
+
+    assert not ok, "T00 and T01 would meet three times"
+    assert bumps == [1], "Matchup failure should bump impatience"
+    assert state.check(candidate, 3)
+
+
+def test_state_pseudo_teams():
+    scheduler = make_scheduler(teams=['T{0:02}'.format(n) for n in range(6)])
+    state = ScheduleState(scheduler)
+
+    assert not state.check(entries(scheduler, ['T00', 'T01', '~0', '~1']), 2)
+    assert state.check(entries(scheduler, ['T00', 'T01', 'T02', '~0']), 2)
+    assert state.check(entries(scheduler, [None, None, None, None]), 2)
+
+
+def test_state_pop_restores():
+    scheduler = make_scheduler()
+    state = ScheduleState(scheduler)
+    state.push(entries(scheduler, ['T00', 'T01', 'T02', 'T03']))
+    state.push(entries(scheduler,
+                       ['T04', 'T05', 'T06', 'T07'],
+                       ['T00', 'T01', 'T08', 'T09']))
+
+    removed = state.pop(2)
+
+    assert len(state) == 1
+    assert removed[4:] == entries(scheduler, ['T00', 'T01', 'T08', 'T09'])
+    assert state.matchups[1 * 0 // 2 + 0] == 1, "T00 vs T01 from the first match"
+    assert state.matchups[9 * 8 // 2 + 0] == 0, "T00 vs T09 was rolled back"
+    assert list(state.last_appearance[:4]) == [0] * 4
+    assert list(state.last_appearance[4:]) == [NEVER] * 8
+
+
+def test_state_grows_beyond_capacity():
+    scheduler = make_scheduler(separation=0)
+    state = ScheduleState(scheduler, 1)
+    state.push(entries(scheduler, *[['T00', 'T01', 'T02', 'T03']] * 3))
+
+    assert state.matches == [[0, 1, 2, 3]] * 3
+
+
+def test_validate_agrees_with_state():
+    scheduler = make_scheduler()
+    schedule = [['T00', 'T01', 'T02', 'T03'],
+                ['T04', 'T05', 'T06', 'T07'],
+                ['T08', 'T09', 'T10', 'T11'],
+                ['T00', 'T01', 'T02', 'T03']]
+    schedule = [scheduler._encode_match(match) for match in schedule]
+
+    def encoded(*matches):
+        return schedule + [scheduler._encode_match(match) for match in matches]
+
+    assert scheduler._validate(schedule)
+    assert not scheduler._validate(encoded(['T04', 'T05', 'T06', 'T03']))
+    assert not scheduler._validate(encoded(['T04', 'T05', 'T06', 'T07'],
+                                           ['T08', 'T09', 'T00', 'T01']))
+
+
+def test_run_produces_valid_schedule():
+    scheduler = make_scheduler(separation=1)
+    output = scheduler.run()
+
+    assert len(output) == scheduler.total_matches
+    schedule = [scheduler._encode_match(output[n]['main'])
+                for n in range(len(output))]
+    assert scheduler._validate(schedule)
+
+
+def test_check_batch_agrees_with_state():
+    import numpy as np
+
+    teams = ['T{0:02}'.format(n) for n in range(14)]
+    scheduler = make_scheduler(teams=teams, arenas=('A', 'B'),
+                               separation=0, max_matchups=1)
+    state = ScheduleState(scheduler)
+    state.push(list(range(8)))
+
+    rng = np.random.RandomState(0)
+    candidates = np.array([rng.permutation(scheduler._teams) for n in range(200)])
+    valid, matchup_failures = check_batch(candidates, 4, 8, len(teams), 0, 1,
+                                          np.asarray(state.last_appearance),
+                                          np.asarray(state.matchups), 1)
+
+    for candidate, is_valid in zip(candidates, valid):
+        assert state.check(candidate.tolist(), 1) == is_valid
+    assert valid.any() and not valid.all()
+    assert matchup_failures.any()
+
+
+def test_run_batch_strategy():
+    scheduler = make_scheduler(separation=1, strategy='batch')
+    output = scheduler.run()
+
+    schedule = [scheduler._encode_match(output[n]['main'])
+                for n in range(len(output))]
+    assert len(schedule) == scheduler.total_matches
+    assert scheduler._validate(schedule)
+
+
+def test_run_propagate_strategy():
+    teams = ['T{0:02}'.format(n) for n in range(30)]
+    scheduler = make_scheduler(teams=teams, arenas=('A', 'B'),
+                               max_match_periods=24, strategy='propagate')
+    output = scheduler.run()
+
+    schedule = [scheduler._encode_match(output[n]['A'] + output[n]['B'])
+                for n in range(len(output))]
+    assert len(schedule) == scheduler.total_matches
+    assert scheduler._validate(schedule)
+
+
+def test_run_records_stats():
+    scheduler = make_scheduler(separation=1)
+    scheduler.run()
+
+    assert scheduler.stats['ticks'] > 0
+    assert scheduler.stats['backtracks'] >= 0
+
+
+def test_run_reports_progress():
+    events = []
+    scheduler = make_scheduler(separation=1)
+    scheduler.on_progress = events.append
+    scheduler.run()
+
+    assert events[0]['event'] == 'start'
+    assert events[-1]['event'] == 'finish'
+    rounds = [event for event in events if event['event'] == 'round']
+    assert rounds == scheduler.round_stats
+    assert sum(event['ticks'] for event in rounds) == scheduler.stats['ticks']
+    assert rounds[-1]['matches'] == scheduler.total_matches
+    assert all(0 < event['acceptance_rate'] <= 1 for event in rounds)
+
+
+def test_resume_from_checkpoint():
+    expected = make_scheduler(separation=1).run()
+
+    with temp_dir() as tmp:
+        path = os.path.join(tmp, 'checkpoint.json')
+        scheduler = make_scheduler(separation=1)
+        scheduler.checkpoint_file = path
+        scheduler.checkpoint_interval = 0
+
+        # Interrupt the run part of the way through
+        def on_progress(event):
+            if event['event'] == 'round' and event['matches'] >= 6:
+                raise KeyboardInterrupt
+        scheduler.on_progress = on_progress
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            pass
+
+        checkpoint = load_checkpoint(path)
+    assert 0 < len(checkpoint['entries']) < 4 * scheduler.total_matches
+
+    resumed = make_scheduler(separation=1, random=random.Random(0))
+    assert resumed.run(checkpoint) == expected
+
+
+def test_resume_checks_settings():
+    with temp_dir() as tmp:
+        path = os.path.join(tmp, 'checkpoint.json')
+        scheduler = make_scheduler(separation=1)
+        scheduler.checkpoint_file = path
+        scheduler.run()
+        checkpoint = load_checkpoint(path)
+
+    other = make_scheduler(separation=2)
+    try:
+        other.run(checkpoint)
+    except ValueError:
+        pass
+    else:
+        assert False, "Should refuse a checkpoint with different settings"
+
+
+def test_conflict_positions():
+    scheduler = make_scheduler(separation=1)
+    scheduler._matchup_limit = 2
+    state = ScheduleState(scheduler)
+    previous = entries(scheduler,
+                       ['T00', 'T01', 'T02', 'T03'],
+                       ['T04', 'T05', 'T06', 'T07'],
+                       ['T08', 'T09', 'T10', 'T11'])
+    state.push(entries(scheduler, ['T00', 'T01', 'T08', 'T09']))
+    state.push(previous)
+
+    positions = scheduler._conflict_positions(state, previous)
+
+    # The first game repeats T00 vs T01, and the last is at the boundary
+    assert positions == [0, 1, 2, 3, 8, 9, 10, 11]
+
+
+def test_partial_backtrack_keeps_rest_of_round():
+    scheduler = make_scheduler(separation=1)
+    scheduler._matchup_limit = 2
+    scheduler._relaxation = RelaxationPolicy(2)
+    state = ScheduleState(scheduler)
+    previous = entries(scheduler,
+                       ['T00', 'T01', 'T02', 'T03'],
+                       ['T04', 'T05', 'T06', 'T07'],
+                       ['T08', 'T09', 'T10', 'T11'])
+    state.push(previous)
+
+    # Fail while the previous round ends with all of T08-T11
+    def search_round(state, teams):
+        if set(state.entries[8:12]) == set(range(8, 12)):
+            return None
+        return list(state.entries[8:12]) + list(state.entries[:8])
+
+    round_entries = scheduler._partial_backtrack(state, scheduler._teams,
+                                                 search_round)
+
+    assert round_entries is not None
+    assert len(state) == 3
+    replaced = state.entries[:12].tolist()
+    assert replaced != previous
+    assert sum(1 for a, b in zip(replaced, previous) if a != b) <= 8
+
+
+def test_relaxation_policy_relaxes_when_stalled_on_matchups():
+    policy = RelaxationPolicy(2)
+    assert policy.end_round(12, True, 1) is None
+
+    for n in range(RELAX_STALLED_ATTEMPTS - 1):
+        for tick in range(100):
+            policy.bump()
+        assert policy.end_round(12, False, 100) is None
+    for tick in range(100):
+        policy.bump()
+    decision = policy.end_round(12, False, 100)
+
+    assert decision == {'action': 'relax', 'matchup_limit': 3,
+                        'stalled': RELAX_STALLED_ATTEMPTS,
+                        'matchup_share': 1}
+    assert policy.limit == 3
+
+
+def test_relaxation_policy_ignores_other_rejections():
+    policy = RelaxationPolicy(2)
+    for n in range(RELAX_STALLED_ATTEMPTS * 2):
+        policy.reject('separation', 10)
+        assert policy.end_round(0, False, 10) is None
+    assert policy.limit == 2
+    assert policy.last_rejections['other'] == 10
+
+
+def test_relaxation_policy_tightens_again():
+    policy = RelaxationPolicy(2)
+    policy.limit = 3
+    for n in range(RETIGHTEN_ROUNDS - 1):
+        assert policy.end_round(n + 1, True, 1) is None
+    decision = policy.end_round(RETIGHTEN_ROUNDS, True, 1)
+
+    assert decision == {'action': 'tighten', 'matchup_limit': 2,
+                        'easy_rounds': RETIGHTEN_ROUNDS}
+    assert policy.retighten_rounds == RETIGHTEN_ROUNDS * 2
+
+
+def test_run_relaxes_matchup_limit():
+    scheduler = make_scheduler(teams=['T{0:02}'.format(n) for n in range(8)],
+                               separation=0, max_matchups=1)
+    events = []
+    scheduler.on_progress = events.append
+    output = scheduler.run()
+
+    assert len(output) == scheduler.total_matches
+    assert scheduler.stats['relaxations'] >= 1
+    relaxations = [event for event in events if event['event'] == 'relaxation']
+    assert relaxations[0]['action'] == 'relax'
+    assert relaxations[0]['matchup_share'] >= 0.5
+
+
+def test_run_propagate_tightens_matchup_limit_again():
+    scheduler = make_scheduler(separation=1, max_matchups=1,
+                               strategy='propagate')
+    events = []
+    scheduler.on_progress = events.append
+    output = scheduler.run()
+
+    assert len(output) == scheduler.total_matches
+    actions = [event['action'] for event in events
+               if event['event'] == 'relaxation']
+    assert actions[:2] == ['relax', 'tighten']
+    # Each attempt at a round counts once, however many options it tried
+    for event in events:
+        if event['event'] == 'round':
+            assert sum(event['rejections'].values()) <= event['ticks']
+
+
+def test_lcg_params_are_cached():
+    teams = ['T{0:02}'.format(n) for n in range(48)]
+    with temp_dir() as tmp, \
+            mock.patch('sr.comp.cli.cache.cache_dir', return_value=tmp):
+        scheduler = make_scheduler(teams=teams, enable_lcg=True)
+        assert scheduler._lcg_params == (37, 47)
+        with mock.patch.object(Scheduler, '_search_lcg_params') as search:
+            again = make_scheduler(teams=teams, enable_lcg=True)
+        assert not search.called
+    assert again._lcg_params == (37, 47)
+    assert sorted(again._lcg_permute(list(range(48)))) == list(range(48))
+
+
+def test_corner_balancer():
+    games = [[0, 1, 2, 3] for n in range(8)]
+    balancer = CornerBalancer(4, 4)
+    balancer.balance(games)
+
+    assert balancer.counts == [[2, 2, 2, 2]] * 4
+    assert all(sorted(game) == [0, 1, 2, 3] for game in games)
+
+
+def test_corner_balancer_pseudo_teams_and_fixed_games():
+    games = [[0, 1, 2, 3], [0, 1, 2, 4], [0, 1, 2, 4]]
+    balancer = CornerBalancer(4, 4)
+    balancer.balance(games, fixed=1)
+
+    assert games[0] == [0, 1, 2, 3]
+    assert max(max(counts) for counts in balancer.counts) == 1
+
+
+def test_clean_balances_corners_and_keeps_base_matches():
+    base = [['T00', 'T01', 'T02', 'T03'],
+            ['T04', 'T05', 'T06', 'T07'],
+            ['T08', 'T09', 'T10', 'T11']]
+    scheduler = make_scheduler(separation=0, max_match_periods=15,
+                               base_matches=base)
+    output = scheduler.run()
+
+    assert [output[n]['main'] for n in range(3)] == base
+    corners = {}
+    for n in range(len(output)):
+        for corner, team in enumerate(output[n]['main']):
+            corners.setdefault(team, [0] * 4)[corner] += 1
+    assert all(max(counts) - min(counts) <= 1 for counts in corners.values())
+
+
+def test_stream_matches_output():
+    import yaml
+
+    from sr.comp.cli.league_stream import ScheduleStream
+
+    base = [['T00', 'T01', 'T02', 'T03'],
+            ['T04', 'T05', 'T06', 'T07'],
+            ['T08', 'T09', 'T10', 'T11']]
+    scheduler = make_scheduler(separation=1, max_match_periods=15,
+                               base_matches=base)
+    streamed = []
+
+    with temp_dir() as tmp:
+        path = os.path.join(tmp, 'league.yaml')
+        scheduler.stream = ScheduleStream(path)
+
+        def on_progress(event):
+            if event['event'] == 'round':
+                with open(path) as f:
+                    streamed.append(yaml.safe_load(f)['matches'])
+        scheduler.on_progress = on_progress
+        output = scheduler.run()
+        scheduler.stream.close()
+
+        with open(path) as f:
+            assert yaml.safe_load(f) == {'matches': output}
+    assert [output[n]['main'] for n in range(3)] == base
+    schedule = [scheduler._encode_match(output[n]['main'])
+                for n in range(len(output))]
+    assert scheduler._validate(schedule, scheduler._matchup_limit)
+    # The file held each round as it was found
+    assert len(streamed[0]) == 6
+    assert all(len(matches) % 3 == 0 for matches in streamed)
+
+
+def test_resumed_stream_carries_on_the_same_search():
+    from sr.comp.cli.league_stream import ScheduleStream
+
+    def games(output):
+        return [sorted(output[n]['main']) for n in range(len(output))]
+
+    with temp_dir() as tmp:
+        scheduler = make_scheduler(separation=1)
+        scheduler.stream = ScheduleStream(os.path.join(tmp, 'whole.yaml'))
+        expected = scheduler.run()
+        scheduler.stream.close()
+
+        path = os.path.join(tmp, 'checkpoint.json')
+        scheduler = make_scheduler(separation=1)
+        scheduler.stream = ScheduleStream(os.path.join(tmp, 'first.yaml'))
+        scheduler.checkpoint_file = path
+        scheduler.checkpoint_interval = 0
+
+        def on_progress(event):
+            if event['event'] == 'round' and event['matches'] >= 6:
+                raise KeyboardInterrupt
+        scheduler.on_progress = on_progress
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            pass
+        scheduler.stream.close()
+
+        resumed = make_scheduler(separation=1, random=random.Random(0))
+        resumed.stream = ScheduleStream(os.path.join(tmp, 'resumed.yaml'))
+        output = resumed.run(load_checkpoint(path))
+        resumed.stream.close()
+
+    assert games(output) == games(expected)
+
+
+def test_stream_takes_back_matches():
+    import yaml
+
+    from sr.comp.cli.league_stream import ScheduleStream
+
+    with temp_dir() as tmp:
+        path = os.path.join(tmp, 'league.yaml')
+        stream = ScheduleStream(path)
+        for match_id in range(3):
+            stream.write(match_id,
+                         {'main': ['T{0:02}'.format(match_id), None]})
+        stream.truncate(1)
+        stream.write(1, {'main': [None, 'T05']})
+        stream.close()
+
+        with open(path) as f:
+            matches = yaml.safe_load(f)['matches']
+    assert matches == {0: {'main': ['T00', None]},
+                       1: {'main': [None, 'T05']}}
+
+
+def live_schedule(scheduler):
+    output = scheduler.run()
+    return [output[n]['main'] for n in range(len(output))]
+
+
+def test_reschedule_keeps_valid_matches():
+    matches = live_schedule(make_scheduler(separation=1))
+    # A team drops out, leaving gaps in its remaining matches
+    remaining = [[None if team == 'T05' else team for team in match]
+                 for match in matches]
+    teams = ['T{0:02}'.format(n) for n in range(12) if n != 5]
+    scheduler = make_scheduler(teams=teams, separation=1,
+                               base_matches=matches[:4] + remaining[4:])
+
+    output = scheduler.reschedule(4, 0)
+
+    assert [output[n]['main'] for n in range(12)] == matches[:4] + remaining[4:]
+    assert scheduler.stats['ticks'] == 0
+
+
+def test_reschedule_repairs_before_searching():
+    matches = live_schedule(make_scheduler(separation=1))
+    # Moving a team which played in match 5 into match 6 (swapping it with
+    # someone else in its round) makes it play twice in a row
+    broken = [list(match) for match in matches]
+    later = next(n for n in (7, 8) if set(broken[n]) & set(broken[5]))
+    team = (set(broken[later]) & set(broken[5])).pop()
+    position = broken[later].index(team)
+    broken[later][position], broken[6][0] = broken[6][0], team
+    scheduler = make_scheduler(separation=1, base_matches=broken)
+    assert not scheduler._validate(scheduler._base_matches)
+
+    output = scheduler.reschedule(4, 5)
+
+    rescheduled = [output[n]['main'] for n in range(12)]
+    assert rescheduled[:4] == broken[:4]
+    assert scheduler.stats['ticks'] == 0
+    assert scheduler._validate([scheduler._encode_match(match)
+                                for match in rescheduled])
+
+
+def test_reschedule_searches_for_new_teams():
+    matches = live_schedule(make_scheduler(separation=1))
+    teams = ['T{0:02}'.format(n) for n in range(13)]
+    scheduler = make_scheduler(teams=teams, separation=1, max_match_periods=16,
+                               base_matches=matches)
+
+    output = scheduler.reschedule(4, 5)
+
+    assert [output[n]['main'] for n in range(4)] == matches[:4]
+    assert any('T12' in output[n]['main'] for n in range(4, len(output)))
+
+
+def test_batch_with_team_only_in_base_matches():
+    base = [['T00', 'T01', 'T02', 'XXX'],
+            ['T04', 'T05', 'T06', 'T07'],
+            ['T08', 'T09', 'T10', 'T11']]
+    scheduler = make_scheduler(separation=1, max_match_periods=15,
+                               base_matches=base, strategy='batch')
+    output = scheduler.run()
+
+    assert [output[n]['main'] for n in range(3)] == base
+    schedule = [scheduler._encode_match(output[n]['main'])
+                for n in range(len(output))]
+    assert scheduler._validate(schedule, scheduler._matchup_limit)
+    assert not any('XXX' in output[n]['main'] for n in range(3, len(output)))
+
+
+def test_reschedule_warns_when_league_gets_shorter():
+    from sr.comp.cli.schedule_league import count_changed_matches
+
+    matches = live_schedule(make_scheduler(separation=1, max_match_periods=15))
+    teams = ['T{0:02}'.format(n) for n in range(13)]
+    scheduler = make_scheduler(teams=teams, separation=1, max_match_periods=15,
+                               base_matches=matches)
+    messages = []
+    scheduler.lprint = lambda *args, **kwargs: messages.append(' '.join(args))
+
+    output = scheduler.reschedule(4, 1)
+
+    assert len(output) < len(matches)
+    assert any('fewer than the 15 before' in message for message in messages)
+    changed = count_changed_matches(matches, output, ['main'], 4)
+    assert changed >= len(matches) - len(output), "Dropped matches have changed"
+
+
+def test_clear_errors_without_numpy():
+    import sys
+
+    with mock.patch.dict(sys.modules, {'numpy': None}):
+        try:
+            make_scheduler(strategy='batch')
+        except ImportError as e:
+            assert 'sr.comp.cli[league]' in str(e)
+        else:
+            assert False, "The batch strategy should need numpy"
+
+
+def test_lcg_search_without_numpy():
+    import sys
+
+    for num_teams in (12, 30, 48):
+        scheduler = make_scheduler(teams=['T{0:02}'.format(n)
+                                          for n in range(num_teams)],
+                                   separation=2)
+        expected = scheduler._search_lcg_params()
+        with mock.patch.dict(sys.modules, {'numpy': None}):
+            assert scheduler._search_lcg_params() == expected, num_teams
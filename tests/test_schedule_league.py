@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+
+import mock
+
+from sr.comp.cli.schedule_league import (command, count_changed_matches,
+                                         league_matches, live_cut_over)
+
+
+START = datetime(2016, 4, 16, 10, 0)
+
+
+def make_match(num, arena, teams, match_type='league'):
+    return mock.Mock(num=num, arena=arena, teams=teams,
+                     start_time=START + timedelta(minutes=5 * num),
+                     type=mock.Mock(value=match_type))
+
+
+def make_comp(num_matches, scored=()):
+    comp = mock.Mock(timezone=None)
+    comp.schedule.matches = [
+        {arena: make_match(num, arena, ['{0}{1}'.format(arena, num), None],
+                           'league' if num < num_matches - 1 else 'knockout')
+         for arena in ('A', 'B')}
+        for num in range(num_matches)]
+    comp.scores.league.game_points = dict((('A', num), {}) for num in scored)
+    return comp
+
+
+def frozen_time(now):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now
+    return mock.patch('datetime.datetime', FrozenDatetime)
+
+
+def test_cut_over_after_scored_matches():
+    comp = make_comp(12, scored=[0, 1, 2])
+
+    # Before the matches start, only the scored matches are kept
+    with frozen_time(START - timedelta(hours=1)):
+        assert live_cut_over(comp, timedelta(minutes=10)) == 3
+
+
+def test_cut_over_includes_matches_about_to_start():
+    comp = make_comp(12, scored=[0, 1])
+
+    with frozen_time(START + timedelta(minutes=21)):
+        # Matches 4 to 6 start by 10:31, so can't be changed
+        assert live_cut_over(comp, timedelta(minutes=10)) == 7
+        assert live_cut_over(comp, timedelta(0)) == 5
+        # The knockout match at the end doesn't count
+        assert live_cut_over(comp, timedelta(hours=2)) == 11
+
+
+def test_league_matches_and_changes():
+    comp = make_comp(4)
+    matches = league_matches(comp, ['A', 'B'])
+
+    assert matches == [['A0', None, 'B0', None],
+                       ['A1', None, 'B1', None],
+                       ['A2', None, 'B2', None]]
+
+    new = dict((num, {'A': matches[num][:2], 'B': matches[num][2:]})
+               for num in range(3))
+    new[2]['B'] = [None, 'B2']
+    assert count_changed_matches(matches, new, ['A', 'B'], 1) == 1
+
+
+def test_count_changed_matches_with_different_lengths():
+    old = [['A0', 'B0'], ['A1', 'B1'], ['A2', 'B2'], ['A3', 'B3']]
+    shorter = {0: {'A': ['A0'], 'B': ['B0']}, 1: {'A': ['A1'], 'B': ['B1']},
+               2: {'A': ['A2'], 'B': ['B2']}}
+    longer = dict(shorter)
+    longer[3] = {'A': ['A3'], 'B': ['B3']}
+    longer[4] = {'A': ['A4'], 'B': ['B4']}
+
+    assert count_changed_matches(old, shorter, ['A', 'B'], 1) == 1
+    assert count_changed_matches(old, longer, ['A', 'B'], 1) == 1
+
+
+def test_time_limit_is_not_coordinated():
+    args = mock.Mock(checkpoint=None, resume=None, live=False, stream=None,
+                     repair=None, parallel=1, time_limit=60,
+                     coordinate='0.0.0.0:9000')
+
+    with mock.patch('sys.stdout'):
+        try:
+            command(args)
+        except SystemExit as e:
+            assert e.code == 1
+        else:
+            assert False, "Should refuse a time limit when coordinating"
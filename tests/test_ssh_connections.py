@@ -0,0 +1,172 @@
+import os
+import subprocess
+
+import mock
+
+from sr.comp.cli.ssh_connections import SSHConnections
+
+from utils import temp_dir
+
+
+class LocalChannel(object):
+    """Stands in for a paramiko channel, running commands locally."""
+
+    def exec_command(self, command):
+        self.process = subprocess.Popen(command, shell=True,
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+
+    def sendall(self, data):
+        self.process.stdin.write(data)
+        self.process.stdin.flush()
+
+    def shutdown_write(self):
+        self.process.stdin.close()
+
+    def recv(self, size):
+        return os.read(self.process.stdout.fileno(), size)
+
+    def recv_stderr(self, size):
+        return os.read(self.process.stderr.fileno(), size)
+
+    def recv_exit_status(self):
+        return self.process.wait()
+
+    def close(self):
+        self.process.stdout.close()
+        self.process.stderr.close()
+
+
+class LocalClient(object):
+    def __init__(self, host):
+        self.host = host
+        self.channels = 0
+        self.transport = mock.Mock()
+        self.transport.is_active.return_value = True
+        self.transport.open_session.side_effect = self.open_session
+
+    def open_session(self):
+        self.channels += 1
+        return LocalChannel()
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.transport.is_active.return_value = False
+
+
+def git(cwd, *args):
+    return subprocess.check_output(('git',) + args, cwd=cwd).decode('utf-8').strip()
+
+
+def make_repo(tmp):
+    source = os.path.join(tmp, 'source')
+    os.mkdir(source)
+    git(source, 'init', '-q')
+    git(source, 'config', 'user.name', 'Test')
+    git(source, 'config', 'user.email', 'test@example.com')
+    with open(os.path.join(source, 'schedule.yaml'), 'w') as f:
+        f.write('delays: []\n')
+    git(source, 'add', 'schedule.yaml')
+    git(source, 'commit', '-q', '-m', 'Initial')
+    return source
+
+
+def test_connections_are_reused():
+    connect = mock.Mock(side_effect=LocalClient)
+
+    with SSHConnections(connect) as connections:
+        first = connections.client('alpha')
+        assert connections.client('alpha') is first
+        connections.client('beta')
+
+    assert connect.call_count == 2
+    assert not first.transport.is_active(), "Should close the connections"
+
+
+def test_reconnects_when_connection_drops():
+    connect = mock.Mock(side_effect=LocalClient)
+
+    with SSHConnections(connect) as connections:
+        first = connections.client('alpha')
+        first.transport.is_active.return_value = False
+        assert connections.client('alpha') is not first
+
+    assert connect.call_count == 2
+
+
+def test_git_push_runs_over_existing_connection():
+    connect = mock.Mock(side_effect=LocalClient)
+    with temp_dir() as tmp:
+        source = make_repo(tmp)
+        target = os.path.join(tmp, 'target.git')
+        git(tmp, 'init', '-q', '--bare', target)
+        revision = git(source, 'rev-parse', 'HEAD')
+
+        with SSHConnections(connect) as connections, \
+                connections.git_over_ssh(['alpha']):
+            client = connections.client('alpha')
+            url = 'ssh://srcomp@alpha{0}'.format(target)
+            git(source, 'push', '-q', url,
+                '{0}:refs/heads/deploy-{0}'.format(revision))
+
+        assert git(target, 'rev-parse', 'deploy-' + revision) == revision
+
+    assert 'SRCOMP_SSH_RELAY_PORT' not in os.environ, "Should restore the environment"
+    assert connect.call_count == 1, "Should reuse the connection for the push"
+    assert client.channels == 1
+
+
+def test_git_push_reports_failure():
+    connect = mock.Mock(side_effect=LocalClient)
+    with temp_dir() as tmp:
+        source = make_repo(tmp)
+        missing = os.path.join(tmp, 'missing.git')
+
+        with SSHConnections(connect) as connections, \
+                connections.git_over_ssh(['alpha']):
+            process = subprocess.Popen(['git', 'push', '-q',
+                                        'ssh://srcomp@alpha{0}'.format(missing),
+                                        'HEAD:refs/heads/deploy'],
+                                       cwd=source, stderr=subprocess.PIPE)
+            _, stderr = process.communicate()
+
+    assert process.returncode != 0
+    assert b'missing.git' in stderr
+
+
+FAKE_SSH = '''#!/bin/sh
+for last; do destination=$command; command=$last; done
+echo "$destination" >> "$FAKE_SSH_LOG"
+exec sh -c "$command"
+'''
+
+
+def test_git_uses_own_ssh_for_other_hosts():
+    connect = mock.Mock(side_effect=LocalClient)
+    with temp_dir() as tmp:
+        source = make_repo(tmp)
+        target = os.path.join(tmp, 'target.git')
+        git(tmp, 'init', '-q', '--bare', target)
+        fake_ssh = os.path.join(tmp, 'fake-ssh')
+        with open(fake_ssh, 'w') as f:
+            f.write(FAKE_SSH)
+        os.chmod(fake_ssh, 0o755)
+        log = os.path.join(tmp, 'ssh.log')
+
+        with mock.patch.dict(os.environ, {'GIT_SSH_COMMAND': fake_ssh,
+                                          'FAKE_SSH_LOG': log}), \
+                SSHConnections(connect) as connections, \
+                connections.git_over_ssh(['alpha']):
+            # Neither a different host nor a different user should be relayed
+            for url in ('ssh://git@other{0}', 'ssh://git@alpha{0}'):
+                git(source, 'push', '-q', url.format(target),
+                    'HEAD:refs/heads/deploy')
+
+        with open(log) as f:
+            destinations = f.read().splitlines()
+
+    assert not connect.called, "Should not relay connections to other hosts"
+    assert destinations == ['git@other', 'git@alpha']
@@ -0,0 +1,30 @@
+import random
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+
+@contextmanager
+def temp_dir():
+    path = tempfile.mkdtemp()
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path)
+
+
+def make_scheduler(num_teams=12, **kwargs):
+    """
+    A quiet, reproducible league scheduler, which only uses the LCG or the
+    constructions if asked to.
+    """
+    from sr.comp.cli.league_scheduler import Scheduler
+
+    teams = kwargs.pop('teams', ['T{0:02}'.format(n) for n in range(num_teams)])
+    kwargs.setdefault('max_match_periods', 12)
+    kwargs.setdefault('random', random.Random(42))
+    kwargs.setdefault('enable_lcg', False)
+    kwargs.setdefault('construct', False)
+    scheduler = Scheduler(teams, **kwargs)
+    scheduler.lprint = lambda *args, **kwargs: None
+    return scheduler